@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares two benchmark results by their median times.
+
+Results are given as files or as commits (any prefix) found in
+benchmarks/results. Without arguments the two most recent results are
+compared.
+
+    python3 benchmarks/compare.py 1a2b3c HEAD --threshold 0.1 --fail
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def resolve(name):
+    if os.path.exists(name):
+        return name
+    commit = subprocess.run(["git", "rev-parse", name], cwd=os.path.dirname(RESULTS), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip() or name
+    matches = sorted(glob.glob(os.path.join(RESULTS, f"{commit[:12]}*.json")))
+    if not matches:
+        sys.exit(f"no results for {name} in {RESULTS}")
+    return matches[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", nargs="?", help="results file or commit")
+    parser.add_argument("candidate", nargs="?", help="results file or commit")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as a regression")
+    parser.add_argument("--fail", action="store_true", help="exit with 1 when there are regressions")
+    args = parser.parse_args()
+    if args.baseline and args.candidate:
+        paths = [resolve(args.baseline), resolve(args.candidate)]
+    else:
+        paths = sorted(glob.glob(os.path.join(RESULTS, "*.json")), key=os.path.getmtime)[-2:]
+        if len(paths) < 2:
+            sys.exit(f"need two results in {RESULTS} or two arguments")
+    baseline, candidate = [json.load(open(path)) for path in paths]
+    for key in ("tools", "design", "cpus"):
+        if baseline.get(key) != candidate.get(key):
+            print(f"warning: {key} differs ({baseline.get(key)} vs {candidate.get(key)})")
+    print(f"{'benchmark':20} {baseline['commit'][:10]:>10} {candidate['commit'][:10]:>10}   change")
+    regressions = []
+    for name in sorted(set(baseline["results"]) | set(candidate["results"])):
+        old = baseline["results"].get(name)
+        new = candidate["results"].get(name)
+        if not old or not new:
+            old_median = f"{old['median']:.3f}" if old else "-"
+            new_median = f"{new['median']:.3f}" if new else "-"
+            print(f"{name:20} {old_median:>10} {new_median:>10}")
+            continue
+        change = new["median"] / old["median"] - 1 if old["median"] else 0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif new["failed"] > old["failed"]:
+            flag = "  FAILING"
+            regressions.append(name)
+        print(f"{name:20} {old['median']:10.3f} {new['median']:10.3f}   {change:+7.1%}{flag}")
+    if regressions and args.fail:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
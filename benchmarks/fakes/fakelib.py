@@ -0,0 +1,113 @@
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared by the stand-in tools: they really read their inputs and write
+outputs of a size that follows the inputs, so the I/O and the wrapper
+around them cost about what they would with the real tools, only the
+geometry work itself is skipped."""
+import hashlib
+import struct
+from collections import Counter
+
+CHUNK = 1 << 20
+
+
+def read_file(path):
+    """Reads path through and returns its size; hashing it stands in for
+    the parsing work of the real tool."""
+    digest = hashlib.sha1()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def gds_records(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + 4 <= len(data):
+        length, kind = struct.unpack_from(">HB", data, offset)
+        if length < 4:
+            break
+        yield kind, data[offset + 4:offset + length]
+        offset += length
+
+
+def gds_cells(path):
+    return [payload.rstrip(b"\0").decode() for kind, payload in gds_records(path) if kind == 0x06]
+
+
+def gds_shapes(path):
+    """Counter of (cell, layer, datatype, xy bytes) over the boundaries."""
+    shapes = Counter()
+    cell = layer = datatype = None
+    for kind, payload in gds_records(path):
+        if kind == 0x06:
+            cell = payload.rstrip(b"\0").decode()
+        elif kind == 0x0D:
+            layer = struct.unpack(">h", payload[:2])[0]
+        elif kind == 0x0E:
+            datatype = struct.unpack(">h", payload[:2])[0]
+        elif kind == 0x10 and layer is not None:
+            shapes[(cell, layer, datatype, bytes(payload))] += 1
+        elif kind == 0x11:
+            layer = datatype = None
+    return shapes
+
+
+def gds_record(kind, datatype, payload=b""):
+    return struct.pack(">HBB", 4 + len(payload), kind, datatype) + payload
+
+
+def gds_string(kind, value):
+    data = value.encode()
+    if len(data) % 2:
+        data += b"\0"
+    return gds_record(kind, 6, data)
+
+
+# 1e-3 um user units and 1e-9 m database units as GDSII reals
+UNITS = bytes.fromhex("3e4189374bc6a7f0") + bytes.fromhex("3944b82fa09b5a54")
+
+
+def write_gds(path, cell, shapes=(), size=0):
+    """Writes a valid gds with one cell holding shapes, a list of (layer,
+    datatype, xy bytes), padded with filler rectangles up to about size
+    bytes."""
+    with open(path, "wb") as f:
+        f.write(gds_record(0x00, 2, struct.pack(">h", 600)) + gds_record(0x01, 2, bytes(24)))
+        f.write(gds_string(0x02, cell) + gds_record(0x03, 5, UNITS))
+        f.write(gds_record(0x05, 2, bytes(24)) + gds_string(0x06, cell))
+        written = 0
+        filler = struct.pack(">10i", 0, 0, 100, 0, 100, 100, 0, 100, 0, 0)
+        shapes = list(shapes)
+        while written < size or shapes:
+            layer, datatype, xy = shapes.pop() if shapes else (235, 0, filler)
+            element = (
+                gds_record(0x08, 0) + gds_record(0x0D, 2, struct.pack(">h", layer))
+                + gds_record(0x0E, 2, struct.pack(">h", datatype)) + gds_record(0x10, 3, xy) + gds_record(0x11, 0)
+            )
+            f.write(element)
+            written += len(element)
+        f.write(gds_record(0x07, 0) + gds_record(0x04, 0))
+
+
+def write_text(path, header, line, size):
+    """Writes header and then copies of line up to about size bytes."""
+    with open(path, "w") as f:
+        f.write(header)
+        for _ in range(max(0, size // max(1, len(line)))):
+            f.write(line)
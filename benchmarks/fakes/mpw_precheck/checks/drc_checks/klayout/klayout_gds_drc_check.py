@@ -0,0 +1,66 @@
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stand-in for the precheck klayout DRC: reports every 97th rectangle of
+the layers a deck covers as a violation, in a klayout report database."""
+import argparse
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), *[os.pardir] * 4))
+
+import fakelib  # noqa: E402
+
+RULES = {66: "licon.1", 67: "li.1", 68: "m1.2", 69: "m2.2", 70: "m3.2"}
+DECKS = {"feol": lambda layer: layer < 67, "beol": lambda layer: layer >= 67, "offgrid": lambda layer: True}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--gds_input_file_path", required=True)
+    parser.add_argument("-o", "--output_directory", required=True)
+    parser.add_argument("-f", "--feol", action="store_true")
+    parser.add_argument("-b", "--beol", action="store_true")
+    parser.add_argument("-og", "--offgrid", action="store_true")
+    args = parser.parse_args()
+    decks = [deck for deck in DECKS if getattr(args, deck)]
+    design = os.path.splitext(os.path.basename(args.gds_input_file_path))[0]
+    items = []
+    categories = set()
+    for index, (cell, layer, _, xy) in enumerate(sorted(fakelib.gds_shapes(args.gds_input_file_path))):
+        if index % 97:
+            continue
+        for deck in decks:
+            if not DECKS[deck](layer):
+                continue
+            rule = f"{RULES.get(layer, 'x')}{'.og' if deck == 'offgrid' else ''}"
+            categories.add(rule)
+            x0, y0, x1, _, _, y1 = [value / 1000 for value in struct.unpack(">6i", xy[:24])]
+            items.append((rule, cell, f"polygon: ({x0},{y0};{x0},{y1};{x1},{y1};{x1},{y0})"))
+    name = "_".join(decks)
+    with open(os.path.join(args.output_directory, "outputs", "reports", f"{design}_{name}.lyrdb"), "w") as f:
+        f.write(f'<?xml version="1.0" encoding="utf-8"?>\n<report-database>\n<description>{name}</description>\n<top-cell>{design}</top-cell>\n<categories>\n')
+        for rule in sorted(categories):
+            f.write(f"<category><name>{rule}</name><description>{rule}</description><categories/></category>\n")
+        f.write("</categories>\n<cells>\n")
+        for cell in sorted({cell for _, cell, _ in items}):
+            f.write(f"<cell><name>{cell}</name><variant/><references/></cell>\n")
+        f.write("</cells>\n<items>\n")
+        for rule, cell, value in items:
+            f.write(f"<item><tags/><category>'{rule}'</category><cell>{cell}</cell><visited>false</visited><multiplicity>1</multiplicity><values><value>{value}</value></values></item>\n")
+        f.write("</items>\n</report-database>\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stand-in for the precheck LVS: reads the design gds and netlist and
+writes an extraction and a report of matching size."""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), *[os.pardir] * 3))
+
+import fakelib  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--design_directory", required=True)
+    parser.add_argument("-o", "--output_directory", required=True)
+    parser.add_argument("-d", "--design_name", required=True)
+    parser.add_argument("-c", "--config_file", required=True)
+    parser.add_argument("-p", "--pdk_path", required=True)
+    parser.add_argument("-t", "--tag")
+    args = parser.parse_args()
+    size = 0
+    for view in (f"gds/{args.design_name}.gds", f"verilog/gl/{args.design_name}.v"):
+        path = os.path.join(args.design_directory, view)
+        if os.path.exists(path):
+            size += fakelib.read_file(path)
+    output = os.path.join(args.output_directory, args.design_name)
+    if not args.tag:
+        fakelib.write_text(os.path.join(output, f"{args.design_name}.spice"), "* extracted\n", "M1 a b c d nfet\n", size // 4)
+    fakelib.write_text(os.path.join(output, f"{args.design_name}.lvs.log"), "Circuits match uniquely.\n", "", 0)
+
+
+if __name__ == "__main__":
+    main()
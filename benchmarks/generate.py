@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Generates synthetic GDS, DEF and MAG views of one design.
+
+The design has `cells` cells spread over `depth` hierarchy levels. Every
+cell holds `polygons` rectangles on sky130 layers and every cell above the
+leaves places `fanout` cells of the level below. The same seed always gives
+the same files.
+
+    python3 benchmarks/generate.py --name bench --cells 200 --depth 4 --polygons 500 --output /tmp/bench
+"""
+import argparse
+import os
+import random
+import struct
+
+# li1 up to met3 drawing layers, (gds layer, datatype, magic type)
+LAYERS = [(67, 20, "locali"), (68, 20, "metal1"), (69, 20, "metal2"), (70, 20, "metal3"), (66, 44, "licon"), (67, 44, "mcon")]
+DBU = 1000  # database units per um
+PITCH = 20  # um between placed cells
+
+SIZES = {
+    "small": dict(cells=20, depth=3, polygons=50, fanout=4),
+    "medium": dict(cells=200, depth=4, polygons=500, fanout=6),
+    "large": dict(cells=2000, depth=5, polygons=2000, fanout=8),
+}
+
+
+def record(kind, datatype, payload=b""):
+    return struct.pack(">HBB", 4 + len(payload), kind, datatype) + payload
+
+
+def string(kind, value):
+    data = value.encode()
+    if len(data) % 2:
+        data += b"\0"
+    return record(kind, 6, data)
+
+
+def int16(kind, *values):
+    return record(kind, 2, struct.pack(f">{len(values)}h", *values))
+
+
+def int32(kind, *values):
+    return record(kind, 3, struct.pack(f">{len(values)}i", *values))
+
+
+def real8(value):
+    if value == 0:
+        return b"\0" * 8
+    exponent = 64
+    while value >= 1:
+        value /= 16
+        exponent += 1
+    while value < 1 / 16:
+        value *= 16
+        exponent -= 1
+    return bytes([exponent]) + round(value * (1 << 56)).to_bytes(7, "big")
+
+
+class Design:
+    """Cells per level, from the leaves (level 0) up to the top cell."""
+
+    def __init__(self, name, cells, depth, polygons, fanout, seed=0, mutate=0):
+        self.name = name
+        self.random = random.Random(seed)
+        depth = max(1, depth)
+        cells = max(cells, depth)
+        self.levels = []
+        remaining = cells - 1
+        for level in range(depth - 1):
+            # every level has fewer cells than the one below it
+            count = max(1, remaining * (depth - level - 1) // sum(range(1, depth)))
+            self.levels.append([f"{name}_l{level}_c{index}" for index in range(count)])
+        self.levels.append([name])
+        self.shapes = {}
+        self.children = {}
+        for level, names in enumerate(self.levels):
+            for cell in names:
+                self.shapes[cell] = [self.rectangle() for _ in range(polygons)]
+                below = self.levels[level - 1] if level else []
+                self.children[cell] = [
+                    (self.random.choice(below), f"u{index}", (index % 10) * PITCH, (index // 10) * PITCH)
+                    for index in range(fanout if below else 0)
+                ]
+        # the top places every cell at least once so nothing is left unused
+        for level in range(len(self.levels) - 1):
+            placed = {child for parent in self.levels[level + 1] for child, _, _, _ in self.children[parent]}
+            for cell in self.levels[level]:
+                if cell not in placed:
+                    parent = self.random.choice(self.levels[level + 1])
+                    index = len(self.children[parent])
+                    self.children[parent].append((cell, f"u{index}", (index % 10) * PITCH, (index // 10) * PITCH))
+        # a revision of the same design differs in a few leaf rectangles
+        for _ in range(mutate):
+            shapes = self.shapes[self.random.choice(self.levels[0])]
+            if shapes:
+                shapes[self.random.randrange(len(shapes))] = self.rectangle()
+
+    def rectangle(self):
+        layer = self.random.choice(LAYERS)
+        x = self.random.randint(0, PITCH * DBU - 1000)
+        y = self.random.randint(0, PITCH * DBU - 1000)
+        width = self.random.randint(140, 1000)
+        height = self.random.randint(140, 1000)
+        return layer, (x, y, x + width, y + height)
+
+    def cells(self):
+        """Every cell, children before their parents."""
+        return [cell for names in self.levels for cell in names]
+
+    def write_gds(self, path):
+        with open(path, "wb") as f:
+            f.write(int16(0x00, 600) + int16(0x01, *[0] * 12) + string(0x02, self.name))
+            f.write(record(0x03, 5, real8(1 / DBU) + real8(1e-6 / DBU)))
+            for cell in self.cells():
+                f.write(int16(0x05, *[0] * 12) + string(0x06, cell))
+                for (layer, datatype, _), (x0, y0, x1, y1) in self.shapes[cell]:
+                    f.write(record(0x08, 0) + int16(0x0D, layer) + int16(0x0E, datatype))
+                    f.write(int32(0x10, x0, y0, x1, y0, x1, y1, x0, y1, x0, y0) + record(0x11, 0))
+                for child, _, x, y in self.children[cell]:
+                    f.write(record(0x0A, 0) + string(0x12, child) + int32(0x10, x * DBU, y * DBU) + record(0x11, 0))
+                f.write(record(0x07, 0))
+            f.write(record(0x04, 0))
+
+    def write_mag(self, directory):
+        for cell in self.cells():
+            by_type = {}
+            for (_, _, magic_type), box in self.shapes[cell]:
+                by_type.setdefault(magic_type, []).append(box)
+            with open(os.path.join(directory, f"{cell}.mag"), "w") as f:
+                f.write("magic\ntech sky130A\nmagscale 1 2\ntimestamp 0\n")
+                for magic_type, boxes in by_type.items():
+                    f.write(f"<< {magic_type} >>\n")
+                    for box in boxes:
+                        # magic internal units of 5 nm at magscale 1 2
+                        f.write("rect " + " ".join(str(value // 5) for value in box) + "\n")
+                for child, instance, x, y in self.children[cell]:
+                    f.write(f"use {child}  {instance}\n")
+                    f.write(f"timestamp 0\ntransform 1 0 {x * 200} 0 1 {y * 200}\n")
+                    f.write(f"box 0 0 {PITCH * 200} {PITCH * 200}\n")
+                f.write("<< end >>\n")
+
+    def write_def(self, path):
+        # the DEF flattens the top into placed instances of the leaf cells
+        leaves = self.levels[0]
+        components = [(f"inst{index}", self.random.choice(leaves)) for index in range(len(self.cells()) * 4)]
+        side = int(len(components) ** 0.5) + 1
+        with open(path, "w") as f:
+            f.write(f"VERSION 5.8 ;\nDIVIDERCHAR \"/\" ;\nBUSBITCHARS \"[]\" ;\nDESIGN {self.name} ;\nUNITS DISTANCE MICRONS {DBU} ;\n")
+            f.write(f"DIEAREA ( 0 0 ) ( {side * PITCH * DBU} {side * PITCH * DBU} ) ;\n")
+            f.write(f"COMPONENTS {len(components)} ;\n")
+            for index, (instance, master) in enumerate(components):
+                x, y = (index % side) * PITCH * DBU, (index // side) * PITCH * DBU
+                f.write(f"- {instance} {master} + PLACED ( {x} {y} ) N ;\n")
+            f.write("END COMPONENTS\n")
+            nets = components[1:]
+            f.write(f"NETS {len(nets)} ;\n")
+            for index, (instance, _) in enumerate(nets):
+                f.write(f"- net{index} ( {components[index][0]} A ) ( {instance} Y ) ;\n")
+            f.write("END NETS\nEND DESIGN\n")
+
+
+def generate(output, name="bench", cells=20, depth=3, polygons=50, fanout=4, seed=0, mutate=0):
+    """Writes <output>/gds/<name>.gds, <output>/mag/*.mag and
+    <output>/def/<name>.def and returns their paths."""
+    design = Design(name, cells, depth, polygons, fanout, seed, mutate)
+    paths = {}
+    for view in ("gds", "mag", "def"):
+        os.makedirs(os.path.join(output, view), exist_ok=True)
+    paths["gds"] = os.path.join(output, "gds", f"{name}.gds")
+    design.write_gds(paths["gds"])
+    design.write_mag(os.path.join(output, "mag"))
+    paths["mag"] = os.path.join(output, "mag", f"{name}.mag")
+    paths["def"] = os.path.join(output, "def", f"{name}.def")
+    design.write_def(paths["def"])
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="directory receiving the gds, mag and def directories")
+    parser.add_argument("--name", default="bench", help="top cell and file name")
+    parser.add_argument("--size", choices=SIZES, default="small", help="preset for the options below")
+    parser.add_argument("--cells", type=int, help="number of cells")
+    parser.add_argument("--depth", type=int, help="hierarchy levels, top included")
+    parser.add_argument("--polygons", type=int, help="rectangles per cell")
+    parser.add_argument("--fanout", type=int, help="instances per cell above the leaves")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mutate", type=int, default=0, help="rectangles changed in leaf cells, for a second revision to xor against")
+    args = parser.parse_args()
+    options = dict(SIZES[args.size])
+    for key in options:
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    for view, path in generate(args.output, args.name, seed=args.seed, mutate=args.mutate, **options).items():
+        print(f"{view} : {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Times every utilities command on a synthetic design.
+
+By default the commands run against the stand-in tools of benchmarks/fakes
+(magic, klayout and a precheck checkout), which read and write files like
+the real ones, so the wrapper, scheduling, caching and parsing costs can be
+measured anywhere. With --real the installed tools and precheck are used.
+The results are written as JSON to benchmarks/results/<commit>.json, see
+compare.py.
+
+    python3 benchmarks/run.py --size medium --repeat 5
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+FAKES = os.path.join(BENCHMARKS, "fakes")
+RESULTS = os.path.join(BENCHMARKS, "results")
+sys.path.insert(0, ROOT)
+
+from generate import SIZES, generate  # noqa: E402
+from utilities.batch import job_args  # noqa: E402
+from utilities.manage import batch_cmd, commands, stats_cmd  # noqa: E402
+
+BATCH_JOBS = 8
+
+
+def cases(paths, pdk_root, pdk):
+    """(name, command, input, options, setup) for every benchmark; setup is
+    the name of a case run once beforehand."""
+    pdk_options = {"pdk_root": pdk_root, "pdk": pdk, "output": "out"}
+    gds, mag, def_ = paths["gds"], paths["mag"], paths["def"]
+    design = os.path.splitext(os.path.basename(gds))[0]
+    return [
+        ("gds-info", "gds-info", gds, {}, None),
+        ("gds-to-mag", "gds-to-mag", gds, pdk_options, None),
+        ("gds-to-mag-cached", "gds-to-mag", gds, dict(pdk_options, use_cache=True), "gds-to-mag-cached"),
+        ("gds-to-mag-pool", "gds-to-mag", gds, dict(pdk_options, use_pool=True), None),
+        ("gds-to-def", "gds-to-def", gds, pdk_options, None),
+        ("gds-to-lef", "gds-to-lef", gds, pdk_options, None),
+        ("mag-to-gds", "mag-to-gds", mag, pdk_options, None),
+        ("mag-to-gds-incremental", "mag-to-gds", mag, dict(pdk_options, incremental=True, mag_dir=os.path.dirname(mag)), "mag-to-gds-incremental"),
+        ("mag-to-def", "mag-to-def", mag, pdk_options, None),
+        ("mag-to-lef", "mag-to-lef", mag, pdk_options, None),
+        ("def-to-gds", "def-to-gds", def_, pdk_options, None),
+        ("def-to-mag", "def-to-mag", def_, pdk_options, None),
+        ("def-to-lef", "def-to-lef", def_, pdk_options, None),
+        ("def-to-lef-native", "def-to-lef", def_, dict(pdk_options, backend="native"), None),
+        ("convert", "convert", gds, dict(pdk_options, targets="mag,lef,def"), None),
+        ("xor", "xor", design, {"design1": gds, "design2": paths["revision"]}, None),
+        ("xor-prefilter", "xor", design, {"design1": gds, "design2": paths["revision"], "prefilter": True}, None),
+        ("xor-per-layer", "xor", design, {"design1": gds, "design2": paths["revision"], "per_layer": True, "processes": 4}, None),
+        ("drc", "drc", gds, {"output": "drc"}, None),
+        ("drc-sharded", "drc", gds, {"output": "drc", "sharded": True}, None),
+        ("lvs", "lvs", design, dict(pdk_options, design_dir=paths["design_dir"], config_file=paths["lvs_config"]), None),
+        ("batch", "batch", paths["manifest"], {"processes": BATCH_JOBS}, None),
+        ("batch-pool", "batch", paths["manifest"], {"processes": BATCH_JOBS, "use_pool": True}, None),
+        ("report-query", "report", None, {}, "drc"),
+        ("stats", "stats", paths["telemetry"], {}, None),
+        ("cache-stats", "cache", None, {}, "gds-to-mag-cached"),
+    ]
+
+
+def command_line(command, input_file, options):
+    if command == "report":
+        return ["report", "query", "drc/outputs/reports/drc.db", "--counts"]
+    if command == "cache":
+        return ["cache", "stats"]
+    job = {"name": command, "command": command, "input": input_file, "options": options}
+    return [command, *job_args(dict(commands, batch=batch_cmd, stats=stats_cmd)[command], job)]
+
+
+def prepare_inputs(work, size, pdk_root, pdk):
+    paths = generate(os.path.join(work, "design"), "bench", **size)
+    paths["revision"] = generate(os.path.join(work, "revision"), "bench", mutate=3, **size)["gds"]
+    design_dir = os.path.join(work, "design")
+    os.makedirs(os.path.join(design_dir, "verilog", "gl"), exist_ok=True)
+    with open(os.path.join(design_dir, "verilog", "gl", "bench.v"), "w") as f:
+        f.write("module bench ();\nendmodule\n")
+    paths["design_dir"] = design_dir
+    paths["lvs_config"] = os.path.join(work, "lvs_config.json")
+    with open(paths["lvs_config"], "w") as f:
+        json.dump({"TOP_SOURCE": "bench", "TOP_LAYOUT": "bench"}, f)
+    jobs = []
+    for index in range(BATCH_JOBS * 2):
+        copy = os.path.join(work, "batch", f"bench_{index}.gds")
+        os.makedirs(os.path.dirname(copy), exist_ok=True)
+        shutil.copy(paths["gds"], copy)
+        jobs.append({"name": f"bench_{index}", "command": "gds-to-mag", "input": copy, "options": {"output": "out", "pdk_root": pdk_root, "pdk": pdk}})
+    paths["manifest"] = os.path.join(work, "manifest.json")
+    with open(paths["manifest"], "w") as f:
+        json.dump({"jobs": jobs}, f)
+    paths["telemetry"] = os.path.join(work, "telemetry.jsonl")
+    with open(paths["telemetry"], "w") as f:
+        for index in range(5000):
+            f.write(json.dumps({
+                "command": "gds-to-mag", "tool": "magic", "input": f"macro_{index % 50}.gds", "input_bytes": 1 << 20,
+                "output_bytes": 1 << 19, "wall": 1.5, "cpu": 1.4, "max_rss_kb": 200000, "returncode": 0,
+                "phases": {"gds_read": 0.5, "mag_write": 1.0},
+            }) + "\n")
+    return paths
+
+
+def fake_pdk(work, pdk):
+    pdk_root = os.path.join(work, "pdk")
+    os.makedirs(os.path.join(pdk_root, pdk, "libs.tech", "magic"), exist_ok=True)
+    open(os.path.join(pdk_root, pdk, "libs.tech", "magic", f"{pdk}.magicrc"), "w").close()
+    for library in ("sky130_fd_sc_hd", "sky130_fd_sc_hvl"):
+        techlef = os.path.join(pdk_root, pdk, "libs.ref", library, "techlef")
+        os.makedirs(techlef, exist_ok=True)
+        with open(os.path.join(techlef, f"{library}__nom.tlef"), "w") as f:
+            f.write("VERSION 5.7 ;\nEND LIBRARY\n")
+    return pdk_root
+
+
+def environment(work, real):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT, env.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+    env["UTILITIES_CACHE_DIR"] = os.path.join(work, "cache")
+    env.pop("UTILITIES_TELEMETRY", None)
+    # rich would otherwise wrap the output to the width of the terminal
+    env["COLUMNS"] = "200"
+    if not real:
+        env["PATH"] = os.pathsep.join([FAKES, env["PATH"]])
+        home = os.path.join(work, "home")
+        os.makedirs(home, exist_ok=True)
+        if not os.path.exists(os.path.join(home, "mpw_precheck")):
+            os.symlink(os.path.join(FAKES, "mpw_precheck"), os.path.join(home, "mpw_precheck"))
+        env["HOME"] = home
+    return env
+
+
+def run_case(args, cwd, env):
+    os.makedirs(os.path.join(cwd, "out"), exist_ok=True)
+    os.makedirs(os.path.join(cwd, "drc"), exist_ok=True)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-m", "utilities", *args], cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return time.perf_counter() - start, process.returncode, process.stdout.decode(errors="replace")
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+
+    return git("rev-parse", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=SIZES, default="small", help="size of the synthetic design")
+    parser.add_argument("--cells", type=int)
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--polygons", type=int)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--only", action="append", help="glob of the benchmarks to run, can be repeated")
+    parser.add_argument("--real", action="store_true", help="use the installed magic, klayout and ~/mpw_precheck")
+    parser.add_argument("--pdk-root", help="pdk for --real runs")
+    parser.add_argument("--pdk", default="sky130A")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+    if args.real:
+        missing = [tool for tool in ("magic", "klayout") if not shutil.which(tool)]
+        if missing or not args.pdk_root:
+            sys.exit(f"--real needs {', '.join(missing) or 'magic and klayout'} on the PATH and --pdk-root")
+    size = dict(SIZES[args.size])
+    for key in ("cells", "depth", "polygons"):
+        if getattr(args, key) is not None:
+            size[key] = getattr(args, key)
+
+    work = tempfile.mkdtemp(prefix="utilities-bench-")
+    try:
+        pdk_root = os.path.abspath(args.pdk_root) if args.real else fake_pdk(work, args.pdk)
+        paths = prepare_inputs(work, size, pdk_root, args.pdk)
+        env = environment(work, args.real)
+        selected = [case for case in cases(paths, pdk_root, args.pdk) if not args.only or any(fnmatch.fnmatch(case[0], pattern) for pattern in args.only)]
+        results = {}
+        for name, command, input_file, options, setup in selected:
+            cwd = os.path.join(work, "runs", name)
+            os.makedirs(cwd, exist_ok=True)
+            command_args = command_line(command, input_file, options)
+            if setup:
+                setup_case = next(case for case in cases(paths, pdk_root, args.pdk) if case[0] == setup)
+                run_case(command_line(*setup_case[1:4]), cwd, env)
+            runs, failures = [], 0
+            for _ in range(args.repeat):
+                duration, returncode, output = run_case(command_args, cwd, env)
+                runs.append(duration)
+                if returncode:
+                    failures += 1
+                    last_output = output
+            results[name] = {
+                "command": command,
+                "args": command_args,
+                "runs": runs,
+                "min": min(runs),
+                "median": statistics.median(runs),
+                "mean": statistics.mean(runs),
+                "failed": failures,
+            }
+            status = f"FAILED {failures}/{args.repeat}" if failures else "ok"
+            print(f"{name:20} {results[name]['median']:8.3f}s  {status}")
+            if failures:
+                print("    " + "\n    ".join(last_output.strip().splitlines()[-5:]))
+    finally:
+        if args.keep:
+            print(f"work directory: {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "time": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "tools": "real" if args.real else "fake",
+        "design": size,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS, f"{commit[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
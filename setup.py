@@ -15,6 +15,7 @@ setup(
     author="Marwan Abbas",
     author_email="marwan.abbas@efabless.com",
     install_requires=requirements,
+    extras_require={"density": ["numpy"]},
     include_package_data=True,
     package_data={
         "utilities": ["helper_lib/*", "helper_lib/**/*", "helper_lib/**/**/*"],
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from utilities import cache
+
+FAKES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fakes")
+PDK = "sky130A"
+
+
+@pytest.fixture
+def pdk_root(tmp_path, monkeypatch):
+    """Puts the stand-in tools of the benchmarks on PATH and returns a pdk
+    root with the files they read. The result cache and scratch are under
+    tmp_path."""
+    pytest.importorskip("tkinter")
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / "mpw_precheck").symlink_to(os.path.join(FAKES, "mpw_precheck"))
+    monkeypatch.setenv("PATH", os.pathsep.join([FAKES, os.environ["PATH"]]))
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("UTILITIES_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("UTILITIES_SCRATCH", str(tmp_path / "scratch"))
+    monkeypatch.delenv("UTILITIES_TELEMETRY", raising=False)
+    monkeypatch.setattr(cache, "_cache", None)
+    root = tmp_path / "pdk"
+    magic = root / PDK / "libs.tech" / "magic"
+    magic.mkdir(parents=True)
+    (magic / f"{PDK}.magicrc").write_text("")
+    for library in ("sky130_fd_sc_hd", "sky130_fd_sc_hvl"):
+        techlef = root / PDK / "libs.ref" / library / "techlef"
+        techlef.mkdir(parents=True)
+        (techlef / f"{library}__nom.tlef").write_text("VERSION 5.7 ;\nEND LIBRARY\n")
+    return str(root)
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import pytest
+from conftest import FAKES
+from test_gds import library, rectangle, structure
+
+from utilities import api
+
+DRC_CHECK = os.path.join("checks", "drc_checks", "klayout", "klayout_gds_drc_check.py")
+
+
+@pytest.fixture
+def gds_file(tmp_path):
+    path = tmp_path / "top.gds"
+    path.write_bytes(library(structure("top", rectangle(68, 0, 0, 100, 100))))
+    return str(path)
+
+
+def precheck(tmp_path, monkeypatch, body):
+    """A precheck whose drc script runs body, in a home of its own."""
+    home = tmp_path / "drc_home"
+    script = home / "mpw_precheck" / DRC_CHECK
+    script.parent.mkdir(parents=True)
+    script.write_text(f"import runpy, sys\nREAL = {os.path.join(FAKES, 'mpw_precheck', DRC_CHECK)!r}\n{body}\n")
+    monkeypatch.setenv("HOME", str(home))
+
+
+def test_conversion(pdk_root, gds_file, tmp_path):
+    result = asyncio.run(api.gds_to_mag(gds_file, str(tmp_path), pdk_root, "sky130A"))
+    assert result.returncode == 0 and result.outputs == [str(tmp_path / "top.mag")]
+    assert os.path.exists(result.outputs[0]) and not result.details["cached"]
+
+
+def test_invalid_input(pdk_root, tmp_path):
+    with pytest.raises(api.InvalidInput):
+        asyncio.run(api.gds_to_mag(str(tmp_path / "missing.gds"), str(tmp_path), pdk_root, "sky130A"))
+
+
+def test_missing_tool(pdk_root, gds_file, tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with pytest.raises(api.RunFailed, match="can't run magic") as failed:
+        asyncio.run(api.gds_to_mag(gds_file, str(tmp_path), pdk_root, "sky130A"))
+    assert failed.value.result.returncode is None
+
+
+def test_drc_violations(pdk_root, gds_file, tmp_path, monkeypatch):
+    # like the real precheck, exits non-zero when it finds violations
+    precheck(tmp_path, monkeypatch, "sys.argv[0] = REAL\nrunpy.run_path(REAL, run_name='__main__')\nsys.exit(1)")
+    result = asyncio.run(api.drc(gds_file, str(tmp_path)))
+    report = str(tmp_path / "outputs" / "reports" / "top_feol_beol_offgrid.lyrdb")
+    assert result.returncode == 1 and result.outputs == [report]
+    # m1.2 from the beol and m1.2.og from the offgrid deck
+    assert result.details == {"violations": 2, "markers": {report: 2}}
+
+
+def test_drc_without_report(pdk_root, gds_file, tmp_path, monkeypatch):
+    precheck(tmp_path, monkeypatch, "sys.exit(2)")
+    with pytest.raises(api.RunFailed, match="without a report") as failed:
+        asyncio.run(api.drc(gds_file, str(tmp_path)))
+    assert failed.value.result.returncode == 2
+
+
+def test_timeout(pdk_root, gds_file, tmp_path, monkeypatch):
+    precheck(tmp_path, monkeypatch, "import time\ntime.sleep(30)")
+    with pytest.raises(api.RunTimeout):
+        asyncio.run(api.drc(gds_file, str(tmp_path), timeout=0.5))
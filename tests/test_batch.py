@@ -0,0 +1,70 @@
+import os
+import signal
+import time
+
+from utilities.batch import WorkerPool
+
+
+def square(value, delay=0.2):
+    time.sleep(delay)
+    return value * value
+
+
+def die(delay=0.05):
+    time.sleep(delay)
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def run(pool, tasks):
+    results = {}
+    tasks = list(tasks)
+    while tasks or len(pool):
+        while tasks and pool.free():
+            key, function, args = tasks.pop(0)
+            pool.submit(key, function, *args)
+        for key, result, error in pool.wait():
+            results[key] = (result, error)
+    return results
+
+
+def test_results():
+    with WorkerPool(2) as pool:
+        results = run(pool, [(value, square, (value, 0.01)) for value in range(5)])
+    assert results == {value: (value * value, None) for value in range(5)}
+
+
+def test_dead_worker_fails_its_job_only():
+    with WorkerPool(3) as pool:
+        results = run(pool, [("a", square, (2,)), ("dies", die, ()), ("b", square, (3,)), ("c", square, (4, 0.01))])
+    assert results["a"] == (4, None)
+    assert results["b"] == (9, None)
+    assert results["c"] == (16, None)
+    result, error = results["dies"]
+    assert result is None and error.startswith("worker died")
+
+
+def test_pool_keeps_working():
+    with WorkerPool(1) as pool:
+        results = run(pool, [("dies", die, ()), ("after", square, (5, 0.01))])
+    assert results["after"] == (25, None)
+    assert results["dies"][1]
+
+
+def fake_run_job(job, log_dir=None, flags=(), memory_cap=None):
+    if job["name"] == "oom":
+        die()
+    time.sleep(0.2)
+    return {"name": job["name"], "command": job["command"], "input": None, "status": "ok", "detail": "", "duration": 0.2}
+
+
+def test_batch_survives_dead_worker(monkeypatch, tmp_path):
+    from rich.console import Console
+
+    from utilities import batch
+
+    monkeypatch.setattr(batch, "run_job", fake_run_job)
+    monkeypatch.setenv("UTILITIES_TELEMETRY", str(tmp_path / "telemetry.jsonl"))
+    jobs = [{"name": name, "command": "drc", "input": None, "options": {}} for name in ("a", "oom", "b", "c")]
+    results = batch.run_batch(Console(quiet=True), jobs, processes=3, memory_budget=1 << 40)
+    assert [result["status"] for result in results] == ["ok", "failed", "ok", "ok"]
+    assert results[1]["detail"].startswith("worker died") and "estimated" in results[1]["detail"]
@@ -0,0 +1,119 @@
+import io
+import os
+
+import pytest
+from rich.console import Console
+
+from utilities import common
+from utilities.cache import ResultCache, parse_size
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [("123", 123), ("2K", 2048), ("1.5M", 3 << 19), ("10G", 10 << 30), ("10gb", 10 << 30), (" 1T ", 1 << 40), (512, 512)],
+)
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize("size", ["abc", "", "G", "1.5", "-1G", "10X"])
+def test_parse_invalid_size(size):
+    with pytest.raises(ValueError, match="invalid size"):
+        parse_size(size)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"), max_size="10K")
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_key(cache, tmp_path):
+    a = write(tmp_path / "a.gds", b"a")
+    b = write(tmp_path / "b.gds", b"b")
+    key = cache.key([a, b], {"TOP": "top"})
+    assert cache.key([a, b], {"TOP": "top"}) == key
+    # contents count, not paths or timestamps
+    assert cache.key([write(tmp_path / "copy.gds", b"a"), b], {"TOP": "top"}) == key
+    os.utime(a, (1, 1))
+    assert cache.key([a, b], {"TOP": "top"}) == key
+    assert cache.key([b, a], {"TOP": "top"}) != key
+    assert cache.key([a, b], {"TOP": "other"}) != key
+    write(tmp_path / "a.gds", b"changed")
+    assert cache.key([a, b], {"TOP": "top"}) != key
+
+
+def test_directory_key(cache, tmp_path):
+    directory = tmp_path / "mag"
+    (directory / "sub").mkdir(parents=True)
+    write(directory / "a.mag", b"a")
+    key = cache.key([str(directory)])
+    # magic doesn't descend into subdirectories
+    write(directory / "sub" / "b.mag", b"b")
+    assert cache.key([str(directory)]) == key
+    write(directory / "b.mag", b"b")
+    assert cache.key([str(directory)]) != key
+    # with suffixes only the files ending in one of them
+    key = cache.key([str(directory)], suffixes=(".mag",))
+    write(directory / "a.mag_to_gds.manifest.json", b"{}")
+    assert cache.key([str(directory)], suffixes=(".mag",)) == key
+    write(directory / "c.mag", b"c")
+    assert cache.key([str(directory)], suffixes=(".mag",)) != key
+
+
+def store(cache, tmp_path, name, size):
+    output = write(tmp_path / f"{name}.mag", b"x" * size)
+    cache.store(name, [output])
+    return output
+
+
+def test_fetch(cache, tmp_path):
+    output = store(cache, tmp_path, "k1", 100)
+    os.remove(output)
+    assert cache.fetch("k1", [output])
+    assert open(output, "rb").read() == b"x" * 100
+    assert not cache.fetch("k2", [output])
+
+
+def test_prune(cache, tmp_path):
+    for index, name in enumerate(("k1", "k2", "k3")):
+        store(cache, tmp_path, name, 3000)
+        os.utime(os.path.join(cache.entry(name), "manifest.json"), (index, index))
+    assert cache.stats()["entries"] == 3
+    # the least recently used entry goes first
+    removed, size = cache.prune("5K")
+    assert removed == 2 and size < 5 << 10
+    assert [key for key, _, _ in cache.entries()] == ["k3"]
+
+
+def test_store_prunes_over_max_size(cache, tmp_path, monkeypatch):
+    pruned = []
+    prune = cache.prune
+    monkeypatch.setattr(cache, "prune", lambda *args: pruned.append(1) or prune(*args))
+    store(cache, tmp_path, "k1", 3000)
+    # the size isn't tracked yet
+    assert len(pruned) == 1
+    store(cache, tmp_path, "k2", 3000)
+    store(cache, tmp_path, "k3", 3000)
+    assert len(pruned) == 1
+    store(cache, tmp_path, "k4", 3000)
+    assert len(pruned) == 2
+    assert cache.stats()["size"] <= cache.max_size
+    assert cache.track_size() == cache.stats()["size"]
+
+
+def test_hit_with_output_in_input_dir(pdk_root, tmp_path):
+    directory = tmp_path / "mag"
+    directory.mkdir()
+    (directory / "top.mag").write_text("magic\ntech sky130A\n")
+    output = io.StringIO()
+    console = Console(file=output)
+    for _ in range(2):
+        assert common.mag_to_gds(console, str(directory / "top.mag"), (), (), (), str(directory), pdk_root, "sky130A", None, use_cache=True) == 0
+    # the gds, log and manifest of the first run are no input of the second
+    assert "cache hit" in output.getvalue()
+    assert (directory / "top.gds").exists()
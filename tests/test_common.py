@@ -0,0 +1,223 @@
+import io
+import json
+import os
+import threading
+
+import pytest
+from rich.console import Console
+from test_gds import int16, int32, library, record, rectangle, sref, structure
+
+from utilities import common, gds
+from utilities.common import UtilitiesError
+
+CONSOLE = Console(quiet=True)
+
+
+@pytest.fixture
+def mag_design(tmp_path):
+    directory = tmp_path / "mag"
+    directory.mkdir()
+    (directory / "top.mag").write_text("magic\ntech sky130A\nuse leaf leaf_0\n")
+    cells = tmp_path / "cells"
+    cells.mkdir()
+    (cells / "leaf.mag").write_text("magic\ntech sky130A\n")
+    (tmp_path / "out").mkdir()
+    return tmp_path
+
+
+def test_convert_job(pdk_root, mag_design):
+    macro = mag_design / "ram.gds"
+    macro.write_bytes(library(structure("ram", rectangle(68, 0, 0, 10, 10))))
+    job = common.convert.prepare(
+        CONSOLE, str(mag_design / "mag" / "top.mag"), ["lef", "mag", "gds", "lef"], "sky130A", pdk_root, str(mag_design / "out"),
+        mag_dir=[str(mag_design / "cells")], gds_macro=[str(macro)],
+    )
+    # the source view is skipped, the others are written once each
+    assert {name: job.env[name] for name in ("SOURCE", "TO_GDS", "TO_MAG", "TO_LEF", "TO_DEF")} == {
+        "SOURCE": "mag", "TO_GDS": "1", "TO_MAG": "0", "TO_LEF": "1", "TO_DEF": "0",
+    }
+    assert [os.path.basename(output) for output in job.outputs] == ["top.lef", "top.gds"]
+    assert job.env["MAG_DIR"] == f'"{mag_design / "cells"}"'
+    assert job.env["GDS_MACRO"] == f'"{macro}"'
+    assert job.dependencies == [str(mag_design / "cells"), str(macro), str(mag_design / "mag")]
+
+
+def test_convert_nothing_to_do(pdk_root, mag_design):
+    with pytest.raises(UtilitiesError, match="already a mag"):
+        common.convert.prepare(CONSOLE, str(mag_design / "mag" / "top.mag"), ["mag"], "sky130A", pdk_root, str(mag_design / "out"))
+    with pytest.raises(UtilitiesError, match="unknown target"):
+        common.convert.prepare(CONSOLE, str(mag_design / "mag" / "top.mag"), ["gds", "spice"], "sky130A", pdk_root, str(mag_design / "out"))
+
+
+def test_convert(pdk_root, tmp_path):
+    gds_file = tmp_path / "top.gds"
+    gds_file.write_bytes(library(structure("top", rectangle(68, 0, 0, 100, 100))))
+    output = tmp_path / "out"
+    output.mkdir()
+    assert common.convert(CONSOLE, str(gds_file), ["mag", "gds", "lef"], "sky130A", pdk_root, str(output)) == 0
+    written = sorted(name for name in os.listdir(output) if not name.startswith("top.convert"))
+    assert written == ["top.lef", "top.mag"]
+    assert (output / "top.convert.manifest.json").exists()
+
+
+def test_lock_extraction(pdk_root, tmp_path):
+    gds_file = tmp_path / "top.gds"
+    gds_file.write_bytes(library(structure("top", rectangle(68, 0, 0, 10, 10))))
+    (tmp_path / "other.gds").write_bytes(gds_file.read_bytes())
+    jobs = []
+    for design, output in (("top", "a"), ("top", "b"), ("other", "a")):
+        (tmp_path / output).mkdir(exist_ok=True)
+        jobs.append(common.gds_to_def.prepare(CONSOLE, str(tmp_path / f"{design}.gds"), str(tmp_path / output), pdk_root, "sky130A"))
+    first, second, other = jobs
+    # runs of one design share their extraction directory, whatever the output
+    assert first.env["EXTRACT_DIR"] == second.env["EXTRACT_DIR"] != other.env["EXTRACT_DIR"]
+    locked = threading.Event()
+
+    def run_second():
+        common.lock_extraction(second).close()
+        locked.set()
+
+    lock = common.lock_extraction(first)
+    thread = threading.Thread(target=run_second)
+    thread.start()
+    try:
+        # another design isn't held up
+        common.lock_extraction(other).close()
+        assert not locked.wait(0.2)
+    finally:
+        lock.close()
+    assert locked.wait(5)
+    thread.join()
+    assert common.lock_extraction(common.MagicJob(pdk_root, "sky130A", "gds_to_mag.tcl", {}, [], [])) is None
+
+
+def bare_rectangle(layer, size):
+    """A boundary without a DATATYPE record."""
+    return record(gds.BOUNDARY, 0) + int16(gds.LAYER, layer) + int32(gds.XY, 0, 0, size, 0, size, size, 0, size, 0, 0) + record(gds.ENDEL, 0)
+
+
+def selected_shards(changed):
+    return [name for name, (_, depends) in common.DRC_SHARDS.items() if any(depends(layer) for layer in changed)]
+
+
+def test_drc_changes(tmp_path):
+    path = tmp_path / "top.gds"
+
+    def write(nwell=10, met2=10, met1=10):
+        path.write_bytes(library(structure("top", rectangle(64, 0, 0, nwell, 10), rectangle(69, 0, 0, met2, 10), bare_rectangle(68, met1))))
+
+    write()
+    hashes, changed = common.drc_changes(CONSOLE, str(path), {})
+    assert changed is None and set(hashes["layers"]) == {"64/20", "69/20", "68"}
+    # as read back from drc_state.json
+    state = json.loads(json.dumps(hashes))
+    write(met2=20)
+    _, changed = common.drc_changes(CONSOLE, str(path), state)
+    assert changed == {69} and selected_shards(changed) == ["beol", "offgrid"]
+    write(met1=20)
+    _, changed = common.drc_changes(CONSOLE, str(path), state)
+    assert changed == {68} and selected_shards(changed) == ["beol", "offgrid"]
+    write(nwell=20)
+    _, changed = common.drc_changes(CONSOLE, str(path), state)
+    assert changed == {64} and selected_shards(changed) == ["feol", "offgrid"]
+
+
+def test_drc_reuses_shards(pdk_root, tmp_path):
+    path = tmp_path / "top.gds"
+    output = tmp_path / "drc"
+    output.mkdir()
+
+    def run(met2):
+        # the stand-in precheck reports the first shape, on met2, so only
+        # the feol shard is clean
+        path.write_bytes(library(structure("a", rectangle(69, 0, 0, met2, 10)), structure("top", sref("a", 0, 0), rectangle(64, 0, 0, 10, 10))))
+        log = io.StringIO()
+        common.drc(Console(file=log, width=200), str(path), str(output), sharded=True, incremental=True)
+        return log.getvalue()
+
+    assert "reusing" not in run(10)
+    with open(output / "drc_state.json") as f:
+        assert json.load(f)["shards"] == {"feol": True, "beol": False, "offgrid": False}
+    log = run(20)
+    assert "feol : no relevant changes" in log
+    assert "beol : no relevant changes" not in log
+
+
+def test_lvs_reuses_extraction(pdk_root, tmp_path):
+    design = tmp_path / "design"
+    (design / "gds").mkdir(parents=True)
+    (design / "verilog" / "gl").mkdir(parents=True)
+    (design / "gds" / "top.gds").write_bytes(library(structure("top", rectangle(68, 0, 0, 10, 10))))
+    (design / "verilog" / "gl" / "top.v").write_text("module top; endmodule\n")
+    config = tmp_path / "lvs_config.json"
+    config.write_text("{}")
+    output = tmp_path / "lvs"
+    output.mkdir()
+
+    def reused():
+        log = io.StringIO()
+        assert common.lvs(Console(file=log, width=200), str(design), str(output), "top", str(config), pdk_root, "sky130A") == 0
+        return "reusing the extraction" in log.getvalue()
+
+    assert not reused()
+    assert reused()
+    # a change to the gds, the netlist or the config extracts again
+    for path, data in ((design / "gds" / "top.gds", library(structure("top"))), (design / "verilog" / "gl" / "top.v", b"module top(a); endmodule\n"), (config, b'{"a": 1}')):
+        path.write_bytes(data)
+        assert not reused(), path
+        assert reused(), path
+    # the tag of the recorded run, for its key only
+    key = common.lvs_extraction_key(str(design), "top", str(config), "sky130A")
+    assert common.lvs_reused_tag(str(output), "top", key) == "top"
+    assert common.lvs_reused_tag(str(output), "top", "other") is None
+
+
+def test_mag_to_gds_incremental(pdk_root, tmp_path):
+    design = tmp_path / "mag"
+    cells = tmp_path / "cells"
+    output = tmp_path / "out"
+    for directory in (design, cells, output):
+        directory.mkdir()
+    (design / "top.mag").write_text("magic\nuse a a_0\nuse b b_0\n")
+    (design / "a.mag").write_text("magic\nuse leaf leaf_0\n")
+    (cells / "b.mag").write_text("magic\n")
+    (cells / "leaf.mag").write_text("magic\n")
+
+    def run(compress_gds=None):
+        log = io.StringIO()
+        console = Console(file=log, width=200)
+        assert common.mag_to_gds_incremental(console, str(design / "top.mag"), (), [str(cells)], (), str(output), pdk_root, "sky130A", compress_gds) == 0
+        return log.getvalue()
+
+    assert "4 of 4 cells to stream, 0 from the cache" in run()
+    assert (output / "top.gds").exists()
+    assert "is up to date" in run()
+    # a cell and its ancestors are streamed again, with the gds of both
+    # clean children of top handed to magic
+    with open(cells / "leaf.mag", "a") as f:
+        f.write("rect 0 0 1 1\n")
+    assert "3 of 4 cells to stream, 1 from the cache" in run()
+    with open(cells / "b.mag", "a") as f:
+        f.write("rect 0 0 1 1\n")
+    assert "2 of 4 cells to stream, 1 from the cache" in run()
+    # the key of the top cell covers its compression
+    assert "1 of 4 cells to stream, 2 from the cache" in run("gz")
+    with open(output / "top.gds.gz", "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+    assert "is up to date" in run("gz")
+
+
+def test_xor_per_layer(pdk_root, tmp_path):
+    a, b = tmp_path / "a.gds", tmp_path / "b.gds"
+    a.write_bytes(library(structure("top", rectangle(64, 0, 0, 10, 10), rectangle(68, 0, 0, 10, 10), rectangle(69, 0, 0, 10, 10), rectangle(70, 0, 0, 10, 10))))
+    b.write_bytes(library(structure("top", rectangle(64, 0, 0, 10, 10), rectangle(68, 0, 0, 20, 20), rectangle(69, 0, 0, 20, 20), rectangle(71, 0, 0, 10, 10))))
+    xor_gds, total_file = str(tmp_path / "xor.gds"), str(tmp_path / "xor_output.txt")
+    common.xor_per_layer(CONSOLE, "top", str(a), str(b), xor_gds, total_file, processes=2)
+    total, counts = common.read_xor_totals(total_file)
+    assert total == sum(counts.values()) == 6
+    assert {layer: count for layer, count in counts.items() if count} == {"68/20": 2, "69/20": 2, "70/20": 1, "71/20": 1}
+    # one xor cell holding the shapes of every group
+    assert gds.structure_names(xor_gds) == ["top_XOR"]
+    shapes = []
+    gds.read_library(xor_gds, shape=lambda *shape: shapes.append(shape))
+    assert len(shapes) == total
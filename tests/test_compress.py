@@ -0,0 +1,75 @@
+import gzip
+import os
+
+import pytest
+from test_gds import library, rectangle, sref, structure
+
+from utilities import compress, gds
+
+DATA = library(structure("leaf", *(rectangle(68, 0, 0, size, size) for size in range(1, 2000))), structure("top", sref("leaf", 0, 0)))
+
+
+@pytest.fixture(autouse=True)
+def scratch(tmp_path, monkeypatch):
+    monkeypatch.setenv("UTILITIES_SCRATCH", str(tmp_path / "scratch"))
+    return tmp_path / "scratch"
+
+
+def top_cell(stream):
+    return gds.read_library(stream).tops[0]
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_round_trip(tmp_path, suffix):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    plain = tmp_path / "top.gds"
+    plain.write_bytes(DATA)
+    compressed = str(tmp_path / f"top.gds{suffix}")
+    compress.compress_file(str(plain), compressed)
+    # no partial file left next to it
+    assert sorted(os.listdir(tmp_path)) == ["top.gds", f"top.gds{suffix}"]
+    with compress.open_compressed(compressed) as f:
+        assert f.read() == DATA
+    decompression = compress.decompress(compressed, top_cell)
+    assert decompression.result() == "ok top"
+    with open(decompression.path, "rb") as f:
+        assert f.read() == DATA
+    # magic waits for the flag file, written once the copy is complete
+    with open(decompression.ready) as f:
+        assert f.read() == "ok top"
+    assert sorted(os.listdir(decompression.directory)) == ["top.gds", "top.gds.ready"]
+    compress.release(decompression.ready)
+    assert not os.path.exists(decompression.directory)
+
+
+def test_truncated_input(tmp_path):
+    compressed = tmp_path / "top.gds.gz"
+    data = gzip.compress(DATA)
+    compressed.write_bytes(data[:len(data) // 2])
+    decompression = compress.decompress(str(compressed), top_cell)
+    status = decompression.result()
+    # the reader is told, and never sees a partial gds
+    assert status.startswith("error ")
+    with open(decompression.ready) as f:
+        assert f.read() == status
+    assert not os.path.exists(decompression.path)
+    compress.release(decompression.ready)
+
+
+def test_staging(scratch):
+    with pytest.raises(RuntimeError):
+        with compress.staging():
+            directory = compress.scratch_dir()
+            assert os.path.isdir(directory)
+            raise RuntimeError("aborted")
+    assert os.listdir(scratch) == []
+
+
+def test_failed_compression(tmp_path):
+    destination = tmp_path / "out" / "top.gds.gz"
+    destination.parent.mkdir()
+    with pytest.raises(OSError):
+        compress.compress_file(str(tmp_path / "missing.gds"), str(destination))
+    # no partial output left behind
+    assert os.listdir(destination.parent) == []
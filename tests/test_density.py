@@ -0,0 +1,25 @@
+import pytest
+from test_gds import LAYOUT
+
+from utilities import density, gds
+
+pytest.importorskip("numpy")
+
+
+def collect(path, runs=False):
+    collector = density.ShapeCollector([density.DensityLayer("met1", 68, 20, None, None)])
+    library = gds.read_library(path, shape=collector, rectangles=collector.add_rectangles if runs else None)
+    collector.set_boxes(library)
+    return library, collector
+
+
+def test_rectangle_runs(tmp_path):
+    path = tmp_path / "top.gds"
+    path.write_bytes(LAYOUT)
+    shapes, expected = collect(str(path))
+    library, collector = collect(str(path), runs=True)
+    for name in ("leaf", "top"):
+        assert collector.boxes(name, (68, 20)).tolist() == expected.boxes(name, (68, 20)).tolist()
+        assert library.structures[name].box == shapes.structures[name].box
+    assert library.structures["leaf"].box == (0, 0, 400, 300)
+    assert collector.boxes("leaf", (69, 20)).shape == (0, 4)
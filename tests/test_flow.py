@@ -0,0 +1,138 @@
+import json
+import os
+import signal
+import time
+
+import pytest
+from rich.console import Console
+
+from utilities import flow
+from utilities.cache import ResultCache
+from utilities.common import UtilitiesError
+
+CONSOLE = Console(quiet=True)
+
+
+def write_flow(path, steps):
+    path.write_text(json.dumps({"steps": steps}))
+    return str(path)
+
+
+def fake_run_job(job, log_dir=None, flags=(), memory_cap=None):
+    """Stands in for a command: copies its input into <output>/<name>.out."""
+    if job["name"] == "dies":
+        os.kill(os.getpid(), signal.SIGKILL)
+    time.sleep(0.05)
+    with open(job["input"]) as f:
+        data = f.read()
+    with open(os.path.join(job["options"]["output"], f"{job['name']}.out"), "w") as f:
+        f.write(data)
+    return {"name": job["name"], "command": job["command"], "input": job["input"], "status": "ok", "detail": "", "duration": 0.05}
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(flow, "get_cache", lambda: cache)
+    monkeypatch.setattr(flow, "run_job", fake_run_job)
+    (tmp_path / "design.gds").write_text("design")
+    return tmp_path
+
+
+def chain(workspace):
+    return write_flow(
+        workspace / "flow.json",
+        [
+            {"name": "drc", "command": "density", "input": "gds/gds.out", "output": "drc"},
+            {"name": "gds", "command": "density", "input": "design.gds", "output": "gds"},
+            {"name": "lef", "command": "density", "input": "design.gds", "output": "lef"},
+            {"name": "report", "command": "density", "input": "drc/drc.out", "output": "report", "after": "lef"},
+        ],
+    )
+
+
+def test_dependencies(workspace):
+    steps = flow.load_flow(CONSOLE, chain(workspace))
+    after, order = flow.dependencies(CONSOLE, steps)
+    assert after == {"drc": {"gds"}, "gds": set(), "lef": set(), "report": {"drc", "lef"}}
+    assert order.index("gds") < order.index("drc") < order.index("report")
+    assert order.index("lef") < order.index("report")
+
+
+def test_cycle(workspace):
+    path = write_flow(
+        workspace / "cycle.json",
+        [
+            {"name": "a", "command": "density", "input": "b/x.gds", "output": "a"},
+            {"name": "b", "command": "density", "input": "a/x.gds", "output": "b"},
+        ],
+    )
+    with pytest.raises(UtilitiesError, match="depend on each other"):
+        flow.dependencies(CONSOLE, flow.load_flow(CONSOLE, path))
+
+
+def test_unknown_after(workspace):
+    path = write_flow(workspace / "bad.json", [{"name": "a", "command": "density", "input": "x.gds", "after": "b"}])
+    with pytest.raises(UtilitiesError, match="unknown steps b"):
+        flow.load_flow(CONSOLE, path)
+
+
+def test_critical_path():
+    after = {"gds": set(), "lef": set(), "drc": {"gds"}, "xor": {"gds"}, "report": {"drc", "xor", "lef"}}
+    order = ["gds", "lef", "drc", "xor", "report"]
+    durations = {"gds": 2.0, "lef": 5.0, "drc": 4.0, "xor": 1.0, "report": 1.0}
+    assert flow.critical_path(after, order, durations) == (["gds", "drc", "report"], 7.0)
+    assert flow.critical_path({}, [], {}) == ([], 0.0)
+
+
+def statuses(results):
+    return {result["name"]: result["status"] for result in results}
+
+
+def test_up_to_date(workspace):
+    path = chain(workspace)
+    state = str(workspace / "flow.state.json")
+    results = flow.run_flow(CONSOLE, flow.load_flow(CONSOLE, path), state, processes=2)
+    assert set(statuses(results).values()) == {"ok"}
+    results = flow.run_flow(CONSOLE, flow.load_flow(CONSOLE, path), state, processes=2)
+    assert set(statuses(results).values()) == {"up to date"}
+    # the content counts, not the timestamp
+    os.utime(workspace / "design.gds", (time.time() + 10, time.time() + 10))
+    results = flow.run_flow(CONSOLE, flow.load_flow(CONSOLE, path), state, processes=2)
+    assert set(statuses(results).values()) == {"up to date"}
+    (workspace / "design.gds").write_text("changed")
+    results = flow.run_flow(CONSOLE, flow.load_flow(CONSOLE, path), state, processes=2)
+    assert statuses(results) == {"drc": "ok", "gds": "ok", "lef": "ok", "report": "ok"}
+    # an output changed by hand reruns its step, whose identical output
+    # doesn't rerun the steps after it
+    (workspace / "lef" / "lef.out").write_text("edited")
+    results = flow.run_flow(CONSOLE, flow.load_flow(CONSOLE, path), state, processes=2)
+    assert statuses(results) == {"drc": "up to date", "gds": "up to date", "lef": "ok", "report": "up to date"}
+
+
+def test_dead_worker(workspace):
+    path = write_flow(
+        workspace / "flow.json",
+        [
+            {"name": "gds", "command": "density", "input": "design.gds", "output": "gds"},
+            {"name": "dies", "command": "density", "input": "design.gds", "output": "dies"},
+            {"name": "drc", "command": "density", "input": "gds/gds.out", "output": "drc"},
+            {"name": "after", "command": "density", "input": "design.gds", "output": "after", "after": "dies"},
+        ],
+    )
+    results = flow.run_flow(CONSOLE, flow.load_flow(CONSOLE, path), str(workspace / "state.json"), processes=3)
+    assert statuses(results) == {"gds": "ok", "dies": "failed", "drc": "ok", "after": "skipped"}
+
+
+def test_record_cache_hit(workspace):
+    # a result cache hit links a file that kept its old modification time
+    stored = workspace / "stored.gds"
+    stored.write_text("gds")
+    os.utime(stored, (1, 1))
+    (workspace / "gds").mkdir()
+    start = time.time()
+    os.link(stored, workspace / "gds" / "top.gds")
+    state = flow.FlowState(str(workspace / "flow.state.json"))
+    state.record({"name": "gds", "outputs": ["gds"]}, "key", start, 0.0)
+    assert list(state.steps["gds"]["outputs"]) == [os.path.join("gds", "top.gds")]
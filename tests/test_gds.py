@@ -0,0 +1,225 @@
+import io
+import struct
+
+import pytest
+
+from utilities import gds
+
+
+def record(kind, datatype, payload=b""):
+    return struct.pack(">HBB", 4 + len(payload), kind, datatype) + payload
+
+
+def string(kind, value):
+    data = value.encode()
+    if len(data) % 2:
+        data += b"\0"
+    return record(kind, 6, data)
+
+
+def int16(kind, *values):
+    return record(kind, 2, struct.pack(f">{len(values)}h", *values))
+
+
+def int32(kind, *values):
+    return record(kind, 3, struct.pack(f">{len(values)}i", *values))
+
+
+def real8(value):
+    exponent = 64
+    while value >= 1:
+        value /= 16
+        exponent += 1
+    while value < 1 / 16:
+        value *= 16
+        exponent -= 1
+    return bytes([exponent]) + round(value * (1 << 56)).to_bytes(7, "big")
+
+
+def rectangle(layer, x0, y0, x1, y1):
+    return (
+        record(gds.BOUNDARY, 0)
+        + int16(gds.LAYER, layer)
+        + int16(gds.DATATYPE, 20)
+        + int32(gds.XY, x0, y0, x1, y0, x1, y1, x0, y1, x0, y0)
+        + record(gds.ENDEL, 0)
+    )
+
+
+def triangle(layer):
+    return (
+        record(gds.BOUNDARY, 0)
+        + int16(gds.LAYER, layer)
+        + int16(gds.DATATYPE, 20)
+        + int32(gds.XY, 0, 0, 400, 0, 0, 300, 0, 0)
+        + record(gds.ENDEL, 0)
+    )
+
+
+def sref(name, x, y, angle=None):
+    data = record(gds.SREF, 0) + string(gds.SNAME, name)
+    if angle is not None:
+        data += int16(gds.STRANS, 0) + record(gds.ANGLE, 5, real8(angle))
+    return data + int32(gds.XY, x, y) + record(gds.ENDEL, 0)
+
+
+def aref(name, columns, rows, x, y, pitch):
+    return (
+        record(gds.AREF, 0)
+        + string(gds.SNAME, name)
+        + int16(gds.COLROW, columns, rows)
+        + int32(gds.XY, x, y, x + columns * pitch, y, x, y + rows * pitch)
+        + record(gds.ENDEL, 0)
+    )
+
+
+def structure(name, *elements):
+    return record(gds.BGNSTR, 2, b"\0" * 24) + string(gds.STRNAME, name) + b"".join(elements) + record(gds.ENDSTR, 0)
+
+
+def library(*structures):
+    return (
+        int16(gds.HEADER, 600)
+        + record(gds.BGNLIB, 2, b"\0" * 24)
+        + string(gds.LIBNAME, "lib")
+        + record(gds.UNITS, 5, real8(0.001) + real8(1e-9))
+        + b"".join(structures)
+        + record(gds.ENDLIB, 0)
+    )
+
+
+LAYOUT = library(
+    structure("leaf", rectangle(68, 0, 0, 100, 200), rectangle(69, 10, 10, 50, 50), triangle(68)),
+    structure("row", aref("leaf", 3, 2, 0, 0, 1000), sref("missing", 0, 0)),
+    structure("top", sref("row", 5000, 0, angle=90), sref("leaf", 0, 0), rectangle(68, -100, -100, 0, 0)),
+)
+
+
+@pytest.fixture
+def layout(tmp_path):
+    path = tmp_path / "top.gds"
+    path.write_bytes(LAYOUT)
+    return str(path)
+
+
+def test_graph(layout):
+    library = gds.read_library(layout)
+    assert library.name == "lib"
+    assert library.dbu == pytest.approx(0.001)
+    assert list(library.structures) == ["leaf", "row", "top"]
+    assert library.tops == ["top"]
+    assert library.missing == ["missing"]
+    assert library.children("top") == {"row", "leaf"}
+    assert library.structures["leaf"].elements == 3
+    # no shapes are decoded by default
+    assert library.structures["leaf"].box is None
+    row = library.structures["row"].references[0]
+    assert (row.columns, row.rows, row.column_step, row.row_step) == (3, 2, (1000, 0), (0, 1000))
+    rotated = library.structures["top"].references[0]
+    assert (rotated.origin, rotated.angle) == ((5000, 0), 90.0)
+
+
+def test_boxes(layout):
+    library = gds.read_library(layout, boxes=True)
+    assert library.structures["leaf"].box == (0, 0, 400, 300)
+    assert library.bbox("row") == (0, 0, 2400, 1300)
+    assert library.bbox("top") == (-100, -100, 5000, 2400)
+
+
+def test_shapes_and_rectangles(layout):
+    shapes = []
+    gds.read_library(layout, shape=lambda *shape: shapes.append((shape[0], shape[2], gds.int32s(shape[5]))))
+    assert shapes == [
+        ("leaf", 68, (0, 0, 100, 0, 100, 200, 0, 200, 0, 0)),
+        ("leaf", 69, (10, 10, 50, 10, 50, 50, 10, 50, 10, 10)),
+        ("leaf", 68, (0, 0, 400, 0, 0, 300, 0, 0)),
+        ("top", 68, (-100, -100, 0, -100, 0, 0, -100, 0, -100, -100)),
+    ]
+    runs, others = [], []
+    gds.read_library(layout, shape=lambda *shape: others.append(shape[0]), rectangles=lambda name, data: runs.append((name, len(data))))
+    assert runs == [("leaf", 2 * gds.RECTANGLE), ("top", gds.RECTANGLE)]
+    assert others == ["leaf"]
+
+
+def test_stream_chunks(layout, monkeypatch):
+    expected = gds.read_library(layout, boxes=True)
+    # records and runs of rectangles split across reads
+    monkeypatch.setattr(gds, "STREAM_CHUNK", 7)
+    library = gds.read_library(io.BytesIO(LAYOUT), boxes=True)
+    assert list(library.structures) == list(expected.structures)
+    assert library.bbox("top") == expected.bbox("top")
+    assert gds.structure_names(io.BytesIO(LAYOUT)) == ["leaf", "row", "top"]
+
+
+@pytest.mark.parametrize(
+    "data, message",
+    [
+        (LAYOUT[:len(LAYOUT) // 2], "truncated"),
+        (LAYOUT[:-4], "without ENDLIB"),
+        (library(rectangle(68, 0, 0, 1, 1)), "outside a structure"),
+        (library(sref("leaf", 0, 0)), "outside a structure"),
+        (LAYOUT[:6] + struct.pack(">HBB", 2, 0, 0) + LAYOUT[10:], "invalid record length"),
+    ],
+    ids=["truncated", "no-endlib", "boundary-outside", "sref-outside", "bad-length"],
+)
+def test_invalid(tmp_path, data, message):
+    path = tmp_path / "bad.gds"
+    path.write_bytes(data)
+    for source in (str(path), io.BytesIO(data)):
+        with pytest.raises(gds.GDSError, match=message):
+            gds.read_library(source)
+
+
+def design(leaf="leaf", size=100, reverse=False):
+    """top -> mid -> (leaf, other), with the leaf cell named leaf."""
+    mid = [sref(leaf, 0, 0), sref("other", 500, 0)]
+    return library(
+        structure(leaf, rectangle(68, 0, 0, size, 100)),
+        structure("other", rectangle(69, 0, 0, 50, 50)),
+        structure("mid", *(mid[::-1] if reverse else mid)),
+        structure("top", sref("mid", 0, 0), rectangle(70, 0, 0, 10, 10)),
+    )
+
+
+@pytest.mark.parametrize(
+    "changed, status, roots",
+    [
+        # element order doesn't count
+        (design(reverse=True), {"top": "identical", "mid": "identical", "leaf": "identical", "other": "identical"}, []),
+        (design(size=200), {"top": "subtree", "mid": "subtree", "leaf": "changed", "other": "identical"}, ["leaf"]),
+        # the parent of a renamed cell references another name
+        (design(leaf="cell"), {"top": "subtree", "mid": "changed", "leaf": "removed", "cell": "added", "other": "identical"}, ["mid"]),
+    ],
+    ids=["identical", "leaf-changed", "renamed"],
+)
+def test_compare_cells(tmp_path, changed, status, roots):
+    (tmp_path / "a.gds").write_bytes(design())
+    (tmp_path / "b.gds").write_bytes(changed)
+    cells_a, cells_b = gds.hash_cells(str(tmp_path / "a.gds")), gds.hash_cells(str(tmp_path / "b.gds"))
+    assert cells_a["mid"].children == {"leaf", "other"} and cells_a["mid"].elements == 2
+    compared = gds.compare_cells(cells_a, cells_b, "top")
+    assert compared == status
+    assert gds.xor_roots(cells_a, compared, "top") == roots
+
+
+def test_merge_libraries(tmp_path):
+    # two parts of a layer split xor, each with the cells of its layers
+    (tmp_path / "a.gds").write_bytes(library(
+        structure("leaf", rectangle(68, 0, 0, 10, 10)),
+        structure("top", sref("leaf", 0, 0), rectangle(68, 0, 0, 20, 20)),
+    ))
+    (tmp_path / "b.gds").write_bytes(library(
+        structure("top", sref("leaf", 0, 0), sref("leaf", 100, 0), rectangle(69, 0, 0, 30, 30)),
+        structure("leaf", rectangle(69, 0, 0, 10, 10)),
+        structure("other", rectangle(70, 0, 0, 10, 10)),
+    ))
+    merged = str(tmp_path / "merged.gds")
+    gds.merge_libraries([str(tmp_path / "a.gds"), str(tmp_path / "b.gds")], merged)
+    assert gds.structure_names(merged) == ["leaf", "top", "other"]
+    shapes = []
+    merged_library = gds.read_library(merged, shape=lambda name, element, layer, datatype, width, data: shapes.append((name, layer)))
+    assert sorted(shapes) == [("leaf", 68), ("leaf", 69), ("other", 70), ("top", 68), ("top", 69)]
+    # the reference in both parts is placed once
+    references = merged_library.structures["top"].references
+    assert sorted(reference.origin for reference in references) == [(0, 0), (100, 0)]
+    assert merged_library.tops == ["top", "other"]
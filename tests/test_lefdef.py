@@ -0,0 +1,128 @@
+import pytest
+from rich.console import Console
+
+from utilities import lefdef
+from utilities.common import UtilitiesError, def_to_lef_native
+
+TECH_LEF = """LAYER met1
+  TYPE ROUTING ;
+  WIDTH 0.14 ;
+END met1
+LAYER met2
+  TYPE ROUTING ;
+  MINWIDTH 0.2 ;
+END met2
+LAYER met3
+  TYPE ROUTING ;
+  WIDTH 0.3 ;
+END met3
+END LIBRARY
+"""
+
+DEF = """VERSION 5.8 ;
+DESIGN top ;
+UNITS DISTANCE MICRONS 1000 ;
+DIEAREA ( 0 0 ) ( 100000 100000 ) ;
+PINS 2 ;
+- a + NET a + DIRECTION INPUT + USE SIGNAL
+  + LAYER met2 ( -100 0 ) ( 100 500 )
+  + FIXED ( 50000 100000 ) S ;
+- b + NET b + DIRECTION OUTPUT
+  + PORT
+  + LAYER met3 ( -300 -100 ) ( 300 100 )
+  + PLACED ( 200 20000 ) E ;
+END PINS
+NETS 2 ;
+- a ( PIN a ) ( u0 A )
+  + ROUTED met2 ( 10000 20000 )
+  ( * 99800 )
+  ( 50000 * )
+  NEW met4 ( 30000 30000 ) ( 40000 * ) ;
+- b ( PIN b )
+  + ROUTED met1 ( 5000 5000 ) ( 8000 * ) RECT ( -1000 -4000 0 0 )
+  VIRTUAL ( 60000 60000 ) ( 9000 5000 ) ;
+END NETS
+SPECIALNETS 1 ;
+- vccd1 ( * vccd1 )
+  + ROUTED met3 1000 + SHAPE STRIPE ( 1000 1000 ) ( 1000 99000 )
+  NEW met1 480 + SHAPE FOLLOWPIN ( 0 2720 ) ( 100000 2720 ) ;
+END SPECIALNETS
+END DESIGN
+"""
+
+
+@pytest.fixture
+def design(tmp_path):
+    (tmp_path / "top.def").write_text(DEF)
+    (tmp_path / "tech.tlef").write_text(TECH_LEF)
+    return tmp_path
+
+
+def test_routing_widths(design):
+    assert lefdef.lef_routing_widths(str(design / "tech.tlef")) == {"met1": 0.14, "met2": 0.2, "met3": 0.3}
+
+
+@pytest.mark.parametrize("chunk", [1 << 22, 64])
+def test_read_def_abstract(design, monkeypatch, chunk):
+    monkeypatch.setattr(lefdef, "NET_CHUNK", chunk)
+    abstract = lefdef.read_def_abstract(str(design / "top.def"), lefdef.lef_routing_widths(str(design / "tech.tlef")))
+    assert (abstract.design, abstract.dbu, abstract.die) == ("top", 1000, [0, 0, 100000, 100000])
+    ports = {pin.name: list(pin.placed_ports()) for pin in abstract.pins}
+    assert ports == {
+        "a": [[("met2", "RECT", [(49900, 99500), (50100, 100000)])]],
+        # E turns ( x y ) into ( y -x )
+        "b": [[("met3", "RECT", [(100, 19700), (300, 20300)])]],
+    }
+    assert abstract.obstructions == {
+        # the RECT patch below ( 8000 5000 ) and the special net, not the
+        # virtual point
+        "met1": [-240, 1000, 100240, 5070],
+        # `*` repeats the coordinate before it, MINWIDTH without WIDTH
+        "met2": [9900, 19900, 50100, 99900],
+        # the width of the special net
+        "met3": [500, 500, 1500, 99500],
+        # no width in the tech lef, the narrowest one
+        "met4": [29930, 29930, 40070, 30070],
+    }
+
+
+def test_read_def_abstract_without_widths(design):
+    abstract = lefdef.read_def_abstract(str(design / "top.def"))
+    # DEFAULT_WIDTH, never a degenerate box
+    assert abstract.obstructions["met4"] == [29950, 29950, 40050, 30050]
+
+
+def obstructions(lef_file):
+    rects = {}
+    with open(lef_file) as f:
+        lines = f.read().split("  OBS\n")[1].splitlines()
+    for line in lines:
+        words = line.split()
+        if words[0] == "LAYER":
+            layer = words[1]
+        elif words[0] == "RECT":
+            rects.setdefault(layer, []).append(tuple(float(word) for word in words[1:5]))
+    return rects
+
+
+def test_def_to_lef_abstract(design):
+    lef_file = str(design / "top.lef")
+    lefdef.def_to_lef_abstract(str(design / "top.def"), lef_file, [str(design / "tech.tlef")])
+    text = open(lef_file).read()
+    assert "MACRO top\n" in text and "SIZE 100.000 BY 100.000 ;" in text
+    assert "LAYER met2 ;\n        RECT 49.900 99.500 50.100 100.000 ;" in text
+    assert "LAYER met3 ;\n        RECT 0.100 19.700 0.300 20.300 ;" in text
+    assert obstructions(lef_file) == {
+        # clipped to the die
+        "met1": [(0.0, 1.0, 100.0, 5.07)],
+        # pin a cut out
+        "met2": [(9.9, 19.9, 50.1, 99.5), (9.9, 99.5, 49.9, 99.9)],
+        "met3": [(0.5, 0.5, 1.5, 99.5)],
+        "met4": [(29.93, 29.93, 40.07, 30.07)],
+    }
+
+
+def test_def_to_lef_native_needs_tech_lef(design):
+    with pytest.raises(UtilitiesError, match="tech lef"):
+        def_to_lef_native(Console(quiet=True), str(design / "top.def"), "sky130A", str(design / "pdk"), str(design))
+    assert not (design / "top.lef").exists()
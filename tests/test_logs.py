@@ -0,0 +1,63 @@
+import gzip
+import json
+import sys
+
+import pytest
+
+from utilities import logs
+
+SCRIPT = """
+import sys
+print("@@PHASE load", flush=True)
+for i in range(50000):
+    print(f"line {i}")
+print("@@PHASE write", flush=True)
+print("x" * (3 * 65536 + 10))
+print("last line")
+sys.exit(3)
+"""
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.delenv("UTILITIES_SHOW_LOG", raising=False)
+    monkeypatch.delenv("UTILITIES_TELEMETRY", raising=False)
+
+
+def test_tail_is_bounded():
+    with logs.LogCapture("run", tail=5) as capture:
+        for i in range(10000):
+            capture.feed(f"line {i}\n")
+        capture.feed(b"@@PHASE write\n")
+    assert list(capture.tail) == [f"line {i}" for i in range(9995, 10000)]
+    assert list(capture.phases) == ["write"]
+
+
+def test_run_tool(tmp_path, monkeypatch, capsys):
+    telemetry_file = tmp_path / "telemetry.jsonl"
+    monkeypatch.setenv("UTILITIES_TELEMETRY", str(telemetry_file))
+    log_file = logs.log_path(str(tmp_path / "run"))
+    assert logs.run_tool([sys.executable, "-c", SCRIPT], "python", log_file=log_file) == 3
+    # only the last lines are shown, the long line split into pieces
+    shown = capsys.readouterr().err
+    assert "last line" in shown and "line 49999" in shown and "line 100\n" not in shown
+    # the full log, as written
+    with (gzip.open(log_file) if log_file.endswith(".gz") else open(log_file, "rb")) as f:
+        lines = f.read().decode().splitlines()
+    assert lines[0] == "@@PHASE load" and lines[50000] == "line 49999" and lines[-1] == "last line"
+    assert len(lines[-2]) == 3 * 65536 + 10
+    # the rusage of the run is recorded
+    entry, = (json.loads(line) for line in telemetry_file.read_text().splitlines())
+    assert entry["returncode"] == 3 and entry["log"] == log_file
+    assert entry["max_rss_kb"] > 0 and entry["cpu"] == pytest.approx(entry["user"] + entry["sys"])
+    assert set(entry["phases"]) == {"load", "write"}
+
+
+def test_zstd_log(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = str(tmp_path / "run.log.zst")
+    with logs.LogCapture("run", path) as capture:
+        capture.feed("first\n")
+        capture.feed(b"second\n")
+    with open(path, "rb") as f:
+        assert zstandard.ZstdDecompressor().stream_reader(f).read() == b"first\nsecond\n"
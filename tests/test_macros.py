@@ -0,0 +1,72 @@
+import pytest
+from test_gds import aref, library, rectangle, sref, structure
+
+from utilities import macros
+from utilities.cache import ResultCache
+from utilities.lefdef import lef_macros
+
+DEF = """VERSION 5.8 ;
+DESIGN top ;
+COMPONENTS 3 ;
+- u0 ram + PLACED ( 0 0 ) N ;
+- u1 ram + PLACED ( 1000 0 ) N ;
+- u2 pll + PLACED ( 0 1000 ) N ;
+END COMPONENTS
+END DESIGN
+"""
+
+
+def lef(*names):
+    return "".join(f"MACRO {name}\n  PIN {name}\n  END {name}\nEND {name}\n" for name in names) + "END LIBRARY\n"
+
+
+@pytest.fixture
+def design(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(macros, "get_cache", lambda: cache)
+    (tmp_path / "top.def").write_text(DEF)
+    (tmp_path / "ram.lef").write_text(lef("ram", "rom"))
+    (tmp_path / "pll.lef").write_text(lef("pll"))
+    (tmp_path / "unused.lef").write_text(lef("dac", "adc"))
+    # ram.gds only references the bit cells of cells.gds, which defines
+    # no master
+    (tmp_path / "ram.gds").write_bytes(library(structure("ram", aref("bit", 8, 8, 0, 0, 100), sref("sense", 0, 900))))
+    (tmp_path / "cells.gds").write_bytes(library(structure("bit", sref("via", 0, 0)), structure("sense", rectangle(68, 0, 0, 10, 10))))
+    (tmp_path / "vias.gds").write_bytes(library(structure("via", rectangle(68, 0, 0, 1, 1))))
+    (tmp_path / "other.gds").write_bytes(library(structure("adc", rectangle(68, 0, 0, 1, 1))))
+    return tmp_path
+
+
+def select(design, lefs, gds_files):
+    return macros.select_macros(
+        str(design / "top.def"),
+        [str(design / name) for name in lefs],
+        [str(design / name) for name in gds_files],
+        str(design / "pdk"),
+        "sky130A",
+        macros.MacroIndex(str(design / "index.json")),
+    )
+
+
+def test_gds_closure(design):
+    selection = select(design, [], ["other.gds", "ram.gds", "vias.gds", "cells.gds"])
+    assert selection.gds_files == [str(design / name) for name in ("ram.gds", "vias.gds", "cells.gds")]
+    assert selection.masters == {"ram": 2, "pll": 1}
+    assert selection.unresolved == ["pll"]
+
+
+def test_lef_subsets(design):
+    selection = select(design, ["ram.lef", "pll.lef", "unused.lef"], [])
+    # pll.lef is used in full, unused.lef not at all
+    assert selection.lefs[1:] == [str(design / "pll.lef")]
+    assert list(lef_macros(selection.lefs[0])) == ["ram"]
+    assert selection.unresolved == []
+
+
+def test_index(design):
+    index = macros.MacroIndex(str(design / "index.json"))
+    assert index.gds_cells(str(design / "cells.gds")) == {"bit": ["via"], "sense": []}
+    index.save()
+    (design / "cells.gds").write_bytes(library(structure("bit")))
+    # a changed file is scanned again
+    assert macros.MacroIndex(str(design / "index.json")).gds_cells(str(design / "cells.gds")) == {"bit": []}
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from utilities import common
+from utilities.magic_pool import MagicPool
+
+
+@pytest.fixture
+def pool(pdk_root, monkeypatch):
+    # set when the worker starts, so part of the environment it restores
+    monkeypatch.setenv("POOL_TEST", "outer")
+    pool = MagicPool(1)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def rcfile(pdk_root):
+    return os.path.join(pdk_root, "sky130A", "libs.tech", "magic", "sky130A.magicrc")
+
+
+def script(tmp_path, name, text):
+    path = tmp_path / f"{name}.tcl"
+    path.write_text(text)
+    return str(path)
+
+
+def run(pool, rcfile, script, env=None, cwd=None):
+    lines = []
+    returncode = pool.run(rcfile, script, env or {}, cwd, output=lines.append)
+    return returncode, "".join(lines)
+
+
+def test_job(pool, rcfile, tmp_path):
+    (tmp_path / "top.mag").write_text("magic\n")
+    env = {"MACRO": str(tmp_path / "top.mag"), "OUTPUT": str(tmp_path), "PDK_ROOT": "pdk", "PDK": "sky130A"}
+    returncode, output = run(pool, rcfile, os.path.join(common.HELPER_LIB, "mag_to_gds.tcl"), env)
+    assert returncode == 0 and "@@PHASE gds_write" in output
+    assert (tmp_path / "top.gds").exists()
+
+
+def test_reset_between_jobs(pool, rcfile, tmp_path):
+    (tmp_path / "top.mag").write_text("magic\n")
+    first = script(tmp_path, "first", "load top\nset ::env(POOL_TEST) job\nputs \"in job $::env(POOL_TEST) $::env(JOB_ONLY)\"\n")
+    assert run(pool, rcfile, first, {"JOB_ONLY": "1"}, str(tmp_path)) == (0, "in job job 1\n")
+    second = script(tmp_path, "second", "puts \"[cellname list allcells] [info exists ::env(JOB_ONLY)] $::env(POOL_TEST)\"\n")
+    # the same worker, without the cells and variables of the job before
+    assert run(pool, rcfile, second, cwd=str(tmp_path)) == (0, " 0 outer\n")
+    assert len(pool._workers[rcfile]) == 1
+
+
+def test_failed_jobs(pool, rcfile, tmp_path):
+    returncode, output = run(pool, rcfile, script(tmp_path, "error", "error \"no such cell\"\n"))
+    assert returncode == 1 and "failed: no such cell" in output
+    # the worker survives a failed script
+    worker, = pool._workers[rcfile]
+    assert worker.alive
+    # stderr of a worker that dies reaches the job's output
+    returncode, output = run(pool, rcfile, script(tmp_path, "crash", "puts stderr \"out of memory\"\nexit 3\n"))
+    assert returncode == 3 and "out of memory" in output
+    assert pool._workers[rcfile] == []
+    # and the next job gets a new worker
+    assert run(pool, rcfile, script(tmp_path, "next", "puts ok\n")) == (0, "ok\n")
+    assert pool._workers[rcfile] != [worker]
+
+
+def test_environment_precedence(monkeypatch):
+    # as in a pool worker, the job's variables win over the environment
+    monkeypatch.setenv("OUTPUT", "outer")
+    job = common.MagicJob("pdk", "sky130A", "mag_to_gds.tcl", {"OUTPUT": "out"}, [], [])
+    env = common.magic_environment(job)
+    assert env["OUTPUT"] == "out" and env["PATH"] == os.environ["PATH"]
@@ -0,0 +1,24 @@
+import click
+import pytest
+from click.testing import CliRunner
+
+from utilities.common import UtilitiesError
+from utilities.manage import UtilitiesCommand, mag_to_gds_cmd
+
+
+@click.command(cls=UtilitiesCommand)
+@click.argument("outcome")
+def command(outcome):
+    if outcome == "abort":
+        raise UtilitiesError("aborted")
+    return int(outcome)
+
+
+@pytest.mark.parametrize("outcome, code", [("0", 0), ("2", 2), ("-9", 1), ("300", 1), ("abort", 1)])
+def test_exit_code(outcome, code):
+    assert CliRunner().invoke(command, ["--", outcome]).exit_code == code
+
+
+def test_incremental_rejects_cache():
+    result = CliRunner().invoke(mag_to_gds_cmd, ["top.mag", "--pdk_root", "pdk", "--pdk", "sky130A", "--output", "out", "--incremental", "--cache"])
+    assert result.exit_code == 1 and "leave out --cache" in result.output
@@ -0,0 +1,75 @@
+from test_gds import library, rectangle, structure
+
+from utilities import reports
+from utilities.reports import value_box
+
+
+def lyrdb(path, markers, categories=None):
+    """Writes a report of (rule, cell, box) markers."""
+    items = "".join(
+        f"<item><category>'{rule}'</category><cell>{cell}</cell><values><value>polygon: ({x0},{y0};{x1},{y0};{x1},{y1};{x0},{y1})</value></values></item>\n"
+        for rule, cell, (x0, y0, x1, y1) in markers
+    )
+    names = categories or sorted({rule for rule, _, _ in markers})
+    path.write_text(
+        "<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<report-database>\n<description>drc</description>\n"
+        + "<categories>" + "".join(f"<category><name>{name}</name></category>" for name in names) + "</categories>\n"
+        + "<cells><cell><name>top</name></cell></cells>\n<items>\n" + items + "</items>\n</report-database>\n"
+    )
+    return str(path)
+
+
+def test_value_box():
+    assert value_box(["polygon: (0,0;2,0;2,1.5;0,1.5)"]) == (0, 0, 2, 1.5)
+    assert value_box(["edge-pair: (0,0;1,0)/(0,2;1,2)", "box: (-1,-1;0.5,0.5)"]) == (-1, -1, 1, 2)
+    # only geometry values count
+    assert value_box(["edge: (0,0;1,1)", "float: 100", "text: 'at 5,7'"]) == (0, 0, 1, 1)
+    assert value_box(["float: 0.5"]) is None
+    assert value_box([]) is None
+
+
+def test_merge_lyrdb(tmp_path):
+    feol = lyrdb(tmp_path / "feol.lyrdb", [("difftap.1", "top", (0, 0, 1, 1))] * 2, ["difftap.1", "m1.2"])
+    beol = lyrdb(tmp_path / "beol.lyrdb", [("m1.2", "top", (0, 0, 1, 1)), ("m2.1", "top", (0, 0, 1, 1))])
+    merged = str(tmp_path / "merged.lyrdb")
+    counts = reports.merge_lyrdb([feol, beol], merged)
+    assert counts == {feol: {"difftap.1": 2}, beol: {"m1.2": 1, "m2.1": 1}}
+    # m1.2 is a category of both reports
+    categories = [element.findtext("name") for kind, element in reports.iter_lyrdb(merged) if kind == "category"]
+    assert categories == ["difftap.1", "m1.2", "m2.1"]
+    assert [kind for kind, _ in reports.iter_lyrdb(merged) if kind == "cell"] == ["cell"]
+    assert reports.count_markers(merged) == {"difftap.1": 2, "m1.2": 1, "m2.1": 1}
+
+
+def test_queries(tmp_path):
+    report = lyrdb(tmp_path / "drc.lyrdb", [
+        ("m1.2", "top", (0, 0, 1, 1)),
+        ("m1.2", "top", (10, 10, 12, 11)),
+        ("m2.1", "top", (10.5, 10.5, 20, 20)),
+        ("licon.8a", "top", (50, 50, 51, 51)),
+    ])
+    connection = reports.open_db(str(tmp_path / "markers.db"))
+    assert reports.ingest_lyrdb(connection, report) == 4
+    assert reports.query_markers(connection, rule="m1.*") == [
+        ("m1.2", "m1", "top", 0, 0, 1, 1),
+        ("m1.2", "m1", "top", 10, 10, 12, 11),
+    ]
+    assert [row[0] for row in reports.query_markers(connection, layer="licon")] == ["licon.8a"]
+    # markers overlapping the box, found through the r-tree
+    assert [row[0] for row in reports.query_markers(connection, bbox=(11, 10.8, 15, 15))] == ["m1.2", "m2.1"]
+    assert [row[0] for row in reports.query_markers(connection, rule="m2.*", bbox=(11, 10.8, 15, 15))] == ["m2.1"]
+    assert reports.query_markers(connection, bbox=(30, 30, 40, 40)) == []
+    assert dict(reports.marker_counts(connection, ("rule",))) == {"m1.2": 2, "m2.1": 1, "licon.8a": 1}
+
+
+def test_ingest_xor(tmp_path):
+    xor_gds = tmp_path / "xor.gds"
+    xor_gds.write_bytes(library(structure("top_XOR", rectangle(68, 0, 0, 1000, 1000), rectangle(69, 2000, 0, 3000, 500), rectangle(69, 0, 0, 10, 10))))
+    total_file = tmp_path / "xor_output.txt"
+    total_file.write_text("3\n68/20 1\n69/20 2\n")
+    connection = reports.open_db(str(tmp_path / "markers.db"))
+    assert reports.ingest_xor(connection, str(xor_gds), str(total_file)) == 3
+    assert connection.execute("SELECT layer, count FROM totals ORDER BY layer").fetchall() == [("68/20", 1), ("69/20", 2), ("total", 3)]
+    # the per layer totals match the markers
+    assert sorted(reports.marker_counts(connection, ("layer",))) == [("68/20", 1), ("69/20", 2)]
+    assert reports.query_markers(connection, bbox=(1.5, 0, 2.5, 1)) == [("xor", "69/20", "top_XOR", 2, 0, 3, 0.5)]
@@ -0,0 +1,49 @@
+import os
+
+from utilities.spool import Spool
+
+JOB = {"name": "top", "command": "gds-info", "input": "top.gds", "options": {}}
+
+
+def expire(spool, job_id, age):
+    path = spool.path("running", job_id)
+    mtime = os.stat(path).st_mtime - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_claim_and_finish(tmp_path):
+    spool = Spool(str(tmp_path))
+    first, second = spool.submit([JOB, dict(JOB, name="next")])
+    job = spool.claim("a")
+    assert (job["id"], job["worker"], job["attempts"]) == (first, "a", 1)
+    assert spool.finish(job, "a", {"status": "ok"})
+    assert spool.claim("b")["id"] == second
+    assert spool.claim("b") is None
+    assert [(state, job["id"]) for state, job in spool.jobs()] == [("running", second), ("done", first)]
+
+
+def test_lease_expiry(tmp_path):
+    spool = Spool(str(tmp_path))
+    job_id, = spool.submit([JOB])
+    job = spool.claim("a")
+    # a fresh heartbeat keeps the lease
+    assert spool.requeue_expired(lease=60) == []
+    expire(spool, job_id, 120)
+    assert spool.requeue_expired(lease=60) == [job_id]
+    taken = spool.claim("b")
+    assert (taken["worker"], taken["attempts"]) == ("b", 2)
+    # the worker whose lease expired can't finish the job anymore
+    assert not spool.finish(job, "a", {"status": "ok"})
+    assert spool.finish(taken, "b", {"status": "ok"})
+
+
+def test_lease_expired_too_often(tmp_path):
+    spool = Spool(str(tmp_path))
+    job_id, = spool.submit([JOB])
+    for worker in ("a", "b"):
+        spool.claim(worker)
+        expire(spool, job_id, 120)
+        spool.requeue_expired(lease=60, max_attempts=2)
+    (state, job), = spool.jobs()
+    assert state == "done"
+    assert job["result"]["status"] == "failed" and "expired 2 times" in job["result"]["detail"]
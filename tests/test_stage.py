@@ -0,0 +1,38 @@
+import hashlib
+import json
+import os
+
+from utilities import stage
+
+
+def test_publish_and_verify(tmp_path):
+    scratch = tmp_path / "scratch"
+    (scratch / "reports").mkdir(parents=True)
+    (scratch / "top.gds").write_bytes(b"gds")
+    (scratch / "reports" / "drc.lyrdb").write_text("report")
+    (scratch / ".top.gds.part").write_bytes(b"")
+    output = tmp_path / "out"
+    manifest = str(output / f"top.mag_to_gds{stage.MANIFEST_SUFFIX}")
+    published = stage.publish(str(scratch), str(output), manifest, {"script": "mag_to_gds.tcl"})
+    assert published == [str(output / "top.gds"), str(output / "reports" / "drc.lyrdb")]
+    # hidden files stay behind, no partial copy is left
+    assert sorted(os.listdir(output)) == ["reports", "top.gds", os.path.basename(manifest)]
+    with open(manifest) as f:
+        content = json.load(f)
+    assert content == {
+        "script": "mag_to_gds.tcl",
+        "files": {
+            "top.gds": {"size": 3, "sha256": hashlib.sha256(b"gds").hexdigest()},
+            "reports/drc.lyrdb": {"size": 6, "sha256": hashlib.sha256(b"report").hexdigest()},
+        },
+    }
+    assert stage.verify(manifest) == []
+    # an identical rerun writes the same manifest
+    before = open(manifest, "rb").read()
+    stage.publish(str(scratch), str(output), manifest, {"script": "mag_to_gds.tcl"})
+    assert open(manifest, "rb").read() == before
+    # a changed file of the same size and a missing one
+    (output / "top.gds").write_bytes(b"GDS")
+    assert stage.verify(manifest) == ["top.gds"]
+    os.remove(output / "reports" / "drc.lyrdb")
+    assert stage.verify(manifest) == ["top.gds", "reports/drc.lyrdb"]
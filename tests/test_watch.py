@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import time
+
+from rich.console import Console
+
+from utilities import watch
+
+# a job with a child of its own, both recorded in the pid file it is given
+JOB = """
+import os, subprocess, sys, time
+child = subprocess.Popen(["sleep", "30"])
+with open(sys.argv[1], "w") as f:
+    f.write(f"{os.getpid()} {child.pid}")
+time.sleep(30)
+"""
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rpartition(")")[2].split()[0] not in ("Z", "X")
+    except FileNotFoundError:
+        return False
+
+
+def dead(pid):
+    # the killed children of the job are gone shortly after the job
+    deadline = time.time() + 5
+    while alive(pid):
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def pids(path):
+    deadline = time.time() + 10
+    while not os.path.exists(path) or not open(path).read():
+        assert time.time() < deadline, "the job didn't start"
+        time.sleep(0.05)
+    return [int(pid) for pid in open(path).read().split()]
+
+
+def test_watch(tmp_path, monkeypatch):
+    design = tmp_path / "mag"
+    design.mkdir()
+    (design / "top.mag").write_text("magic\nuse leaf leaf_0\n")
+    (design / "leaf.mag").write_text("magic\n")
+    runs = []
+    run = watch.WatchedJob.run
+
+    def fake_run(self, console):
+        # the command line of the job, with a stand-in for what it runs
+        if not runs:
+            assert self.args[3:] == ["mag-to-gds", str(design / "top.mag"), "--output", str(design)]
+        runs.append(str(tmp_path / f"run{len(runs)}.pid"))
+        self.args = [sys.executable, "-c", JOB, runs[-1]]
+        run(self, console)
+
+    started = []
+    steps = [
+        # the job writes its output next to its input, no edit
+        lambda: (design / "top.gds").write_bytes(b"gds"),
+        None,
+        lambda: (design / "top.mag").write_text("magic\nuse leaf leaf_0\nrect 0 0 1 1\n"),
+        None,
+        # a new edit while the job runs, to a subcell
+        lambda: (started.extend(pids(runs[0])), (design / "leaf.mag").write_text("magic\nrect 0 0 1 1\n")),
+        None,
+        lambda: started.extend(pids(runs[1])),
+    ]
+
+    class ScriptedPoller(watch.Poller):
+        def wait(self, timeout):
+            if not steps:
+                raise KeyboardInterrupt
+            step = steps.pop(0)
+            if step:
+                step()
+            return super().wait(timeout)
+
+    monkeypatch.setattr(watch.WatchedJob, "run", fake_run)
+    monkeypatch.setattr(watch, "Poller", ScriptedPoller)
+    log = io.StringIO()
+    job = {"name": "top", "command": "mag-to-gds", "input": str(design / "top.mag"), "options": {"output": str(design)}}
+    watch.watch(Console(file=log, width=200), [job], debounce=0.1, poll=True, initial=False)
+    assert len(runs) == 2
+    # the first run and its child are killed by the edit, the second once
+    # watching stops
+    assert len(started) == 4 and all(dead(pid) for pid in started)
+    assert log.getvalue().count("cancelled top, its inputs changed") == 1
+    assert "cancelled top, stopping" in log.getvalue()
+
+
+def test_affected_by(tmp_path):
+    from utilities.manage import commands
+
+    (tmp_path / "top.gds").write_bytes(b"gds")
+    output = tmp_path / "out"
+    output.mkdir()
+    job = watch.WatchedJob(commands["gds-to-mag"], {"name": "top", "command": "gds-to-mag", "input": str(tmp_path / "top.gds"), "options": {"output": str(output)}})
+    poller = watch.Poller(interval=0.05)
+    poller.add(str(tmp_path))
+    (tmp_path / "top.gds").write_bytes(b"gds, edited")
+    (tmp_path / ".top.gds.swp").write_bytes(b"")
+    changed = poller.wait(1)
+    assert changed == {str(tmp_path / "top.gds"), str(tmp_path / ".top.gds.swp")}
+    assert [job.affected_by(path) for path in sorted(changed)] == [False, True]
+    assert not job.affected_by(str(output / "top.mag"))
+    assert poller.wait(0.1) == set()
@@ -12,6 +12,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+
 import click
 from click_default_group import DefaultGroup
 
@@ -27,8 +29,20 @@ from .manage import (
     mag_to_lef_cmd,
     gds_to_lef_cmd,
     drc_cmd,
+    density_cmd,
     lvs_cmd,
     xor_cmd,
+    convert_cmd,
+    gds_info_cmd,
+    verify_cmd,
+    batch_cmd,
+    watch_cmd,
+    flow_cmd,
+    queue_group,
+    worker_cmd,
+    cache_group,
+    report_group,
+    stats_cmd,
 )
 
 
@@ -38,8 +52,13 @@ from .manage import (
     default_if_no_args=True,
 )
 @click.version_option(__version__)
-def cli():
-    pass
+@click.option("--telemetry", "telemetry_file", required=False, help="append the resource usage of every magic/klayout run to this JSON lines file (default: $UTILITIES_TELEMETRY)")
+@click.option("--show-log", is_flag=True, help="echo the output of magic/klayout instead of showing their progress")
+def cli(telemetry_file, show_log):
+    if telemetry_file:
+        os.environ["UTILITIES_TELEMETRY"] = os.path.abspath(telemetry_file)
+    if show_log:
+        os.environ["UTILITIES_SHOW_LOG"] = "1"
 
 
 cli.add_command(mag_to_gds_cmd)
@@ -52,8 +71,20 @@ cli.add_command(def_to_lef_cmd)
 cli.add_command(mag_to_lef_cmd)
 cli.add_command(gds_to_lef_cmd)
 cli.add_command(drc_cmd)
+cli.add_command(density_cmd)
 cli.add_command(lvs_cmd)
 cli.add_command(xor_cmd)
+cli.add_command(convert_cmd)
+cli.add_command(gds_info_cmd)
+cli.add_command(verify_cmd)
+cli.add_command(batch_cmd)
+cli.add_command(watch_cmd)
+cli.add_command(flow_cmd)
+cli.add_command(queue_group)
+cli.add_command(worker_cmd)
+cli.add_command(cache_group)
+cli.add_command(report_group)
+cli.add_command(stats_cmd)
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memory estimates of batch jobs, for running them within a budget.
+
+The peak memory of a job is modelled as `base + slope * input bytes` per
+command. The defaults below are rough figures for magic and klayout; the
+records of earlier runs in the telemetry file (max_rss_kb against
+input_bytes) replace them once there are some.
+"""
+import os
+import resource
+
+from . import telemetry
+from .cache import parse_size
+
+MB = 1 << 20
+# command: (base bytes, bytes per input byte)
+DEFAULT_MODELS = {
+    "drc": (1024 * MB, 6),
+    "xor": (512 * MB, 4),
+    "lvs": (1024 * MB, 12),
+}
+DEFAULT_MODEL = (300 * MB, 10)
+# headroom over the calibrated figures
+MARGIN = 1.25
+# RLIMIT_AS counts address space, which runs well above the resident set
+CAP_FACTOR = 4
+MIN_CAP = 2048 * MB
+RECENT_RUNS = 100
+
+
+def available_memory():
+    """MemAvailable of /proc/meminfo, or the physical memory elsewhere."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def memory_budget(budget=None):
+    """Parses a budget such as 48G or 80%, a share of the available memory
+    (the default is 80%)."""
+    budget = str(budget or "80%").strip()
+    if budget.endswith("%"):
+        return int(available_memory() * float(budget[:-1]) / 100)
+    return parse_size(budget)
+
+
+class MemoryModel:
+    def __init__(self, records=()):
+        self.models = dict(DEFAULT_MODELS)
+        runs = {}
+        for entry in records:
+            if entry.get("command") and entry.get("max_rss_kb") and entry.get("input_bytes") and not entry.get("cached"):
+                runs.setdefault(entry["command"], []).append((entry["input_bytes"], entry["max_rss_kb"] * 1024))
+        for command, samples in runs.items():
+            samples = samples[-RECENT_RUNS:]
+            slope = self.models.get(command, DEFAULT_MODEL)[1]
+            base = min(rss for _, rss in samples)
+            # a slope needs runs on inputs of different sizes
+            if len({size for size, _ in samples}) > 1:
+                slope = max((rss - base) / size for size, rss in samples)
+            self.models[command] = (base, slope)
+
+    @classmethod
+    def from_telemetry(cls, paths=None):
+        paths = [path for path in (paths or [telemetry.telemetry_file()]) if path and os.path.exists(path)]
+        return cls(telemetry.load(paths))
+
+    def estimate(self, command, input_bytes):
+        base, slope = self.models.get(command, DEFAULT_MODEL)
+        return int((base + slope * input_bytes) * MARGIN)
+
+
+def address_space_cap(estimate):
+    return max(MIN_CAP, CAP_FACTOR * estimate)
+
+
+def limit_address_space(cap):
+    """Lowers the soft RLIMIT_AS of the process, and so of the tools it
+    starts, to cap; None restores the hard limit. Only the soft limit is
+    set, so that a pool process can run a bigger job next."""
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if cap is None:
+        soft = hard
+    else:
+        soft = cap if hard == resource.RLIM_INFINITY else min(cap, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""asyncio interface to the conversions and checks.
+
+Every coroutine validates its inputs like the matching command, runs the
+tool with asyncio.create_subprocess_exec and returns a Result. Nothing is
+printed and nothing exits: bad inputs raise InvalidInput, failed runs
+RunFailed and runs over their timeout RunTimeout. Cancelling a coroutine
+kills the tool together with its children.
+
+    result = await api.gds_to_mag("top.gds", "out", pdk_root, "sky130A", timeout=600)
+"""
+import asyncio
+import functools
+import io
+import os
+import signal
+import time
+from collections import deque, namedtuple
+
+from rich.console import Console
+
+from . import common
+from .common import UtilitiesError
+from .reports import count_markers
+
+LOG_TAIL = 50
+
+# outputs are the files the run produced, log_tail the last lines of the
+# combined stdout and stderr, details anything specific to the tool
+Result = namedtuple("Result", "returncode outputs duration log_tail details")
+
+
+class InvalidInput(UtilitiesError):
+    pass
+
+
+class RunFailed(UtilitiesError):
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+
+class RunTimeout(RunFailed):
+    pass
+
+
+def quiet_console():
+    return Console(file=io.StringIO())
+
+
+def kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def run_process(command, env=None, cwd=None, timeout=None, log_file=None, tail=LOG_TAIL):
+    """Runs command and returns (returncode, duration, last lines of output).
+
+    The output is also appended to log_file when given. The process runs in
+    its own session so a timeout or cancellation kills everything it started.
+    """
+    start = time.time()
+    lines = deque(maxlen=tail)
+    log = open(log_file, "ab") if log_file else None
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                env=env,
+                cwd=cwd,
+                start_new_session=True,
+            )
+        except OSError as e:
+            # e.g. the tool isn't installed; there is no return code
+            raise RunFailed(f"can't run {command[0]} : {e}", Result(None, [], time.time() - start, [], {})) from e
+
+        async def read_output():
+            async for line in process.stdout:
+                lines.append(line.decode(errors="replace").rstrip("\n"))
+                if log:
+                    log.write(line)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(read_output(), process.wait()), timeout)
+        except asyncio.TimeoutError:
+            kill(process)
+            await process.wait()
+            result = Result(process.returncode, [], time.time() - start, list(lines), {})
+            raise RunTimeout(f"{command[0]} timed out after {timeout}s", result)
+        except asyncio.CancelledError:
+            kill(process)
+            await process.wait()
+            raise
+    finally:
+        if log:
+            log.close()
+    return process.returncode, time.time() - start, list(lines)
+
+
+def finish(name, returncode, duration, log_tail, outputs, details=None):
+    result = Result(returncode, [output for output in outputs if os.path.exists(output)], duration, log_tail, details or {})
+    if returncode != 0:
+        raise RunFailed(f"{name} exited with {returncode}", result)
+    missing = [output for output in outputs if not os.path.exists(output)]
+    if missing:
+        raise RunFailed(f"{name} did not write {', '.join(missing)}", result)
+    return result
+
+
+async def in_thread(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+
+async def prepare(conversion, *args, **kwargs):
+    # preparing reads the input (gds preflight, def components), which
+    # mustn't block the event loop
+    try:
+        return await in_thread(conversion.prepare, quiet_console(), *args, **kwargs)
+    except UtilitiesError as e:
+        raise InvalidInput(str(e)) from e
+
+
+async def run_magic(job, use_cache=False, timeout=None, log_file=None, cwd=None):
+    staged = await in_thread(common.stage_job, job)
+    try:
+        return await run_magic_job(job, staged, use_cache, timeout, log_file, cwd)
+    finally:
+        await in_thread(common.release_scratch, job, staged)
+
+
+async def run_magic_job(job, staged, use_cache=False, timeout=None, log_file=None, cwd=None):
+    cache_key = None
+    if use_cache and job.outputs:
+        hit, cache_key = await in_thread(common.cache_lookup, quiet_console(), job)
+        if hit:
+            return Result(0, list(job.outputs), 0.0, [], {"cached": True})
+    lock = await in_thread(common.lock_extraction, job)
+    try:
+        returncode, duration, log_tail = await run_process(
+            common.magic_command(job), common.magic_environment(staged), cwd, timeout, log_file
+        )
+    finally:
+        if lock:
+            lock.close()
+    if returncode == 0:
+        try:
+            await in_thread(common.publish_job, job, staged)
+        except OSError as e:
+            result = Result(returncode, [], duration, log_tail, {"cached": False})
+            raise RunFailed(f"can't publish {', '.join(job.outputs)} : {e}", result) from e
+    if cache_key:
+        await in_thread(common.cache_store, job, cache_key, returncode)
+    return finish(job.script, returncode, duration, log_tail, job.outputs, {"cached": False})
+
+
+def async_conversion(conversion):
+    async def run(*args, use_cache=False, timeout=None, log_file=None, **kwargs):
+        job = await prepare(conversion, *args, **kwargs)
+        return await run_magic(job, use_cache, timeout, log_file)
+
+    run.__name__ = run.__qualname__ = conversion.__name__
+    run.__doc__ = (
+        f"Async {conversion.__name__}, takes the arguments of common.{conversion.__name__} "
+        "without the console, plus use_cache, timeout (s) and log_file."
+    )
+    return run
+
+
+gds_to_mag = async_conversion(common.gds_to_mag)
+mag_to_gds = async_conversion(common.mag_to_gds)
+gds_to_def = async_conversion(common.gds_to_def)
+mag_to_def = async_conversion(common.mag_to_def)
+def_to_gds = async_conversion(common.def_to_gds)
+def_to_mag = async_conversion(common.def_to_mag)
+mag_to_lef = async_conversion(common.mag_to_lef)
+gds_to_lef = async_conversion(common.gds_to_lef)
+def_to_lef = async_conversion(common.def_to_lef)
+convert = async_conversion(common.convert)
+
+
+def check_paths(*paths):
+    for path in paths:
+        if not os.path.exists(path):
+            raise InvalidInput(f"{path} path doesn't exist")
+
+
+async def drc(gds_file, output_path, flags=("-f", "-b", "-og"), timeout=None, log_file=None):
+    """Runs the precheck klayout decks selected by flags; the outputs are the
+    report databases and details holds the number of markers, in total as
+    "violations" and per report as "markers". The precheck exits non-zero
+    on violations too, so only a run that wrote no report fails."""
+    gds_file = os.path.abspath(gds_file)
+    output_path = os.path.abspath(output_path)
+    check_paths(gds_file, output_path)
+    precheck_root = await in_thread(common.precheck_checkout)
+    command = common.drc_command(precheck_root, gds_file, output_path, list(flags))
+    returncode, duration, log_tail = await run_process(command, timeout=timeout, log_file=log_file)
+    reports = common.lyrdb_reports(output_path)
+    if not reports:
+        raise RunFailed(f"drc exited with {returncode} without a report", Result(returncode, [], duration, log_tail, {}))
+    markers = await in_thread(lambda: {path: sum(count_markers(path).values()) for path in reports})
+    return Result(returncode, reports, duration, log_tail, {"violations": sum(markers.values()), "markers": markers})
+
+
+async def lvs(design_dir, output_path, design_name, config_file, pdk_root, pdk, tag=None, timeout=None, log_file=None):
+    """Runs the precheck LVS; the outputs are the files of the design's
+    output directory. Without a tag the extraction of the last run is
+    reused when the gds, netlist and config did not change."""
+    design_dir = os.path.abspath(design_dir)
+    output_path = os.path.abspath(output_path)
+    config_file = os.path.abspath(config_file)
+    check_paths(design_dir, output_path, config_file, os.path.join(pdk_root, pdk))
+    precheck_root = await in_thread(common.precheck_checkout)
+    os.makedirs(f'{output_path}/{design_name}', exist_ok=True)
+    key = None
+    if not tag:
+        key = await in_thread(common.lvs_extraction_key, design_dir, design_name, config_file, pdk)
+        tag = common.lvs_reused_tag(output_path, design_name, key)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = precheck_root
+    command = common.lvs_command(precheck_root, design_dir, output_path, design_name, config_file, pdk_root, pdk, tag)
+    returncode, duration, log_tail = await run_process(command, env, precheck_root, timeout, log_file)
+    result = finish("lvs", returncode, duration, log_tail, [])
+    if key:
+        common.lvs_record(output_path, design_name, key)
+    design_output = f'{output_path}/{design_name}'
+    return result._replace(outputs=sorted(os.path.join(design_output, name) for name in os.listdir(design_output)))
+
+
+async def xor(design_name, design1, design2, threads=None, tile_size=None, layers=None, timeout=None, log_file=None):
+    """XORs design_name in both layouts into <design_name>-xor.gds next to
+    design1; details holds the total and the per layer differences."""
+    design1 = os.path.abspath(design1)
+    design2 = os.path.abspath(design2)
+    check_paths(design1, design2)
+    output_dir = os.path.dirname(design1)
+    xor_gds, total_file = f'{output_dir}/{design_name}-xor.gds', f'{output_dir}/xor_output.txt'
+    command = common.xor_command(design_name, design1, design2, xor_gds, total_file, threads, tile_size, layers)
+    returncode, duration, log_tail = await run_process(command, timeout=timeout, log_file=log_file)
+    result = finish("xor", returncode, duration, log_tail, [xor_gds, total_file])
+    total, counts = common.read_xor_totals(total_file)
+    return result._replace(details={"total": total, "layers": counts})
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+from rich.table import Table
+
+from . import telemetry
+from .admission import MemoryModel, address_space_cap, limit_address_space
+from .cache import format_size
+from .common import UtilitiesError, abort
+
+# options that name outputs or whole installations rather than inputs
+IGNORED_OPTIONS = ("output", "pdk_root", "log_dir")
+
+
+def load_manifest(console, manifest, key="jobs"):
+    """Reads a yaml, json or csv manifest into a list of jobs.
+
+    Every job has a `command` (the name of a utilities command), an optional
+    `input` (the command's argument) and its options, given either inline or
+    under `options`. In csv manifests multiple values of one option are
+    separated by whitespace. A yaml or json mapping lists the jobs under
+    key.
+    """
+    if not os.path.exists(manifest):
+        abort(console, f"{manifest} path doesn't exist")
+    extension = os.path.splitext(manifest)[1].lower()
+    with open(manifest) as f:
+        if extension in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                abort(console, "pyyaml is needed to read yaml manifests")
+            data = yaml.safe_load(f)
+        elif extension == ".json":
+            data = json.load(f)
+        elif extension == ".csv":
+            data = [{k: v for k, v in row.items() if v} for row in csv.DictReader(f)]
+        else:
+            abort(console, f"unknown manifest format {extension}")
+    if isinstance(data, dict):
+        data = data.get(key, [])
+    jobs = []
+    for index, entry in enumerate(data or []):
+        entry = dict(entry)
+        options = dict(entry.pop("options", None) or {})
+        command = entry.pop("command", None) or entry.pop("type", None)
+        if not command:
+            abort(console, f"job {index} in {manifest} has no command")
+        name = entry.pop("name", None) or f"{index}-{command}"
+        jobs.append(
+            {
+                "name": str(name),
+                "command": command,
+                "input": entry.pop("input", None),
+                "options": {**entry, **options},
+            }
+        )
+    return jobs
+
+
+def is_true(value):
+    return value is True or str(value).lower() in ("1", "true", "yes", "y")
+
+
+def job_args(command, job, flags=()):
+    """Turns a job into the command line of its click command."""
+    params = {param.name: param for param in command.params}
+    args = [str(job["input"])] if job.get("input") is not None else []
+    for key, value in job["options"].items():
+        param = params.get(key.replace("-", "_"))
+        if param is None or not isinstance(param, click.Option):
+            raise UtilitiesError(f"{command.name} has no option {key}")
+        if param.is_flag:
+            if is_true(value):
+                args.append(param.opts[0])
+            continue
+        if isinstance(value, (list, tuple)):
+            values = value
+        elif param.multiple and isinstance(value, str):
+            values = value.split()
+        else:
+            values = [value]
+        for value in values:
+            args += [param.opts[0], str(value)]
+    # batch wide flags such as --use-pool apply to every command that has them
+    for flag in flags:
+        if flag in params and params[flag].opts[0] not in args:
+            args.append(params[flag].opts[0])
+    return args
+
+
+def job_inputs(job):
+    """Returns the files and the directories a job reads, from its argument
+    and the options that name existing paths."""
+    values = [job.get("input")]
+    for key, value in job["options"].items():
+        if key.replace("-", "_") in IGNORED_OPTIONS:
+            continue
+        values += value if isinstance(value, (list, tuple)) else str(value).split()
+    files, directories = set(), set()
+    for value in values:
+        if value is None or not os.path.exists(str(value)):
+            continue
+        path = os.path.abspath(str(value))
+        if os.path.isdir(path):
+            directories.add(path)
+        else:
+            files.add(path)
+            # magic looks for the subcells of a .mag next to it
+            if path.endswith(".mag"):
+                directories.add(os.path.dirname(path))
+    return files, directories
+
+
+def job_input_bytes(job):
+    files, directories = job_inputs(job)
+    return sum(telemetry.path_size(path) for path in files | directories)
+
+
+def run_job(job, log_dir=None, flags=(), memory_cap=None):
+    from .manage import commands
+
+    start = time.time()
+    status, detail = "ok", ""
+    saved_fds = None
+    if log_dir:
+        log_name = re.sub(r"[^\w.-]", "_", job["name"])
+        log = open(os.path.join(log_dir, f"{log_name}.log"), "w")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = os.dup(1), os.dup(2)
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    try:
+        if memory_cap:
+            limit_address_space(memory_cap)
+        if job["command"] not in commands:
+            raise UtilitiesError(f"unknown command {job['command']}")
+        command = commands[job["command"]]
+        with command.make_context(command.name, job_args(command, job, flags)) as ctx:
+            returncode = ctx.invoke(command.callback, **ctx.params)
+        if returncode:
+            status, detail = "failed", f"exit code {returncode}"
+    except click.ClickException as e:
+        status, detail = "failed", e.format_message()
+    except UtilitiesError as e:
+        status, detail = "failed", str(e)
+    except Exception as e:
+        status, detail = "failed", f"{type(e).__name__}: {e}"
+    finally:
+        if memory_cap:
+            limit_address_space(None)
+        if saved_fds:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+            log.close()
+    return {
+        "name": job["name"],
+        "command": job["command"],
+        "input": job.get("input"),
+        "status": status,
+        "detail": detail,
+        "duration": time.time() - start,
+    }
+
+
+def summary_table(results, title="batch summary"):
+    table = Table(title=title)
+    table.add_column("job")
+    table.add_column("command")
+    table.add_column("input")
+    table.add_column("status")
+    table.add_column("time (s)", justify="right")
+    for result in results:
+        color = "green" if result["status"] == "ok" else "red"
+        status = result["status"]
+        if result["detail"]:
+            status = f"{status}: {result['detail']}"
+        table.add_row(
+            result["name"],
+            result["command"],
+            str(result["input"] or ""),
+            f"[{color}]{status}",
+            f"{result['duration']:.1f}",
+        )
+    return table
+
+
+class WorkerPool:
+    """Process pool that outlives its workers.
+
+    A worker that dies, e.g. to the OOM killer, breaks a ProcessPoolExecutor:
+    every job in it fails and nothing more can be submitted. The executor
+    is then rebuilt and the jobs that were running are run again one at a
+    time, so that only the job that also kills its worker alone fails.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        # future: (task, run alone)
+        self.running = {}
+        self.queued = []
+        # jobs that were running when a worker died
+        self.suspects = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown()
+
+    def __len__(self):
+        return len(self.running) + len(self.queued) + len(self.suspects)
+
+    def free(self):
+        """Number of jobs that can start now."""
+        if self.queued or self.suspects or any(alone for _, alone in self.running.values()):
+            return 0
+        return self.processes - len(self.running)
+
+    def submit(self, key, function, *args):
+        self.queued.append((key, function, args))
+        self.start()
+
+    def start(self):
+        while True:
+            if self.suspects:
+                if self.running:
+                    return
+                task, alone = self.suspects.pop(0), True
+            elif self.queued and len(self.running) < self.processes:
+                task, alone = self.queued.pop(0), False
+            else:
+                return
+            try:
+                future = self.executor.submit(task[1], *task[2])
+            except BrokenProcessPool:
+                (self.suspects if alone else self.queued).insert(0, task)
+                if self.running:
+                    # wait() collects the jobs of the broken pool first
+                    return
+                self.rebuild()
+                continue
+            self.running[future] = (task, alone)
+
+    def rebuild(self):
+        self.executor.shutdown(wait=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.processes)
+
+    def wait(self):
+        """Waits for a job to finish. Returns (key, result, error) for the
+        jobs that finished, error telling why the worker of a failed job
+        died."""
+        self.start()
+        if not self.running:
+            return []
+        done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+        finished, broken = [], []
+        for future in done:
+            self.collect(future, finished, broken)
+        if broken:
+            # the other jobs of the broken pool fail too, right after
+            rest = list(self.running)
+            wait(rest)
+            for future in rest:
+                self.collect(future, finished, broken)
+            self.rebuild()
+            if len(broken) == 1:
+                task, error = broken[0]
+                finished.append((task[0], None, f"worker died: {error}"))
+            else:
+                self.suspects += [task for task, _ in broken]
+        self.start()
+        return finished
+
+    def collect(self, future, finished, broken):
+        task, alone = self.running.pop(future)
+        try:
+            finished.append((task[0], future.result(), None))
+        except BrokenProcessPool as e:
+            broken.append((task, e))
+
+
+def run_batch(console, jobs, processes=None, log_dir=None, flags=(), memory_budget=None, memory_cap=True):
+    """Runs jobs in parallel. With a memory_budget (bytes), jobs are only
+    started while the sum of their estimated peak memory fits in it; a job
+    estimated over the budget runs alone. With memory_cap, each job also
+    gets an address space limit derived from its estimate."""
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    processes = processes or os.cpu_count()
+    estimates = {}
+    if memory_budget:
+        model = MemoryModel.from_telemetry()
+        estimates = {index: model.estimate(job["command"], job_input_bytes(job)) for index, job in enumerate(jobs)}
+        oversized = [jobs[index]["name"] for index, estimate in estimates.items() if estimate > memory_budget]
+        if oversized:
+            console.print(f"[yellow]estimated over the memory budget, run alone : {' '.join(oversized)}")
+    results = {}
+    pending = list(range(len(jobs)))
+    used = 0
+    with WorkerPool(processes) as pool:
+        while pending or len(pool):
+            # jobs are started in manifest order, skipping those that don't
+            # fit yet; a job over the whole budget waits for the others to
+            # finish and runs alone
+            for index in list(pending):
+                if not pool.free():
+                    break
+                need = estimates.get(index, 0)
+                if memory_budget and len(pool) and need > memory_budget:
+                    break
+                if memory_budget and len(pool) and used + need > memory_budget:
+                    continue
+                pending.remove(index)
+                cap = address_space_cap(need) if memory_budget and memory_cap else None
+                pool.submit(index, run_job, jobs[index], log_dir, flags, cap)
+                used += need
+                if memory_budget and need > memory_budget:
+                    break
+            for index, result, error in pool.wait():
+                used -= estimates.get(index, 0)
+                if error:
+                    if index in estimates:
+                        # most likely the OOM killer, the estimate was too low
+                        error = f"{error} (estimated {format_size(estimates[index])})"
+                    job = jobs[index]
+                    result = {
+                        "name": job["name"],
+                        "command": job["command"],
+                        "input": job.get("input"),
+                        "status": "failed",
+                        "detail": error,
+                        "duration": 0.0,
+                    }
+                color = "green" if result["status"] == "ok" else "red"
+                console.print(
+                    f"[{color}]{result['status']}[/{color}] {result['name']} ({result['duration']:.1f}s)"
+                )
+                results[index] = result
+    results = [results[index] for index in range(len(jobs))]
+    console.print(summary_table(results))
+    return results
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size):
+    """Parses a size such as 500M or 10G into bytes; raises ValueError."""
+    text = str(size).strip().upper()
+    text = text[:-1] if text.endswith("B") else text
+    try:
+        if text and text[-1] in SIZE_UNITS:
+            value = int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+        else:
+            value = int(text)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise ValueError(f"invalid size {size}, expected e.g. 500M or 10G")
+    return value
+
+
+def format_size(size):
+    for unit in ("", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.1f}{unit}B" if unit else f"{size}B"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def default_cache_dir():
+    if os.environ.get("UTILITIES_CACHE_DIR"):
+        return os.environ["UTILITIES_CACHE_DIR"]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "utilities")
+
+
+def write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ResultCache:
+    """Content addressed store of conversion outputs.
+
+    Entries live in `objects/<key[:2]>/<key>/` next to a `manifest.json`
+    whose mtime records the last use of the entry, which is what the LRU
+    eviction sorts on. File digests are memoized under `stat/` by path,
+    size and mtime so unchanged inputs are not re-read on every lookup.
+    The total size is tracked in `size`, so a store only walks the
+    entries to prune them once the cache grew past max_size.
+    """
+
+    def __init__(self, root=None, max_size=None):
+        self.root = root or default_cache_dir()
+        self.max_size = parse_size(
+            max_size or os.environ.get("UTILITIES_CACHE_SIZE", "10G")
+        )
+        self.objects = os.path.join(self.root, "objects")
+        self.stat_dir = os.path.join(self.root, "stat")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.stat_dir, exist_ok=True)
+
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        memo = os.path.join(
+            self.stat_dir, hashlib.sha1(path.encode()).hexdigest()
+        )
+        signature = f"{stat.st_size} {stat.st_mtime_ns}"
+        try:
+            with open(memo) as f:
+                recorded, digest = f.read().rsplit(" ", 1)
+            if recorded == signature:
+                return digest
+        except (OSError, ValueError):
+            pass
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        write_atomic(memo, f"{signature} {digest}")
+        return digest
+
+    def path_digest(self, path, suffixes=None):
+        # directories are hashed the way magic searches them: their files,
+        # without descending into subdirectories, and only those ending in
+        # one of suffixes if given
+        if not os.path.isdir(path):
+            return self.file_digest(path)
+        sha = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(path, name)
+            if os.path.isfile(child) and (suffixes is None or name.endswith(suffixes)):
+                sha.update(f"{name}\0{self.file_digest(child)}\0".encode())
+        return sha.hexdigest()
+
+    def key(self, files, values=None, suffixes=None):
+        sha = hashlib.sha256()
+        for path in files:
+            sha.update(f"{self.path_digest(path, suffixes)}\0".encode())
+        for name, value in sorted((values or {}).items()):
+            sha.update(f"{name}={value}\0".encode())
+        return sha.hexdigest()
+
+    def extraction_dir(self, macro):
+        """Working directory of the extractions of one design, where magic
+        keeps its .ext files between runs."""
+        macro = os.path.abspath(macro)
+        name = os.path.splitext(os.path.basename(macro))[0]
+        directory = os.path.join(self.root, "extract", f"{name}-{hashlib.sha1(macro.encode()).hexdigest()[:12]}")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def entry(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    def fetch(self, key, outputs):
+        entry = self.entry(key)
+        manifest_path = os.path.join(entry, "manifest.json")
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        files = manifest["files"]
+        for output in outputs:
+            stored = os.path.join(entry, os.path.basename(output))
+            recorded = files.get(os.path.basename(output))
+            # outputs are restored as hard links, so a stored file that was
+            # modified in place through one of them can no longer be trusted
+            try:
+                stat = os.stat(stored)
+            except OSError:
+                recorded = None
+            if recorded is None or recorded != [stat.st_size, stat.st_mtime_ns]:
+                self.remove(key)
+                return False
+        for output in outputs:
+            stored = os.path.join(entry, os.path.basename(output))
+            if os.path.lexists(output):
+                os.remove(output)
+            try:
+                os.link(stored, output)
+            except OSError:
+                shutil.copy2(stored, output)
+        os.utime(manifest_path)
+        return True
+
+    def store(self, key, outputs):
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".tmp-")
+        files = {}
+        for output in outputs:
+            stored = os.path.join(tmp, os.path.basename(output))
+            shutil.copy2(output, stored)
+            stat = os.stat(stored)
+            files[os.path.basename(output)] = [stat.st_size, stat.st_mtime_ns]
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"files": files, "created": time.time()}, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another process stored the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        size = self.track_size(sum(os.stat(os.path.join(entry, name)).st_size for name in os.listdir(entry)))
+        if size is None or size > self.max_size:
+            self.prune()
+
+    def track_size(self, added=0, total=None):
+        """Adds added bytes to the tracked size of the cache, or sets it to
+        total. Returns the tracked size, None while it isn't known."""
+        with open(os.path.join(self.root, "size"), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if total is None:
+                f.seek(0)
+                try:
+                    total = int(f.read()) + added
+                except ValueError:
+                    return None
+            f.seek(0)
+            f.truncate()
+            f.write(str(total))
+        return total
+
+    def remove(self, key):
+        shutil.rmtree(self.entry(key), ignore_errors=True)
+
+    def entries(self):
+        for prefix in os.listdir(self.objects):
+            prefix_dir = os.path.join(self.objects, prefix)
+            if prefix.startswith(".") or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.startswith("."):
+                    continue
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    last_use = os.stat(os.path.join(entry, "manifest.json")).st_mtime
+                except OSError:
+                    continue
+                size = sum(
+                    os.stat(os.path.join(entry, name)).st_size
+                    for name in os.listdir(entry)
+                )
+                yield key, size, last_use
+
+    def stats(self):
+        entries = list(self.entries())
+        return {
+            "path": self.root,
+            "entries": len(entries),
+            "size": sum(size for _, size, _ in entries),
+            "max_size": self.max_size,
+            "oldest_use": min((last_use for _, _, last_use in entries), default=None),
+            "newest_use": max((last_use for _, _, last_use in entries), default=None),
+        }
+
+    def prune(self, max_size=None):
+        max_size = self.max_size if max_size is None else parse_size(max_size)
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for key, size, _ in entries:
+            if total <= max_size:
+                break
+            self.remove(key)
+            total -= size
+            removed += 1
+        self.track_size(total=total)
+        return removed, total
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -12,69 +12,387 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import fcntl
+import functools
+import glob
+import json
 import os
+import shutil
 import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+from rich.table import Table
+
+from .cache import get_cache, write_atomic
+from .lefdef import DefError, def_to_lef_abstract
+from .macros import select_macros
+from .mag import mag_hierarchy
+from .gds import GDSError, compare_cells, hash_cells, layer_hashes, merge_libraries, read_library, shape_layers, xor_roots
+from .reports import count_markers, ingest_lyrdb, ingest_xor, is_lyrdb, merge_lyrdb, open_db
+from .magic_pool import get_pool
+from . import compress, density as layer_density, logs, stage, telemetry
+
+HELPER_LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "helper_lib")
+# magic_env entries that only carry paths; the cache hashes what they point to
+PATH_VARIABLES = {"MACRO", "MACRO_READY", "MACRO_SOURCE", "GDS_OUTPUT", "OUTPUT", "EXTRACT_DIR", "PDK_ROOT", "MAGLEF_MACRO", "GDS_MACRO", "MAG_DIR", "EXTRA_LEFS", "EXTRA_GDS_FILES"}
+
+
+class UtilitiesError(Exception):
+    pass
+
+
+def abort(console, message):
+    console.print(f"[red]ERROR : {message}")
+    raise UtilitiesError(message)
+
+
+def tech_lefs(pdk_root, pdk):
+    return [
+        f"{pdk_root}/{pdk}/libs.ref/{library}/techlef/{library}__nom.tlef"
+        for library in ("sky130_fd_sc_hd", "sky130_fd_sc_hvl")
+    ]
+
+
+def output_file(directory, macro, extension):
+    # same as [file rootname [file tail $::env(MACRO)]] in the helper scripts,
+    # where a compressed MACRO is already decompressed
+    return os.path.join(directory, os.path.splitext(os.path.basename(compress.plain_name(macro)))[0] + extension)
+
+
+def preflight_gds(console, gds_file, top=None, stream=None):
+    """Checks that gds_file is a readable GDSII stream and picks its top cell;
+    stream is read instead of the file when given."""
+    try:
+        library = read_library(stream or gds_file)
+    except (GDSError, OSError, IndexError) as e:
+        abort(console, f"{gds_file} is not a valid gds : {e}")
+    return library_top(console, gds_file, library, top)
+
+
+def library_top(console, gds_file, library, top=None):
+    """Picks the top cell of the Library read from gds_file."""
+    if not library.structures:
+        abort(console, f"{gds_file} has no cells")
+    tops = library.tops
+    if top:
+        if top not in library.structures:
+            abort(console, f"{top} is not a cell of {gds_file}, its top cells are {', '.join(tops)}")
+    elif len(tops) == 1:
+        top = tops[0]
+    elif os.path.splitext(os.path.basename(compress.plain_name(gds_file)))[0] in tops:
+        top = os.path.splitext(os.path.basename(compress.plain_name(gds_file)))[0]
+    else:
+        abort(console, f"{gds_file} has several top cells ({', '.join(tops)}), pick one with --top")
+    missing = library.missing
+    if missing:
+        console.print(f"[yellow]WARNING : {gds_file} references undefined cells: {', '.join(missing)}")
+    # the preflight reads no shapes, so the size is only known to readers
+    # that set the boxes of the structures
+    box = library.bbox(top)
+    size = ""
+    if box and library.dbu:
+        size = f", {(box[2] - box[0]) * library.dbu:.3f} x {(box[3] - box[1]) * library.dbu:.3f} um"
+    console.print(f"{gds_file} : top cell {top}, {len(library.structures)} cells{size}")
+    return top
+
+
+def gds_input(console, magic_env, gds_file, top=None):
+    """Sets MACRO and TOP_CELL for gds_file. A .gz/.zst gds is decompressed
+    into scratch and checked in the background while magic starts, and the
+    helper scripts wait for it (see compress.py)."""
+    suffix = compress.compression(gds_file)
+    if not suffix:
+        magic_env['MACRO'] = gds_file
+        magic_env['TOP_CELL'] = preflight_gds(console, gds_file, top)
+        return
+    if not compress.supported(suffix):
+        abort(console, f"the zstandard module is needed to read {gds_file}")
+    decompression = compress.decompress(gds_file, lambda stream: preflight_gds(console, gds_file, top, stream))
+    magic_env['MACRO'] = decompression.path
+    magic_env['MACRO_READY'] = decompression.ready
+    magic_env['MACRO_SOURCE'] = os.path.abspath(gds_file)
+
+
+def gds_output(console, magic_env, output, macro, suffix):
+    """Returns the gds output of a job. With a compression suffix magic
+    writes the gds into scratch and it is compressed into output after the
+    run, see publish_outputs."""
+    if not suffix:
+        return output_file(output, macro, ".gds")
+    suffix = suffix if suffix.startswith(".") else f".{suffix}"
+    if suffix not in compress.COMPRESSIONS:
+        abort(console, f"unknown compression {suffix}, expected one of {', '.join(compress.COMPRESSIONS)}")
+    if not compress.supported(suffix):
+        abort(console, f"the zstandard module is needed to write {suffix} files")
+    magic_env['GDS_OUTPUT'] = compress.scratch_dir()
+    return output_file(output, macro, ".gds") + suffix
+
+
+def publish_outputs(job):
+    """Compresses the gds that magic wrote into scratch into its output."""
+    if 'GDS_OUTPUT' not in job.env:
+        return
+    for output in job.outputs:
+        if compress.compression(output):
+            plain = os.path.join(job.env['GDS_OUTPUT'], os.path.basename(compress.plain_name(output)))
+            compress.compress_file(plain, output)
+            # a staged job compresses next to the plain gds, which mustn't
+            # be published
+            os.remove(plain)
+
+
+def release_scratch(job, staged=None):
+    """Removes the scratch directories of job, and the OUTPUT of its staged
+    copy."""
+    if 'MACRO_READY' in job.env:
+        compress.release(job.env['MACRO_READY'])
+    if 'GDS_OUTPUT' in job.env:
+        shutil.rmtree(job.env['GDS_OUTPUT'], ignore_errors=True)
+    if staged is not None and staged is not job:
+        shutil.rmtree(staged.env['OUTPUT'], ignore_errors=True)
+
+
+def macro_source(job):
+    """The input file of a job as given, also when magic reads a
+    decompressed copy."""
+    return job.env.get('MACRO_SOURCE') or job.env['MACRO']
+
+
+def gds_info(console, gds_file):
+    try:
+        library = read_library(gds_file, boxes=True)
+    except (GDSError, OSError, IndexError) as e:
+        abort(console, f"{gds_file} is not a valid gds : {e}")
+    console.print(f"library : {library.name}")
+    console.print(f"dbu     : {library.dbu} um")
+    console.print(f"cells   : {len(library.structures)}")
+    for top in library.tops:
+        box = library.bbox(top)
+        if box and library.dbu:
+            box = ", ".join(f"{value * library.dbu:.3f}" for value in box)
+            console.print(f"top     : {top} ({box} um)")
+        else:
+            console.print(f"top     : {top} (empty)")
+    for missing in library.missing:
+        console.print(f"[yellow]missing : {missing}")
+    return library
+
+
+# Everything needed to run one helper script; the conversions below build
+# one and the magic_conversion wrapper runs it.
+MagicJob = namedtuple("MagicJob", "pdk_root pdk script env outputs dependencies")
+# the files magic reads from the directories of its search path
+MAG_SUFFIXES = (".mag", ".mag.gz")
+
+
+def magic_command(job):
+    rcfile = f"{job.pdk_root}/{job.pdk}/libs.tech/magic/{job.pdk}.magicrc"
+    return ["magic", "-noconsole", "-dnull", "-rcfile", rcfile, os.path.join(HELPER_LIB, job.script)]
+
+
+def magic_environment(job):
+    # the job's variables win, as in a pool worker (see pool_worker.tcl)
+    magic_env = dict(os.environ)
+    magic_env.update(job.env)
+    return magic_env
+
+
+def cache_lookup(console, job):
+    """Returns (hit, key). On a hit the outputs of job were restored from the
+    result cache, otherwise they should be stored under key after the run."""
+    cache = get_cache()
+    rcfile, script = magic_command(job)[-2:]
+    key_files = [script, rcfile, macro_source(job), *job.dependencies]
+    key_files += [lef for lef in tech_lefs(job.pdk_root, job.pdk) if os.path.exists(lef)]
+    key_values = {name: value for name, value in job.env.items() if name not in PATH_VARIABLES}
+    key_values['OUTPUTS'] = " ".join(os.path.basename(output) for output in job.outputs)
+    # only the cells of a directory, not the outputs, logs and manifests
+    # of a run writing into the directory it reads
+    cache_key = cache.key(key_files, key_values, suffixes=MAG_SUFFIXES)
+    if cache.fetch(cache_key, job.outputs):
+        console.print(f"[green]cache hit : {' '.join(job.outputs)}")
+        return True, cache_key
+    for output in job.outputs:
+        # a previous hit may have left a hard link into the cache here
+        if os.path.lexists(output):
+            os.remove(output)
+    return False, cache_key
+
+
+def cache_store(job, cache_key, returncode):
+    if returncode == 0 and all(os.path.exists(output) for output in job.outputs):
+        get_cache().store(cache_key, job.outputs)
+
+
+def lock_extraction(job):
+    """Locks the extraction directory of job, if it has one, against other
+    runs of the same design; closing the returned file releases it."""
+    if 'EXTRACT_DIR' not in job.env:
+        return None
+    lock = open(os.path.join(job.env['EXTRACT_DIR'], ".lock"), "w")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def job_base(job):
+    """Path next to the first output that the log and the manifest of a
+    job are named after, e.g. out/top.mag_to_gds."""
+    step = os.path.splitext(job.script)[0]
+    return f"{os.path.splitext(compress.plain_name(job.outputs[0]))[0]}.{step}"
+
+
+def magic_log(job):
+    """Returns the progress label and the log file of a job; the log goes
+    next to its first output."""
+    step = os.path.splitext(job.script)[0]
+    label = f"{step} {os.path.basename(job.env['MACRO'])}"
+    if not job.outputs or not os.path.isdir(os.path.dirname(os.path.abspath(job.outputs[0]))):
+        return label, None
+    return label, logs.log_path(job_base(job))
+
+
+def stage_job(job):
+    """Returns job with OUTPUT and its outputs moved into a new local
+    scratch directory, see publish_job."""
+    if 'OUTPUT' not in job.env or not job.outputs:
+        return job
+    scratch = compress.scratch_dir()
+    outputs = [os.path.join(scratch, os.path.basename(output)) for output in job.outputs]
+    env = dict(job.env, OUTPUT=scratch)
+    if 'GDS_OUTPUT' in env:
+        # scratch already, the gds is compressed where magic wrote it
+        env['GDS_OUTPUT'] = scratch
+    return job._replace(env=env, outputs=outputs)
+
+
+def publish_job(job, staged):
+    """Publishes what the staged job wrote into the OUTPUT of job, with a
+    manifest `<job_base>.manifest.json` of their sizes and checksums."""
+    publish_outputs(staged)
+    if staged is job:
+        return
+    details = {"script": job.script, "input": os.path.abspath(macro_source(job))}
+    stage.publish(staged.env['OUTPUT'], job.env['OUTPUT'], job_base(job) + stage.MANIFEST_SUFFIX, details)
+
+
+def run_magic(console, job, use_pool=False, use_cache=False, staging=True):
+    """Runs job in local scratch and publishes its outputs; staging=False
+    runs it in place, for jobs that write into scratch already."""
+    staged = stage_job(job) if staging else job
+    try:
+        return run_magic_job(console, job, staged, use_pool, use_cache)
+    finally:
+        release_scratch(job, staged)
+
+
+def run_magic_job(console, job, staged, use_pool=False, use_cache=False):
+    cache_key = None
+    inputs = [macro_source(job), *job.dependencies]
+    if use_cache and job.outputs:
+        hit, cache_key = cache_lookup(console, job)
+        if hit:
+            telemetry.record("magic", inputs, job.outputs, script=job.script, returncode=0, cached=True)
+            return 0
+    label, log_file = magic_log(job)
+    lock = lock_extraction(job)
+    try:
+        if use_pool:
+            rcfile, script = magic_command(job)[-2:]
+            start = time.time()
+            with logs.LogCapture(label, log_file) as capture:
+                returncode = get_pool().run(rcfile, script, staged.env, output=capture.feed)
+            capture.report(returncode)
+            # the worker outlives the job, so only the wall time is its own
+            telemetry.record(
+                "magic", inputs, staged.outputs, script=job.script, returncode=returncode, pool=True,
+                wall=time.time() - start, phases=capture.phases, log=log_file,
+            )
+        else:
+            returncode = logs.run_tool(
+                magic_command(job), "magic", label, magic_environment(staged), log_file=log_file,
+                inputs=inputs, outputs=staged.outputs, script=job.script,
+            )
+    finally:
+        if lock:
+            lock.close()
+    if returncode == 0:
+        try:
+            publish_job(job, staged)
+        except OSError as e:
+            abort(console, f"can't publish {', '.join(job.outputs)} : {e}")
+    if cache_key:
+        cache_store(job, cache_key, returncode)
+    return returncode
+
+
+def magic_conversion(prepare):
+    """Wraps a function returning a MagicJob into one that runs it; the job
+    alone stays available as `.prepare` (see utilities.api)."""
+    @functools.wraps(prepare)
+    def staged(console, *args, **kwargs):
+        with compress.staging():
+            return prepare(console, *args, **kwargs)
+
+    @functools.wraps(prepare)
+    def run(console, *args, use_pool=False, use_cache=False, **kwargs):
+        return run_magic(console, staged(console, *args, **kwargs), use_pool, use_cache)
+    run.prepare = staged
+    return run
+
+@magic_conversion
 def gds_to_mag(
-    console, gds_file, output, pdk_root, pdk
+    console, gds_file, output, pdk_root, pdk, top=None
 ):
     magic_env = dict()
     if not os.path.exists(gds_file):
-        console.print(f"[red]ERROR : {gds_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{gds_file} path doesn't exist")
     else:
-        magic_env['MACRO'] = gds_file
+        gds_input(console, magic_env, gds_file, top)
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/gds_to_mag.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    outputs = [output_file(output, gds_file, ".mag")]
+    dependencies = ()
+    return MagicJob(pdk_root, pdk, "gds_to_mag.tcl", magic_env, outputs, dependencies)
 
+@magic_conversion
 def mag_to_gds(
-    console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk
+    console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, compress_gds=None
 ):
     magic_env = dict()
     if not os.path.exists(mag_file):
-        console.print(f"[red]ERROR : {mag_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{mag_file} path doesn't exist")
     else:
         magic_env['MACRO'] = mag_file
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if maglef_macro:
         mag_export = ""
         for maglefs in maglef_macro:
             if not os.path.exists(maglefs):
-                console.print(f"[red]ERROR : {maglefs} path doesn't exist")
-                exit(1)
+                abort(console, f"{maglefs} path doesn't exist")
             else:
                 mag_export = mag_export + maglefs + " "
         magic_env['MAGLEF_MACRO'] = f'"{mag_export.strip()}"'
@@ -82,8 +400,7 @@ def mag_to_gds(
         gds_export = ""
         for gds in gds_macro:
             if not os.path.exists(gds):
-                console.print(f"[red]ERROR : {gds} path doesn't exist")
-                exit(1)
+                abort(console, f"{gds} path doesn't exist")
             else:
                 gds_export = gds_export + gds + " "
         magic_env['GDS_MACRO'] = f'"{gds_export.strip()}"'
@@ -91,77 +408,160 @@ def mag_to_gds(
         mag_export = ""
         for mags in mag_dir:
             if not os.path.exists(mags):
-                console.print(f"[red]ERROR : {mags} path doesn't exist")
-                exit(1)
+                abort(console, f"{mags} path doesn't exist")
             else:
                 mag_export = mag_export + mags + " "
         magic_env['MAG_DIR'] = f'"{mag_export.strip()}"'
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/mag_to_gds.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    outputs = [gds_output(console, magic_env, output, mag_file, compress_gds)]
+    dependencies = [*(maglef_macro or ()), *(mag_dir or ()), *(gds_macro or ()), os.path.dirname(os.path.abspath(mag_file))]
+    return MagicJob(pdk_root, pdk, "mag_to_gds.tcl", magic_env, outputs, dependencies)
 
+def env_paths(value):
+    return value.strip('"').split() if value else []
+
+def mag_to_gds_incremental(
+    console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, compress_gds=None, use_pool=False, processes=None
+):
+    """mag_to_gds that keeps the gds of every subcell found under mag_dir in
+    the result cache, keyed by the hashes of its .mag and of its subcells.
+
+    Cached subcells are handed to magic as GDS_MACRO so only the cells that
+    changed and their ancestors are streamed again, each with the gds of its
+    clean children inlined. Only the gds of the top cell is compressed.
+    """
+    job = mag_to_gds.prepare(console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, compress_gds)
+    exclude = {os.path.basename(path).split(".")[0] for path in (*(maglef_macro or ()), *(gds_macro or ()))}
+    cells = mag_hierarchy(mag_file, mag_dir or (), exclude)
+    top = cells[-1]
+    cells = {cell.name: cell for cell in cells}
+    cache = get_cache()
+    rcfile, script = magic_command(job)[-2:]
+    key_files = [script, rcfile, *(maglef_macro or ()), *(gds_macro or ())]
+    key_files += [lef for lef in tech_lefs(pdk_root, pdk) if os.path.exists(lef)]
+    keys = {}
+    for name, cell in cells.items():
+        values = {"CELL": name, "CHILDREN": " ".join(keys[child] for child in cell.children)}
+        if cell is top:
+            # the top cell's gds may be compressed
+            values["OUTPUTS"] = " ".join(os.path.basename(output) for output in job.outputs)
+        keys[name] = cache.key([*key_files, cell.path], values)
+    if cache.fetch(keys[top.name], job.outputs):
+        release_scratch(job)
+        console.print(f"{job.outputs[0]} is up to date")
+        telemetry.record("magic", [mag_file], job.outputs, script=job.script, returncode=0, cached=True)
+        return 0
+    for output in job.outputs:
+        # a previous fetch may have left a hard link into the cache here
+        if os.path.lexists(output):
+            os.remove(output)
+    scratch = tempfile.mkdtemp(prefix="utilities-mag-to-gds-")
+    try:
+        cell_gds = {name: os.path.join(scratch, f"{name}.gds") for name in cells}
+        ready = set()
+        pending = []
+        stack = [top.name]
+        while stack:
+            name = stack.pop()
+            if name in pending:
+                continue
+            pending.append(name)
+            for child in cells[name].children:
+                if child in ready or child in pending:
+                    continue
+                if cache.fetch(keys[child], [cell_gds[child]]):
+                    ready.add(child)
+                else:
+                    stack.append(child)
+        console.print(f"{len(pending)} of {len(cells)} cells to stream, {len(ready)} from the cache")
+        # the magic runs record themselves, this only counts the cells
+        telemetry.record("incremental", [mag_file], (), cells=len(cells), streamed=len(pending), cached=len(ready))
+
+        def cell_job(name):
+            cell = cells[name]
+            env = dict(job.env, MACRO=cell.path)
+            env['GDS_MACRO'] = f'"{" ".join(env_paths(job.env.get("GDS_MACRO")) + [cell_gds[child] for child in cell.children])}"'
+            if name == top.name:
+                return job._replace(env=env)
+            env['OUTPUT'] = scratch
+            env.pop('GDS_OUTPUT', None)
+            return job._replace(env=env, outputs=[cell_gds[name]], dependencies=[cell.path])
+
+        def stream(name):
+            returncode = run_magic(console, cell_job(name), use_pool, staging=name == top.name)
+            if returncode == 0 and name != top.name:
+                cache.store(keys[name], [cell_gds[name]])
+            return returncode
+
+        with ThreadPoolExecutor(processes or os.cpu_count()) as executor:
+            while pending:
+                wave = [name for name in pending if all(child in ready for child in cells[name].children)]
+                if not wave:
+                    abort(console, f"cyclic cell references between {', '.join(pending)}")
+                for name, returncode in zip(wave, executor.map(telemetry.keep_command(stream), wave)):
+                    if returncode:
+                        abort(console, f"magic failed to stream {name}")
+                    ready.add(name)
+                    pending.remove(name)
+        cache.store(keys[top.name], job.outputs)
+        return 0
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        release_scratch(job)
+
+@magic_conversion
 def gds_to_def(
-    console, gds_file, output, pdk_root, pdk
+    console, gds_file, output, pdk_root, pdk, top=None
 ):
     magic_env = dict()
     if not os.path.exists(gds_file):
-        console.print(f"[red]ERROR : {gds_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{gds_file} path doesn't exist")
     else:
-        magic_env['MACRO'] = gds_file
+        gds_input(console, magic_env, gds_file, top)
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/gds_to_def.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    # the script changes to the extraction directory
+    magic_env['OUTPUT'] = os.path.abspath(output)
+    magic_env['EXTRACT_DIR'] = get_cache().extraction_dir(gds_file)
+    outputs = [output_file(output, gds_file, ".def")]
+    dependencies = ()
+    return MagicJob(pdk_root, pdk, "gds_to_def.tcl", magic_env, outputs, dependencies)
 
+@magic_conversion
 def mag_to_def(
     console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk
 ):
     magic_env = dict()
     if not os.path.exists(mag_file):
-        console.print(f"[red]ERROR : {mag_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{mag_file} path doesn't exist")
     else:
         magic_env['MACRO'] = mag_file
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if maglef_macro:
         mag_export = ""
         for maglefs in maglef_macro:
             if not os.path.exists(maglefs):
-                console.print(f"[red]ERROR : {maglefs} path doesn't exist")
-                exit(1)
+                abort(console, f"{maglefs} path doesn't exist")
             else:
                 mag_export = mag_export + maglefs + " "
         magic_env['MAGLEF_MACRO'] = f'"{mag_export.strip()}"'
@@ -169,8 +569,7 @@ def mag_to_def(
         gds_export = ""
         for gds in gds_macro:
             if not os.path.exists(gds):
-                console.print(f"[red]ERROR : {gds} path doesn't exist")
-                exit(1)
+                abort(console, f"{gds} path doesn't exist")
             else:
                 gds_export = gds_export + gds + " "
         magic_env['GDS_MACRO'] = f'"{gds_export.strip()}"'
@@ -178,86 +577,522 @@ def mag_to_def(
         mag_export = ""
         for mags in mag_dir:
             if not os.path.exists(mags):
-                console.print(f"[red]ERROR : {mags} path doesn't exist")
-                exit(1)
+                abort(console, f"{mags} path doesn't exist")
             else:
                 mag_export = mag_export + mags + " "
         magic_env['MAG_DIR'] = f'"{mag_export.strip()}"'
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/mag_to_def.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    # the script changes to the extraction directory
+    magic_env['OUTPUT'] = os.path.abspath(output)
+    magic_env['EXTRACT_DIR'] = get_cache().extraction_dir(mag_file)
+    outputs = [output_file(output, mag_file, ".def")]
+    dependencies = [*(maglef_macro or ()), *(mag_dir or ()), *(gds_macro or ()), os.path.dirname(os.path.abspath(mag_file))]
+    return MagicJob(pdk_root, pdk, "mag_to_def.tcl", magic_env, outputs, dependencies)
 
-def drc(console, gds_file, output_path):
-    gds_file = os.path.abspath(gds_file)
-    output_path = os.path.abspath(output_path)
+
+# sky130 gds layer numbers of li1 up to met5, the pad and the MiM caps,
+# which the BEOL deck checks. Shards depend on whole layer numbers, so the
+# BEOL shard also reruns on layer 66 (licon, enclosed by li1) and the FEOL
+# shard on layer 67.
+BEOL_LAYERS = {67, 68, 69, 70, 71, 72, 76, 89, 97}
+DRC_SHARDS = {
+    "feol": (["-f"], lambda layer: layer not in BEOL_LAYERS or layer == 67),
+    "beol": (["-b"], lambda layer: layer in BEOL_LAYERS or layer == 66),
+    "offgrid": (["-og"], lambda layer: True),
+}
+
+def precheck_checkout():
     precheck_root = os.path.join(os.path.expanduser("~"), "mpw_precheck")
     if not os.path.exists(precheck_root):
         subprocess.run(['git', 'clone', 'https://github.com/efabless/mpw_precheck.git', precheck_root])
-    if not os.path.exists(f'{output_path}/logs'):
-        os.mkdir(f'{output_path}/logs')
-    if not os.path.exists(f'{output_path}/outputs'):
-        os.mkdir(f'{output_path}/outputs')
-    if not os.path.exists(f'{output_path}/outputs/reports'):
-        os.mkdir(f'{output_path}/outputs/reports')
-    subprocess.run(['python3', f'{precheck_root}/checks/drc_checks/klayout/klayout_gds_drc_check.py', '-g', f'{gds_file}', '-o', f'{output_path}', '-f', '-b', '-og'])
-
-def lvs(console, design_dir, output_path, design_name, config_file, pdk_root, pdk, tag):
+    return precheck_root
+
+def drc_command(precheck_root, gds_file, output_path, flags):
+    for directory in ('logs', 'outputs', 'outputs/reports'):
+        os.makedirs(f'{output_path}/{directory}', exist_ok=True)
+    return ['python3', f'{precheck_root}/checks/drc_checks/klayout/klayout_gds_drc_check.py', '-g', f'{gds_file}', '-o', f'{output_path}', *flags]
+
+def run_drc_check(precheck_root, gds_file, output_path, flags):
+    name = "drc" + "".join(flags).replace("-", "_")
+    return logs.run_tool(
+        drc_command(precheck_root, gds_file, output_path, flags), "klayout", f"drc {os.path.basename(gds_file)} {' '.join(flags)}".rstrip(),
+        log_file=logs.log_path(f'{output_path}/logs/{name}'), inputs=[gds_file],
+        outputs=[f'{output_path}/outputs/reports'], deck=" ".join(flags),
+    )
+
+def drc_changes(console, gds_file, state):
+    """Hashes gds_file and returns (hashes, changed layer numbers); the
+    layers are None when everything has to be checked again."""
+    try:
+        layers, instances = layer_hashes(gds_file)
+        cells = {name: cell.local for name, cell in hash_cells(gds_file).items()}
+    except (GDSError, OSError, IndexError) as e:
+        abort(console, f"{gds_file} is not a valid gds : {e}")
+    hashes = {"instances": instances, "layers": layers, "cells": cells}
+    if not state or state.get("instances") != instances:
+        return hashes, None
+    changed_cells = sorted(name for name in set(cells) | set(state["cells"]) if cells.get(name) != state["cells"].get(name))
+    if changed_cells:
+        console.print(f"changed cells since the last run : {', '.join(changed_cells)}")
+    changed = {layer for layer in set(layers) | set(state["layers"]) if layers.get(layer) != state["layers"].get(layer)}
+    return hashes, {int(str(layer).partition("/")[0]) for layer in changed}
+
+def lyrdb_reports(output_path):
+    return [path for path in sorted(glob.glob(f'{output_path}/outputs/reports/*')) if path.endswith(('.xml', '.lyrdb')) and is_lyrdb(path)]
+
+def index_results(console, db_file, lyrdbs=(), xors=()):
+    """Loads drc reports and (xor gds, xor total) pairs into a fresh sqlite
+    index, see `utilities report query`."""
+    connection = open_db(db_file, reset=True)
+    try:
+        markers = sum(ingest_lyrdb(connection, path) for path in lyrdbs)
+        markers += sum(ingest_xor(connection, xor_gds, total_file) for xor_gds, total_file in xors)
+    finally:
+        connection.close()
+    console.print(f"{markers} markers indexed in {db_file}")
+    return db_file
+
+def drc(console, gds_file, output_path, sharded=False, incremental=False, processes=None, index=True):
+    gds_file = os.path.abspath(gds_file)
+    output_path = os.path.abspath(output_path)
+    if not os.path.exists(gds_file):
+        abort(console, f"{gds_file} path doesn't exist")
+    if not os.path.exists(output_path):
+        abort(console, f"{output_path} path doesn't exist")
+    precheck_root = precheck_checkout()
+    if sharded:
+        shards = {name: (flags, depends, f'{output_path}/shards/{name}') for name, (flags, depends) in DRC_SHARDS.items()}
+    else:
+        shards = {"all": (["-f", "-b", "-og"], lambda layer: True, output_path)}
+    state_file = f'{output_path}/drc_state.json'
+    state = {}
+    changed_layers = None
+    if incremental:
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+        hashes, changed_layers = drc_changes(console, gds_file, state)
+    passed = state.get("shards", {})
+    pending = [
+        name for name, (_, depends, _) in shards.items()
+        if changed_layers is None or not passed.get(name) or any(depends(layer) for layer in changed_layers)
+    ]
+    for name in shards:
+        if name not in pending:
+            console.print(f"[green]{name} : no relevant changes since the last run, reusing its reports")
+
+    def run_shard(name):
+        flags, _, shard_output = shards[name]
+        start = time.time()
+        returncode = run_drc_check(precheck_root, gds_file, shard_output, flags)
+        return returncode, time.time() - start
+
+    runs = {}
+    if pending:
+        with ThreadPoolExecutor(max_workers=processes or len(pending)) as executor:
+            runs = dict(zip(pending, executor.map(telemetry.keep_command(run_shard), pending)))
+    # a merged report left by an earlier sharded run would count every marker twice
+    reports = {
+        name: [path for path in lyrdb_reports(shard_output) if os.path.basename(path) != 'drc_merged.lyrdb']
+        for name, (_, _, shard_output) in shards.items()
+    }
+    os.makedirs(f'{output_path}/outputs/reports', exist_ok=True)
+    counts = {}
+    if sharded:
+        merged = f'{output_path}/outputs/reports/drc_merged.lyrdb'
+        counts = merge_lyrdb([path for paths in reports.values() for path in paths], merged)
+    elif incremental:
+        counts = {path: count_markers(path) for path in reports["all"]}
+    # the precheck exits non-zero on violations as well, so a shard is
+    # judged by its reports: clean when they were written without markers
+    violations = {name: sum(sum(counts.get(path, {}).values()) for path in reports[name]) for name in shards}
+    if incremental:
+        hashes["shards"] = {
+            name: bool(reports[name]) and violations[name] == 0 if name in runs else passed.get(name, False) for name in shards
+        }
+        with open(state_file, 'w') as f:
+            json.dump(hashes, f)
+    if sharded:
+        table = Table(title="drc shards")
+        table.add_column("shard")
+        table.add_column("status")
+        table.add_column("markers", justify="right")
+        table.add_column("time (s)", justify="right")
+        for name in shards:
+            if name not in runs:
+                status, duration = "[green]reused", "-"
+            else:
+                duration = f"{runs[name][1]:.1f}"
+                if not reports[name]:
+                    status = f"[red]failed ({runs[name][0]}), no report"
+                elif violations[name]:
+                    status = "[red]violations"
+                else:
+                    status = "[green]clean"
+            table.add_row(name, status, str(violations[name]), duration)
+        console.print(table)
+        console.print(f"merged report written to {merged}")
+    if index:
+        lyrdbs = [path for paths in reports.values() for path in paths]
+        index_results(console, f'{output_path}/outputs/reports/drc.db', lyrdbs=lyrdbs)
+    return max([returncode for returncode, _ in runs.values()], default=0)
+
+def lvs_command(precheck_root, design_dir, output_path, design_name, config_file, pdk_root, pdk, tag=None):
+    lvs_cmd = ['python3', f'{precheck_root}/checks/lvs_check/lvs.py', '-g', f'{design_dir}', '-o', f'{output_path}', '-d', f'{design_name}', '-c', f'{config_file}', '-p', f'{pdk_root}/{pdk}']
+    if tag:
+        lvs_cmd += ['-t', f'{tag}']
+    return lvs_cmd
+
+
+LVS_STATE = "lvs_state.json"
+
+
+def lvs_extraction_key(design_dir, design_name, config_file, pdk):
+    """Hash of what the extraction of an LVS run depends on: the gds, the
+    gate level netlist and the config."""
+    files = [f'{design_dir}/gds/{design_name}.gds', f'{design_dir}/gds/{design_name}.gds.gz', f'{design_dir}/verilog/gl/{design_name}.v', config_file]
+    return get_cache().key([path for path in files if os.path.exists(path)], {"design": design_name, "pdk": pdk})
+
+
+def lvs_reused_tag(output_path, design_name, key):
+    """Returns the tag that skips the extraction when the last successful run
+    in output_path had the same extraction key, otherwise None."""
+    try:
+        with open(f'{output_path}/{design_name}/{LVS_STATE}') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return (state.get("tag") or design_name) if state.get("key") == key else None
+
+
+def lvs_record(output_path, design_name, key, tag=None):
+    write_atomic(f'{output_path}/{design_name}/{LVS_STATE}', json.dumps({"key": key, "tag": tag or design_name}))
+
+
+def lvs_design(console, precheck_root, design_dir, output_path, design_name, config_file, pdk_root, pdk, tag=None):
+    os.makedirs(f'{output_path}/{design_name}', exist_ok=True)
+    key = None
+    if not tag:
+        key = lvs_extraction_key(design_dir, design_name, config_file, pdk)
+        tag = lvs_reused_tag(output_path, design_name, key)
+        if tag:
+            console.print(f"{design_name} : gds and netlist unchanged, reusing the extraction")
+    # the environment of the run only, so that designs can run side by side
+    env = dict(os.environ, PYTHONPATH=precheck_root)
+    returncode = logs.run_tool(
+        lvs_command(precheck_root, design_dir, output_path, design_name, config_file, pdk_root, pdk, tag), "lvs", f"lvs {design_name}",
+        env=env, cwd=precheck_root, log_file=logs.log_path(f'{output_path}/{design_name}/lvs'), inputs=[design_dir, config_file], outputs=[f'{output_path}/{design_name}'],
+    )
+    if returncode == 0 and key:
+        lvs_record(output_path, design_name, key)
+    return returncode
+
+def lvs(console, design_dir, output_path, design_names, config_file, pdk_root, pdk, tag=None, processes=None):
+    """Runs the LVS of every design in design_names, in parallel, each in
+    <output_path>/<design>."""
+    if isinstance(design_names, str):
+        design_names = [design_names]
     design_dir = os.path.abspath(design_dir)
     output_path = os.path.abspath(output_path)
     config_file = os.path.abspath(config_file)
-    precheck_root = os.path.join(os.path.expanduser("~"), "mpw_precheck")
-    os.environ['PYTHONPATH'] = f'{precheck_root}'
-    if not os.path.exists(precheck_root):
-        subprocess.run(['git', 'clone', 'https://github.com/efabless/mpw_precheck.git', precheck_root])
-    if not os.path.exists(f'{output_path}/{design_name}'):
-        os.mkdir(f'{output_path}/{design_name}')
-    if tag:
-        subprocess.run(['python3', f'{precheck_root}/checks/lvs_check/lvs.py', '-g', f'{design_dir}', '-o', f'{output_path}', '-d', f'{design_name}', '-c', f'{config_file}', '-p', f'{pdk_root}/{pdk}', '-t', f'{tag}'], cwd=precheck_root)
-    else:
-        subprocess.run(['python3', f'{precheck_root}/checks/lvs_check/lvs.py', '-g', f'{design_dir}', '-o', f'{output_path}', '-d', f'{design_name}', '-c', f'{config_file}', '-p', f'{pdk_root}/{pdk}'], cwd=precheck_root)
+    for path in (design_dir, output_path, config_file):
+        if not os.path.exists(path):
+            abort(console, f"{path} path doesn't exist")
+    precheck_root = precheck_checkout()
+
+    def run(design_name):
+        start = time.time()
+        returncode = lvs_design(console, precheck_root, design_dir, output_path, design_name, config_file, pdk_root, pdk, tag)
+        return returncode, time.time() - start
+
+    if len(design_names) == 1:
+        return run(design_names[0])[0]
+    with ThreadPoolExecutor(max_workers=max(1, min(processes or os.cpu_count(), len(design_names)))) as executor:
+        runs = list(executor.map(telemetry.keep_command(run), design_names))
+    table = Table(title="lvs")
+    table.add_column("design")
+    table.add_column("status")
+    table.add_column("time (s)", justify="right")
+    for design_name, (returncode, duration) in zip(design_names, runs):
+        status = "[green]ok" if returncode == 0 else f"[red]failed ({returncode})"
+        table.add_row(design_name, status, f"{duration:.1f}")
+    console.print(table)
+    return max((returncode for returncode, _ in runs), key=abs)
+
+def xor_command(top_cell, design1, design2, xor_gds, total_file, threads=None, tile_size=None, layers=None):
+    # without a tile size xor.drc tiles by the layout extent
+    xor_cmd = ['klayout', '-b', '-r', os.path.join(HELPER_LIB, 'xor.drc'), '-rd', f'thr={threads or os.cpu_count()}', '-rd', f'tile_size={"auto" if tile_size is None else tile_size}', '-rd', f'top_cell={top_cell}', '-rd', f'a={design1}', '-rd', f'b={design2}', '-rd', f'ol={xor_gds}', '-rd', f'xor_total_file_path={total_file}']
+    if layers:
+        xor_cmd += ['-rd', 'layers=' + ' '.join(f'{layer}/{datatype}' for layer, datatype in layers)]
+    return xor_cmd
+
+def klayout_xor(top_cell, design1, design2, xor_gds, total_file, threads=None, tile_size=None, layers=None):
+    return logs.run_tool(
+        xor_command(top_cell, design1, design2, xor_gds, total_file, threads, tile_size, layers), "klayout", f"xor {top_cell}",
+        log_file=logs.log_path(os.path.splitext(xor_gds)[0]),
+        inputs=[design1, design2], outputs=[xor_gds, total_file], deck="xor",
+    )
+
+def read_xor_totals(total_file):
+    """Returns the total and the per layer counts written by xor.drc."""
+    counts = {}
+    with open(total_file) as f:
+        total = int(f.readline().strip() or 0)
+        for line in f:
+            if line.strip():
+                layer, count = line.split()
+                counts[layer] = int(count)
+    return total, counts
 
-def xor(console, design_name, design1, design2):
+def write_xor_totals(total_file, total, counts):
+    with open(total_file, "w") as f:
+        f.write(f"{total}\n")
+        for layer, count in counts.items():
+            f.write(f"{layer} {count}\n")
+
+def xor_per_layer(console, top_cell, design1, design2, xor_gds, total_file, threads=None, tile_size=None, processes=None):
+    """Splits the layers of both layouts into groups, XORs every group in its
+    own klayout process and merges the results into xor_gds and total_file."""
+    try:
+        layers = sorted(shape_layers(design1) | shape_layers(design2))
+    except (GDSError, OSError, IndexError) as e:
+        abort(console, f"can't read the layers of {design1} and {design2} : {e}")
+    processes = max(1, min(processes or os.cpu_count(), len(layers)))
+    groups = [layers[index::processes] for index in range(processes)]
+    threads = max(1, (threads or os.cpu_count()) // processes)
+    parts_dir = tempfile.mkdtemp(dir=os.path.dirname(xor_gds), prefix=".xor-")
+
+    def run_group(index):
+        start = time.time()
+        returncode = klayout_xor(top_cell, design1, design2, f'{parts_dir}/{index}.gds', f'{parts_dir}/{index}.txt', threads, tile_size, groups[index])
+        return returncode, time.time() - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            runs = list(executor.map(telemetry.keep_command(run_group), range(processes)))
+        table = Table(title=f"{top_cell} xor per layer")
+        table.add_column("layers")
+        table.add_column("differences", justify="right")
+        table.add_column("time (s)", justify="right")
+        total, parts = 0, []
+        counts = {}
+        for index, (returncode, duration) in enumerate(runs):
+            if returncode or not os.path.exists(f'{parts_dir}/{index}.txt'):
+                table.add_row(" ".join(f"{layer}/{datatype}" for layer, datatype in groups[index]), "[red]failed", f"{duration:.1f}")
+                continue
+            group_total, group_counts = read_xor_totals(f'{parts_dir}/{index}.txt')
+            total += group_total
+            counts.update(group_counts)
+            parts.append(f'{parts_dir}/{index}.gds')
+            for layer, count in group_counts.items():
+                color = "green" if count == 0 else "red"
+                table.add_row(layer, f"[{color}]{count}", f"{duration:.1f}")
+        console.print(table)
+        if parts:
+            merge_libraries(parts, xor_gds)
+        write_xor_totals(total_file, total, counts)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return max(returncode for returncode, _ in runs)
+
+def xor_prefilter(console, design_name, design1, design2):
+    """Compares the cell hashes of both layouts and returns the cells that
+    still need a real XOR, writing a per-cell report next to design1."""
+    cells = []
+    for design in (design1, design2):
+        try:
+            cells.append(hash_cells(design))
+        except (GDSError, OSError, IndexError) as e:
+            abort(console, f"{design} is not a valid gds : {e}")
+    for design, design_cells in zip((design1, design2), cells):
+        if design_name not in design_cells:
+            abort(console, f"{design_name} is not a cell of {design}")
+    status = compare_cells(cells[0], cells[1], design_name)
+    table = Table(title=f"{design_name} cell comparison")
+    table.add_column("cell")
+    table.add_column("status")
+    colors = {"identical": "green", "subtree": "yellow"}
+    report = os.path.join(os.path.dirname(design1), f"{design_name}-xor-cells.txt")
+    with open(report, "w") as f:
+        for name, cell_status in status.items():
+            f.write(f"{name} {cell_status}\n")
+            if cell_status != "identical":
+                table.add_row(name, f"[{colors.get(cell_status, 'red')}]{cell_status}")
+    if table.rows:
+        console.print(table)
+    console.print(f"cell report written to {report}")
+    return xor_roots(cells[0], status, design_name)
+
+def density(console, gds_file, output, pdk=None, layers=(), top=None, window=layer_density.WINDOW, step=None, resolution=layer_density.RESOLUTION):
+    """Writes the density of every window of the layers of the pdk, with
+    layers (name=layer/datatype[:min[:max]]) added or overriding them, to
+    `<output>/<top>.density.csv`. Returns the number of windows outside
+    their limits."""
+    if layer_density.np is None:
+        abort(console, "numpy is needed for density, pip install numpy or utilities[density]")
+    for path in (gds_file, output):
+        if not os.path.exists(path):
+            abort(console, f"{path} path doesn't exist")
+    selected = {layer.name: layer for layer in layer_density.pdk_layers(pdk)}
+    for spec in layers:
+        try:
+            layer = layer_density.parse_layer(spec)
+        except ValueError as e:
+            abort(console, f"invalid layer {spec} : {e}")
+        selected[layer.name] = layer
+    if not selected:
+        abort(console, f"no density layers known for {pdk or 'no pdk'}, give them with --layer")
+    if window <= 0 or resolution <= 0 or (step is not None and step <= 0):
+        abort(console, "window, step and resolution must be positive")
+    start = time.time()
+    collector = layer_density.ShapeCollector(selected.values())
+    suffix = compress.compression(gds_file)
+    if suffix and not compress.supported(suffix):
+        abort(console, f"the zstandard module is needed to read {gds_file}")
+    stream = compress.open_compressed(gds_file) if suffix else None
+    try:
+        # the collector takes the boxes of the structures from its arrays
+        library = read_library(stream or gds_file, boxes=False, shape=collector, rectangles=collector.add_rectangles)
+    except (GDSError, OSError, IndexError) as e:
+        abort(console, f"{gds_file} is not a valid gds : {e}")
+    finally:
+        if stream:
+            stream.close()
+    collector.set_boxes(library)
+    top = library_top(console, gds_file, library, top)
+    results = layer_density.layer_densities(library, collector, top, list(selected.values()), window, step, resolution)
+    csv_file = os.path.join(output, f"{top}.density.csv")
+    rows = ["layer,column,row,x0,y0,x1,y1,density,status"]
+    table = Table(title=f"{top} density, {window:g} um windows")
+    for column in ("layer", "area (um^2)", "min", "mean", "max", "limits", "outside"):
+        table.add_column(column, justify="left" if column == "layer" else "right")
+    violations = []
+    for result in results:
+        layer = result.layer
+        low = result.density < (layer.minimum if layer.minimum is not None else -1.0)
+        high = result.density > (layer.maximum if layer.maximum is not None else 2.0)
+        for (x0, y0, x1, y1), (column, row), value, is_low, is_high in zip(result.windows, result.cells, result.density, low, high):
+            status = "low" if is_low else "high" if is_high else "ok"
+            rows.append(f"{layer.name},{column},{row},{x0:.3f},{y0:.3f},{x1:.3f},{y1:.3f},{value:.4f},{status}")
+            if status != "ok":
+                violations.append((layer.name, status, x0, y0, x1, y1, value))
+        limits = [f"{limit:g}" if limit is not None else "" for limit in (layer.minimum, layer.maximum)]
+        table.add_row(
+            f"{layer.name} ({layer.layer}/{layer.datatype})", f"{result.area:.1f}", f"{result.density.min():.3f}",
+            f"{result.density.mean():.3f}", f"{result.density.max():.3f}", "..".join(limits) if any(limits) else "-",
+            str(int(low.sum() + high.sum())),
+        )
+    write_atomic(csv_file, "\n".join(rows) + "\n")
+    telemetry.record("density", [gds_file], [csv_file], returncode=0, wall=time.time() - start)
+    console.print(table)
+    for name, status, x0, y0, x1, y1, value in violations[:20]:
+        console.print(f"[red]{name} density {value:.3f} too {status} in ({x0:.1f}, {y0:.1f}) - ({x1:.1f}, {y1:.1f})")
+    if len(violations) > 20:
+        console.print(f"[red]... {len(violations) - 20} more windows outside their limits, see {csv_file}")
+    console.print(f"windows written to {csv_file}")
+    return len(violations)
+
+
+def xor(console, design_name, design1, design2, prefilter=False, threads=None, tile_size=None, per_layer=False, processes=None, index=True):
     design1 = os.path.abspath(design1)
     design2 = os.path.abspath(design2)
-    precheck_root = os.path.join(os.path.expanduser("~"), "mpw_precheck")
-    if not os.path.exists(precheck_root):
-        subprocess.run(['git', 'clone', 'https://github.com/efabless/mpw_precheck.git', precheck_root])
-    subprocess.run(['klayout', '-r', 'xor.rb.drc', '-rd', f'thr={os.cpu_count}', '-rd', f'top_cell={design_name}', '-rd', f'a={design1}', '-rd', f'b={design2}', '-rd', f'ol={os.path.dirname(design1)}/{design_name}-xor.gds', '-rd', 'ext=gds', '-rd', f'xor_total_file_path={os.path.dirname(design1)}/xor_output.txt', '-zz'], cwd=f'{precheck_root}/checks/xor_check')
+    for design in (design1, design2):
+        if not os.path.exists(design):
+            abort(console, f"{design} path doesn't exist")
+    output_dir = os.path.dirname(design1)
+    roots = [design_name]
+    if prefilter:
+        roots = xor_prefilter(console, design_name, design1, design2)
+        if not roots:
+            console.print(f"[green]{design_name} is identical in both layouts, skipping klayout xor")
+            with open(f'{output_dir}/xor_output.txt', 'w') as f:
+                f.write("0\n")
+            if index:
+                index_results(console, f'{output_dir}/{design_name}-xor.db', xors=[(None, f'{output_dir}/xor_output.txt')])
+            return 0
+        console.print(f"running xor on {', '.join(roots)}")
+    returncode = 0
+    results = []
+    for root in roots:
+        if root == design_name:
+            xor_gds, total_file = f'{output_dir}/{design_name}-xor.gds', f'{output_dir}/xor_output.txt'
+        else:
+            xor_gds, total_file = f'{output_dir}/{design_name}-{root}-xor.gds', f'{output_dir}/xor_output-{root}.txt'
+        if per_layer:
+            returncode = xor_per_layer(console, root, design1, design2, xor_gds, total_file, threads, tile_size, processes) or returncode
+        else:
+            returncode = klayout_xor(root, design1, design2, xor_gds, total_file, threads, tile_size) or returncode
+        results.append((xor_gds, total_file))
+    if roots != [design_name]:
+        # xor_output.txt is what precheck reads, the sum over the roots
+        total_file = f'{output_dir}/xor_output.txt'
+        if all(os.path.exists(part) for _, part in results):
+            total, counts = 0, {}
+            for _, part in results:
+                part_total, part_counts = read_xor_totals(part)
+                total += part_total
+                for layer, count in part_counts.items():
+                    counts[layer] = counts.get(layer, 0) + count
+            write_xor_totals(total_file, total, counts)
+            console.print(f"{total} differences in {', '.join(roots)}, written to {total_file}")
+        elif os.path.exists(total_file):
+            # a total of an earlier run must not pass for this one's
+            os.remove(total_file)
+    if index:
+        try:
+            index_results(console, f'{output_dir}/{design_name}-xor.db', xors=results)
+        except (GDSError, IndexError) as e:
+            console.print(f"[red]can't index the xor results : {e}")
+    return returncode
+
+def needed_macros(console, def_file, extra_lef, extra_gds, pdk_root, pdk):
+    """Narrows extra_lef and extra_gds down to the macros def_file
+    instantiates and reports its masters that are defined nowhere."""
+    for path in (def_file, *(extra_lef or ()), *(extra_gds or ())):
+        if not os.path.exists(path):
+            abort(console, f"{path} path doesn't exist")
+    try:
+        selection = select_macros(def_file, extra_lef or (), extra_gds or (), pdk_root, pdk)
+    except (DefError, GDSError, StopIteration) as e:
+        abort(console, f"can't read the components of {def_file} : {e}")
+    kept = sum(1 for lef, selected in zip(extra_lef or (), selection.lefs) if lef == selected)
+    console.print(
+        f"{len(selection.masters)} masters in {def_file} : {kept} of {len(extra_lef or ())} extra lefs read in full, "
+        f"{len(selection.gds_files)} of {len(extra_gds or ())} extra gds files read"
+    )
+    if selection.unresolved:
+        console.print(f"[yellow]WARNING : {len(selection.unresolved)} masters are in no lef or gds : {' '.join(selection.unresolved)}")
+    return selection.lefs or None, selection.gds_files or None
 
-def def_to_gds(console, def_file, pdk, pdk_root, output, extra_gds=None, extra_lef=None):
+@magic_conversion
+def def_to_gds(console, def_file, pdk, pdk_root, output, extra_gds=None, extra_lef=None, all_macros=False, compress_gds=None):
     magic_env = dict()
     magic_env['DEF_TO_GDS'] = "1"
     magic_env['DEF_TO_MAG'] = "0"
     magic_env['MAGIC_GDS_ALLOW_ABSTRACT'] = "0"
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if not os.path.exists(def_file):
-        console.print(f"[red]ERROR : {def_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{def_file} path doesn't exist")
     else:
         magic_env['MACRO'] = def_file
+    if (extra_lef or extra_gds) and not all_macros:
+        extra_lef, extra_gds = needed_macros(console, def_file, extra_lef, extra_gds, pdk_root, pdk)
     if extra_lef:
         magic_env['MAGIC_GDS_ALLOW_ABSTRACT'] = "1"
         lef_export = ""
         for lef in extra_lef:
             if not os.path.exists(lef):
-                console.print(f"[red]ERROR : {lef} path doesn't exist")
-                exit(1)
+                abort(console, f"{lef} path doesn't exist")
             else:
                 lef_export = lef_export + lef + " "
         magic_env['EXTRA_LEFS'] = f'"{lef_export.strip()}"'
@@ -265,137 +1100,199 @@ def def_to_gds(console, def_file, pdk, pdk_root, output, extra_gds=None, extra_l
         gds_export = ""
         for gds in extra_gds:
             if not os.path.exists(gds):
-                console.print(f"[red]ERROR : {gds} path doesn't exist")
-                exit(1)
+                abort(console, f"{gds} path doesn't exist")
             else:
                 gds_export = gds_export + gds + " "
         magic_env['EXTRA_GDS_FILES'] = f'"{gds_export.strip()}"'
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/def_to_all.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    outputs = [gds_output(console, magic_env, output, def_file, compress_gds)]
+    dependencies = [*(extra_lef or ()), *(extra_gds or ())]
+    return MagicJob(pdk_root, pdk, "def_to_all.tcl", magic_env, outputs, dependencies)
 
 
+@magic_conversion
 def def_to_mag(console, def_file, pdk, pdk_root, output):
     magic_env = dict()
     magic_env['DEF_TO_MAG'] = "1"
     magic_env['DEF_TO_GDS'] = "0"
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if not os.path.exists(def_file):
-        console.print(f"[red]ERROR : {def_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{def_file} path doesn't exist")
     else:
         magic_env['MACRO'] = def_file
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/def_to_all.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    outputs = [output_file(output, def_file, ".mag")]
+    dependencies = ()
+    return MagicJob(pdk_root, pdk, "def_to_all.tcl", magic_env, outputs, dependencies)
 
+@magic_conversion
 def mag_to_lef(console, mag_file, pdk, pdk_root, output):
     magic_env = dict()
     magic_env['MAG_TO_LEF'] = "1"
     magic_env['GDS_TO_LEF'] = "0"
     magic_env['DEF_TO_LEF'] = "0"
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if not os.path.exists(mag_file):
-        console.print(f"[red]ERROR : {mag_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{mag_file} path doesn't exist")
     else:
         magic_env['MACRO'] = mag_file
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/all_to_lef.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+    outputs = [output_file(output, mag_file, ".lef")]
+    dependencies = [os.path.dirname(os.path.abspath(mag_file))]
+    return MagicJob(pdk_root, pdk, "all_to_lef.tcl", magic_env, outputs, dependencies)
 
-def gds_to_lef(console, gds_file, pdk, pdk_root, output):
+@magic_conversion
+def gds_to_lef(console, gds_file, pdk, pdk_root, output, top=None):
     magic_env = dict()
     magic_env['MAG_TO_LEF'] = "0"
     magic_env['GDS_TO_LEF'] = "1"
     magic_env['DEF_TO_LEF'] = "0"
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if not os.path.exists(gds_file):
-        console.print(f"[red]ERROR : {gds_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{gds_file} path doesn't exist")
     else:
-        magic_env['MACRO'] = gds_file
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/all_to_lef.tcl"
-    ]
-    subprocess.run(magic_cmd, env=magic_env)
+        gds_input(console, magic_env, gds_file, top)
+    outputs = [output_file(output, gds_file, ".lef")]
+    dependencies = ()
+    return MagicJob(pdk_root, pdk, "all_to_lef.tcl", magic_env, outputs, dependencies)
 
+@magic_conversion
 def def_to_lef(console, def_file, pdk, pdk_root, output):
     magic_env = dict()
     magic_env['MAG_TO_LEF'] = "0"
     magic_env['GDS_TO_LEF'] = "0"
     magic_env['DEF_TO_LEF'] = "1"
     if not os.path.exists(output):
-        console.print(f"[red]ERROR : {output} path doesn't exist")
-        exit(1)
+        abort(console, f"{output} path doesn't exist")
     else:
         magic_env['OUTPUT'] = output
     if not os.path.exists(pdk_root):
-        console.print(f"[red]ERROR : {pdk_root} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root} path doesn't exist")
     else:
         magic_env['PDK_ROOT'] = pdk_root
     if not os.path.exists(os.path.join(pdk_root, pdk)):
-        console.print(f"[red]ERROR : {pdk_root}/{pdk} path doesn't exist")
-        exit(1)
+        abort(console, f"{pdk_root}/{pdk} path doesn't exist")
     else:
         magic_env['PDK'] = pdk
     if not os.path.exists(def_file):
-        console.print(f"[red]ERROR : {def_file} path doesn't exist")
-        exit(1)
+        abort(console, f"{def_file} path doesn't exist")
     else:
         magic_env['MACRO'] = def_file
-    magic_env.update(os.environ)
-    magic_cmd = [
-        "magic", "-noconsole", "-dnull", "-rcfile", f"{pdk_root}/{pdk}/libs.tech/magic/{pdk}.magicrc", f"{os.path.dirname(os.path.abspath(__file__))}/helper_lib/all_to_lef.tcl"
+    outputs = [output_file(output, def_file, ".lef")]
+    dependencies = ()
+    return MagicJob(pdk_root, pdk, "all_to_lef.tcl", magic_env, outputs, dependencies)
+
+def def_to_lef_native(console, def_file, pdk, pdk_root, output):
+    """def_to_lef without magic: the abstract (die area, pins and a blanket
+    obstruction per routing layer) is written straight from the DEF."""
+    for path in (output, def_file):
+        if not os.path.exists(path):
+            abort(console, f"{path} path doesn't exist")
+    tech_lef_files = [lef for lef in tech_lefs(pdk_root, pdk) if os.path.exists(lef)]
+    if not tech_lef_files:
+        abort(console, f"{tech_lefs(pdk_root, pdk)[0]} path doesn't exist, the wire widths come from the tech lef")
+    lef_file = output_file(output, def_file, ".lef")
+    start = time.time()
+    scratch = compress.scratch_dir()
+    try:
+        abstract = def_to_lef_abstract(def_file, output_file(scratch, def_file, ".lef"), tech_lef_files)
+        manifest = f"{os.path.splitext(lef_file)[0]}.native{stage.MANIFEST_SUFFIX}"
+        stage.publish(scratch, output, manifest, {"script": "native", "input": os.path.abspath(def_file)})
+    except (DefError, IndexError, StopIteration, ValueError) as e:
+        abort(console, f"{def_file} is not a valid def : {e}")
+    except OSError as e:
+        abort(console, f"can't write {lef_file} : {e}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    telemetry.record("native", [def_file], [lef_file], returncode=0, wall=time.time() - start, backend="native")
+    console.print(f"{lef_file} : {len(abstract.pins)} pins, obstructions on {', '.join(sorted(abstract.obstructions)) or 'no layer'}")
+    return 0
+
+
+CONVERT_VIEWS = ("gds", "mag", "lef", "def")
+
+
+def source_view(source_file):
+    return os.path.splitext(compress.plain_name(source_file))[1].lstrip(".").lower()
+
+
+@magic_conversion
+def convert(console, source_file, targets, pdk, pdk_root, output, source=None, maglef_macro=None, mag_dir=None, gds_macro=None, extra_lef=None, extra_gds=None, top=None, all_macros=False, compress_gds=None):
+    source = source or source_view(source_file)
+    if source not in ("gds", "mag", "def"):
+        abort(console, f"can't convert from {source}, the source must be a gds, mag or def")
+    if not targets:
+        abort(console, "no targets to convert to")
+    for target in targets:
+        if target not in CONVERT_VIEWS:
+            abort(console, f"unknown target {target}, expected one of {', '.join(CONVERT_VIEWS)}")
+    if source in targets:
+        console.print(f"{source_file} is already a {source}, skipping that target")
+    targets = [target for target in dict.fromkeys(targets) if target != source]
+    if not targets:
+        abort(console, f"{source_file} is already a {source}, nothing to convert to")
+    magic_env = dict()
+    magic_env['SOURCE'] = source
+    for view in CONVERT_VIEWS:
+        magic_env[f'TO_{view.upper()}'] = "1" if view in targets else "0"
+    for path in (source_file, output, pdk_root, os.path.join(pdk_root, pdk)):
+        if not os.path.exists(path):
+            abort(console, f"{path} path doesn't exist")
+    if source == "def" and (extra_lef or extra_gds) and not all_macros:
+        extra_lef, extra_gds = needed_macros(console, source_file, extra_lef, extra_gds, pdk_root, pdk)
+    magic_env['MAGIC_GDS_ALLOW_ABSTRACT'] = "1" if extra_lef else "0"
+    if source == "gds":
+        gds_input(console, magic_env, source_file, top)
+    else:
+        magic_env['MACRO'] = source_file
+    magic_env['OUTPUT'] = os.path.abspath(output)
+    magic_env['PDK_ROOT'] = pdk_root
+    magic_env['PDK'] = pdk
+    if "def" in targets:
+        magic_env['EXTRACT_DIR'] = get_cache().extraction_dir(source_file)
+    dependencies = []
+    for name, paths in (("MAGLEF_MACRO", maglef_macro), ("MAG_DIR", mag_dir), ("GDS_MACRO", gds_macro), ("EXTRA_LEFS", extra_lef), ("EXTRA_GDS_FILES", extra_gds)):
+        if not paths:
+            continue
+        for path in paths:
+            if not os.path.exists(path):
+                abort(console, f"{path} path doesn't exist")
+        magic_env[name] = f'"{" ".join(paths)}"'
+        dependencies += paths
+    if source == "mag":
+        dependencies.append(os.path.dirname(os.path.abspath(source_file)))
+    outputs = [
+        gds_output(console, magic_env, output, source_file, compress_gds) if target == "gds" else output_file(output, source_file, f".{target}")
+        for target in targets
     ]
-    subprocess.run(magic_cmd, env=magic_env)
+    return MagicJob(pdk_root, pdk, "convert.tcl", magic_env, outputs, dependencies)
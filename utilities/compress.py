@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compressed (.gz, .zst) gds inputs and outputs.
+
+magic only reads plain files, so a compressed input is decompressed into
+local scratch ($UTILITIES_SCRATCH, or the temporary directory) by a thread
+that runs while magic starts up. The helper scripts wait for a flag file
+next to it (see helper_lib/scratch.tcl). Outputs are written by magic into
+scratch and compressed from there into the output directory, so the
+uncompressed gds never goes over NFS.
+"""
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+from .cache import write_atomic
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = (".gz", ".zst")
+CHUNK = 1 << 20
+
+_decompressions = {}
+_decompressions_lock = threading.Lock()
+_local = threading.local()
+
+
+def compression(path):
+    """Returns the compression suffix of path, or None."""
+    for suffix in COMPRESSIONS:
+        if str(path).endswith(suffix):
+            return suffix
+    return None
+
+
+def plain_name(path):
+    suffix = compression(path)
+    return path[:-len(suffix)] if suffix else path
+
+
+def supported(suffix):
+    return suffix != ".zst" or zstandard is not None
+
+
+def open_compressed(path, mode="rb", suffix=None):
+    if (suffix or compression(path)) == ".zst":
+        if "r" in mode:
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), CHUNK)
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(open(path, "wb"))
+    return gzip.open(path, mode, compresslevel=6)
+
+
+def scratch_dir():
+    root = os.environ.get("UTILITIES_SCRATCH") or None
+    if root:
+        os.makedirs(root, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix="utilities-", dir=root)
+    if getattr(_local, "staged", None) is not None:
+        _local.staged.append(directory)
+    return directory
+
+
+@contextlib.contextmanager
+def staging():
+    """Removes the scratch directories created within when it raises, e.g.
+    when a job is aborted after its input was already being decompressed."""
+    outer = getattr(_local, "staged", None)
+    _local.staged = staged = []
+    try:
+        yield
+    except BaseException:
+        with _decompressions_lock:
+            started = [ready for ready, decompression in _decompressions.items() if decompression.directory in staged]
+        for ready in started:
+            release(ready)
+        for directory in staged:
+            shutil.rmtree(directory, ignore_errors=True)
+        raise
+    finally:
+        _local.staged = outer
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Tee:
+    """Reader that writes what it reads to destination."""
+
+    def __init__(self, source, destination, cancelled):
+        self.source = source
+        self.destination = destination
+        self.cancelled = cancelled
+
+    def read(self, size=-1):
+        if self.cancelled.is_set():
+            raise Cancelled("cancelled")
+        data = self.source.read(size)
+        self.destination.write(data)
+        return data
+
+
+class Decompression:
+    """Decompresses source into a scratch directory in a thread.
+
+    inspect, if given, reads the decompressed stream as it is written (a
+    file object with read) and returns a word for the flag file, the top
+    cell for a gds. The flag file `<path>.ready` is written at the end:
+    "ok [word]" or "error <message>".
+    """
+
+    def __init__(self, source, inspect=None):
+        self.source = source
+        self.inspect = inspect
+        self.directory = scratch_dir()
+        self.path = os.path.join(self.directory, os.path.basename(plain_name(source)))
+        self.ready = self.path + ".ready"
+        self.status = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        partial = self.path + ".part"
+        try:
+            with open_compressed(self.source) as source, open(partial, "wb") as destination:
+                tee = Tee(source, destination, self.cancelled)
+                word = self.inspect(tee) if self.inspect else None
+                while tee.read(CHUNK):
+                    pass
+            os.rename(partial, self.path)
+            self.status = f"ok {word}" if word else "ok"
+        except Exception as e:
+            # whatever went wrong has to reach the flag file, magic waits for it
+            self.status = f"error {e}".replace("\n", " ")
+        write_atomic(self.ready, self.status)
+
+    def result(self):
+        self.thread.join()
+        return self.status
+
+    def close(self):
+        self.cancelled.set()
+        self.thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def decompress(source, inspect=None):
+    decompression = Decompression(source, inspect)
+    with _decompressions_lock:
+        _decompressions[decompression.ready] = decompression
+    return decompression
+
+
+def release(ready):
+    """Stops the decompression of the flag file ready and removes its
+    scratch directory."""
+    with _decompressions_lock:
+        decompression = _decompressions.pop(ready, None)
+    if decompression:
+        decompression.close()
+
+
+def compress_file(source, destination):
+    """Compresses source into destination, by its suffix, in chunks."""
+    partial = os.path.join(os.path.dirname(os.path.abspath(destination)), f".{os.path.basename(destination)}.{os.getpid()}")
+    try:
+        with open(source, "rb") as f, open_compressed(partial, "wb", compression(destination)) as out:
+            shutil.copyfileobj(f, out, CHUNK)
+        os.replace(partial, destination)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Window density of gds layers, a quick check before the full drc deck.
+
+The shapes of the layers of interest are collected per structure while the
+gds is scanned (see gds.read_library) and turned into numpy arrays of
+boxes: polygons that are not rectangles are cut into boxes, paths into one
+box per segment. The hierarchy is flattened by composing the transforms of
+all placements of a structure at once, and the boxes are rasterized with
+their exact fractional coverage of every pixel. Coverage is clipped to 1
+per pixel, so shapes overlapping within a pixel count twice there.
+"""
+import math
+import struct
+from collections import namedtuple
+
+from .gds import PATH, RECTANGLE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DensityLayer = namedtuple("DensityLayer", "name layer datatype minimum maximum")
+LayerDensity = namedtuple("LayerDensity", "layer area windows cells density")
+
+# pdk family: layers and limits of its pattern density checks
+DENSITY_LAYERS = {
+    "sky130": [
+        DensityLayer("poly", 66, 20, None, None),
+        DensityLayer("li1", 67, 20, None, None),
+        DensityLayer("met1", 68, 20, 0.70, None),
+        DensityLayer("met2", 69, 20, 0.70, None),
+        DensityLayer("met3", 70, 20, 0.70, None),
+        DensityLayer("met4", 71, 20, 0.70, None),
+        DensityLayer("met5", 72, 20, None, None),
+    ],
+}
+WINDOW = 700.0
+RESOLUTION = 1.0
+# bytes of points kept per structure before they are reduced to a box
+EXTENT_BUFFER = 1 << 20
+# boxes transformed at once
+CHUNK = 1 << 18
+
+
+def pdk_layers(pdk):
+    for family, layers in DENSITY_LAYERS.items():
+        if pdk and pdk.startswith(family):
+            return list(layers)
+    return []
+
+
+def parse_layer(spec):
+    """Parses name=layer/datatype[:min[:max]], e.g. met1=68/20:0.7 or
+    met2=69/20::0.8."""
+    name, _, rest = spec.partition("=")
+    fields = rest.split(":")
+    if not name.strip() or not rest or len(fields) > 3:
+        raise ValueError(f"expected name=layer/datatype[:min[:max]], got {spec}")
+    layer, datatype = (int(value) for value in fields[0].split("/"))
+    limits = [float(value) if value else None for value in fields[1:]] + [None, None]
+    return DensityLayer(name.strip(), layer, datatype, limits[0], limits[1])
+
+
+def polygon_boxes(points):
+    """Cuts a polygon, an (n, 2) array, into one box per slab between
+    consecutive vertex ordinates; exact for manhattan polygons, area
+    preserving for the others."""
+    start = points
+    end = np.roll(points, -1, axis=0)
+    low = np.minimum(start[:, 1], end[:, 1])
+    high = np.maximum(start[:, 1], end[:, 1])
+    ys = np.unique(points[:, 1])
+    boxes = []
+    for y0, y1 in zip(ys[:-1], ys[1:]):
+        y = (y0 + y1) / 2
+        crossing = (low < y) & (high > y)
+        a, b = start[crossing], end[crossing]
+        xs = np.sort(a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1]))
+        boxes += [(x0, y0, x1, y1) for x0, x1 in zip(xs[0::2], xs[1::2])]
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def path_boxes(points, width):
+    """One box per segment of a path, without its end extensions; diagonal
+    segments get their bounding box."""
+    half = abs(width) / 2
+    a, b = points[:-1], points[1:]
+    low = np.minimum(a, b)
+    high = np.maximum(a, b)
+    # a horizontal segment is widened in y only and a vertical one in x only
+    grow_x = half * (a[:, 1] != b[:, 1])
+    grow_y = half * (a[:, 0] != b[:, 0])
+    return np.column_stack([low[:, 0] - grow_x, low[:, 1] - grow_y, high[:, 0] + grow_x, high[:, 1] + grow_y])
+
+
+class ShapeCollector:
+    """read_library callback keeping the shapes of some layers per
+    structure."""
+
+    def __init__(self, layers):
+        self.keys = {(layer.layer, layer.datatype) for layer in layers}
+        # (structure, (layer, datatype)): XY records of 5 points, the rectangles
+        self.rectangles = {}
+        self.polygons = {}
+        self.paths = {}
+        # structure: points of its shapes on any layer, reduced to their
+        # bounding box now and then
+        self.extents = {}
+
+    def __call__(self, structure, element, layer, datatype, width, data):
+        extent = self.extents.get(structure)
+        if extent is None:
+            extent = self.extents[structure] = bytearray()
+        extent += data
+        if len(extent) > EXTENT_BUFFER:
+            self.extents[structure] = bytearray(struct.pack(">4i", *self.extent(structure)))
+        key = (layer, datatype)
+        if key not in self.keys:
+            return
+        if element == PATH:
+            self.paths.setdefault((structure, key), []).append((bytes(data), width or 0))
+        elif len(data) == 40:
+            self.rectangles.setdefault((structure, key), bytearray()).extend(data)
+        else:
+            self.polygons.setdefault((structure, key), []).append(bytes(data))
+
+    def add_rectangles(self, structure, data):
+        """read_library callback taking a run of rectangles, RECTANGLE bytes
+        each, decoded all at once."""
+        words = np.frombuffer(data, ">i4").reshape(-1, RECTANGLE // 4)
+        halves = np.frombuffer(data, ">i2").reshape(-1, RECTANGLE // 2)
+        # the 5 points of the XY record, after the BOUNDARY, LAYER, DATATYPE
+        # and XY headers
+        points = words[:, 5:15]
+        xs, ys = points[:, 0::2], points[:, 1::2]
+        corners = np.array([xs.min(), ys.min(), xs.max(), ys.max()], dtype=">i4")
+        extent = self.extents.get(structure)
+        if extent is None:
+            extent = self.extents[structure] = bytearray()
+        extent += corners.tobytes()
+        layers, datatypes = halves[:, 4], halves[:, 7]
+        for key in self.keys:
+            selected = (layers == key[0]) & (datatypes == key[1])
+            if selected.any():
+                self.rectangles.setdefault((structure, key), bytearray()).extend(points[selected].tobytes())
+
+    def extent(self, structure):
+        points = np.frombuffer(self.extents[structure], ">i4").reshape(-1, 2)
+        low, high = points.min(0), points.max(0)
+        return int(low[0]), int(low[1]), int(high[0]), int(high[1])
+
+    def set_boxes(self, library):
+        """Sets the boxes of the structures of library read with boxes=False."""
+        for name, structure in library.structures.items():
+            if self.extents.get(name):
+                structure.box = self.extent(name)
+
+    def boxes(self, structure, key):
+        """(n, 4) array of x0, y0, x1, y1 in database units."""
+        parts = []
+        data = self.rectangles.get((structure, key))
+        if data:
+            points = np.frombuffer(data, ">i4").reshape(-1, 10)[:, :8].astype(np.float64)
+            xs, ys = points[:, 0::2], points[:, 1::2]
+            rectangle = (
+                (xs[:, 0] == xs[:, 1]) & (ys[:, 1] == ys[:, 2]) & (xs[:, 2] == xs[:, 3]) & (ys[:, 3] == ys[:, 0])
+            ) | (
+                (ys[:, 0] == ys[:, 1]) & (xs[:, 1] == xs[:, 2]) & (ys[:, 2] == ys[:, 3]) & (xs[:, 3] == xs[:, 0])
+            )
+            parts.append(np.column_stack([xs.min(1), ys.min(1), xs.max(1), ys.max(1)])[rectangle])
+            parts += [polygon_boxes(row.reshape(-1, 2)) for row in points[~rectangle]]
+        for data in self.polygons.get((structure, key), ()):
+            parts.append(polygon_boxes(np.frombuffer(data, ">i4").reshape(-1, 2).astype(np.float64)))
+        for data, width in self.paths.get((structure, key), ()):
+            parts.append(path_boxes(np.frombuffer(data, ">i4").reshape(-1, 2).astype(np.float64), width))
+        return np.concatenate(parts) if parts else np.empty((0, 4))
+
+
+def reference_matrix(reference):
+    radians = math.radians(reference.angle)
+    # multiples of 90 degrees stay exact, see Raster.add
+    cos, sin = round(math.cos(radians), 12), round(math.sin(radians), 12)
+    reflect = -1.0 if reference.reflect else 1.0
+    scale = reference.magnification
+    return np.array([[scale * cos, -scale * sin * reflect], [scale * sin, scale * cos * reflect]])
+
+
+def reference_offsets(reference):
+    """Origins of every instance of a reference, an array of AREF."""
+    columns, rows = np.meshgrid(np.arange(max(reference.columns, 1)), np.arange(max(reference.rows, 1)), indexing="ij")
+    return (
+        np.array(reference.origin, dtype=np.float64)
+        + columns.reshape(-1, 1) * np.array(reference.column_step)
+        + rows.reshape(-1, 1) * np.array(reference.row_step)
+    )
+
+
+def placements(library, top):
+    """Yields (structure, matrices (k, 2, 2), offsets (k, 2)) for every
+    structure under top, parents before children, with the k placements
+    of the structure in the coordinates of top."""
+    order = []
+    seen = set()
+
+    def visit(name):
+        seen.add(name)
+        for child in library.children(name):
+            if child in library.structures and child not in seen:
+                visit(child)
+        order.append(name)
+
+    visit(top)
+    pending = {top: [(np.eye(2)[None], np.zeros((1, 2)))]}
+    for name in reversed(order):
+        parts = pending.pop(name, None)
+        if not parts:
+            continue
+        matrices = np.concatenate([matrix for matrix, _ in parts])
+        offsets = np.concatenate([offset for _, offset in parts])
+        yield name, matrices, offsets
+        for reference in library.structures[name].references:
+            if reference.name not in library.structures:
+                continue
+            steps = reference_offsets(reference)
+            composed = np.repeat(matrices @ reference_matrix(reference), len(steps), axis=0)
+            moved = (np.einsum("kab,jb->kja", matrices, steps) + offsets[:, None, :]).reshape(-1, 2)
+            pending.setdefault(reference.name, []).append((composed, moved))
+
+
+class Raster:
+    """Coverage of a layer on a grid of pixel database units from origin,
+    accumulated in a 2d difference array."""
+
+    def __init__(self, origin, shape, pixel):
+        self.origin = np.array(origin, dtype=np.float64)
+        self.shape = shape
+        self.pixel = pixel
+        self.difference = np.zeros((shape[0] + 1) * (shape[1] + 1))
+        # boxes in pixels waiting to be painted, in batches of about CHUNK
+        self.pending = []
+        self.pending_boxes = 0
+
+    def add(self, boxes, matrices, offsets):
+        """Adds boxes placed with every transform."""
+        # rotations by multiples of 90 degrees map a box onto the box of its
+        # two opposite corners, any other angle needs all four
+        aligned = np.all((matrices[:, 0, 1] == 0) & (matrices[:, 1, 0] == 0) | (matrices[:, 0, 0] == 0) & (matrices[:, 1, 1] == 0))
+        xs = boxes[:, [0, 2]] if aligned else boxes[:, [0, 0, 2, 2]]
+        ys = boxes[:, [1, 3]] if aligned else boxes[:, [1, 3, 1, 3]]
+        xs = (xs - self.origin[0]) / self.pixel
+        ys = (ys - self.origin[1]) / self.pixel
+        offsets = (offsets - self.origin) / self.pixel + np.einsum("kab,b->ka", matrices, self.origin) / self.pixel
+        step = max(1, CHUNK // max(len(boxes), 1))
+        for start in range(0, len(matrices), step):
+            m = matrices[start:start + step, :, :, None, None]
+            o = offsets[start:start + step, :, None, None]
+            x = m[:, 0, 0] * xs + m[:, 0, 1] * ys + o[:, 0]
+            y = m[:, 1, 0] * xs + m[:, 1, 1] * ys + o[:, 1]
+            placed = np.empty((x.shape[0] * x.shape[1], 4))
+            np.clip(x.min(-1).ravel(), 0, self.shape[0], out=placed[:, 0])
+            np.clip(y.min(-1).ravel(), 0, self.shape[1], out=placed[:, 1])
+            np.clip(x.max(-1).ravel(), 0, self.shape[0], out=placed[:, 2])
+            np.clip(y.max(-1).ravel(), 0, self.shape[1], out=placed[:, 3])
+            self.pending.append(placed)
+            self.pending_boxes += len(placed)
+            if self.pending_boxes >= CHUNK:
+                self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.paint(*np.concatenate(self.pending).T)
+        self.pending = []
+        self.pending_boxes = 0
+
+    @staticmethod
+    def steps(low, high):
+        """Positions and weights, each (4, n), of the differences along an
+        axis of the coverage of [low, high): a partial first pixel, whole
+        pixels and a partial last pixel."""
+        first = np.floor(low).astype(np.int64)
+        last = np.ceil(high).astype(np.int64)
+        single = last - first == 1
+        head = np.where(single, high - low, first + 1 - low)
+        tail = np.where(single, 0.0, high - (last - 1))
+        positions = np.stack([first, first + 1, np.where(single, first + 1, last - 1), np.where(single, first + 1, last)])
+        weights = np.stack([head, np.where(single, -head, 1 - head), np.where(single, 0.0, tail - 1), -tail])
+        return positions, weights
+
+    def paint(self, x0, y0, x1, y1):
+        used = (x1 > x0) & (y1 > y0)
+        x_positions, x_weights = self.steps(x0[used], x1[used])
+        y_positions, y_weights = self.steps(y0[used], y1[used])
+        # the 2d differences of a box are the outer product of its 1d ones
+        indices = x_positions[:, None, :] * (self.shape[1] + 1) + y_positions[None, :, :]
+        weights = x_weights[:, None, :] * y_weights[None, :, :]
+        self.difference += np.bincount(indices.ravel(), weights.ravel(), minlength=len(self.difference))
+
+    def coverage(self):
+        self.flush()
+        covered = self.difference.reshape(self.shape[0] + 1, self.shape[1] + 1)
+        np.cumsum(covered, 0, out=covered)
+        np.cumsum(covered, 1, out=covered)
+        return np.clip(covered[:self.shape[0], :self.shape[1]], 0.0, 1.0, out=covered[:self.shape[0], :self.shape[1]])
+
+
+def window_starts(size, window, step):
+    """Starts of the windows along an axis of size pixels; the last window
+    ends at the edge and a layout smaller than a window is one window."""
+    if size <= window:
+        return np.array([0])
+    starts = np.arange(0, size - window + 1, step)
+    if starts[-1] != size - window:
+        starts = np.append(starts, size - window)
+    return starts
+
+
+def layer_densities(library, collector, top, layers, window=WINDOW, step=None, resolution=RESOLUTION):
+    """Returns a LayerDensity per layer: its area in um^2, the windows
+    (x0, y0, x1, y1 in um), their column and row and their density."""
+    dbu = library.dbu
+    box = library.bbox(top) or (0, 0, 0, 0)
+    pixel = resolution / dbu
+    shape = (max(1, math.ceil((box[2] - box[0]) / pixel)), max(1, math.ceil((box[3] - box[1]) / pixel)))
+    size = max(1, round(window / resolution))
+    step = max(1, round((step or window) / resolution))
+    results = []
+    # one raster at a time, a chip at 1 um is some 100 MB per layer
+    for layer in layers:
+        raster = Raster(box[:2], shape, pixel)
+        for name, matrices, offsets in placements(library, top):
+            boxes = collector.boxes(name, (layer.layer, layer.datatype))
+            if len(boxes):
+                raster.add(boxes, matrices, offsets)
+        coverage = raster.coverage()
+        integral = np.zeros((shape[0] + 1, shape[1] + 1))
+        np.cumsum(coverage, 0, out=integral[1:, 1:])
+        np.cumsum(integral[1:, 1:], 1, out=integral[1:, 1:])
+        x0 = window_starts(shape[0], size, step)
+        y0 = window_starts(shape[1], size, step)
+        x1 = np.minimum(x0 + size, shape[0])
+        y1 = np.minimum(y0 + size, shape[1])
+        sums = integral[x1][:, y1] - integral[x0][:, y1] - integral[x1][:, y0] + integral[x0][:, y0]
+        density = sums / np.outer(x1 - x0, y1 - y0)
+        columns, rows = np.meshgrid(np.arange(len(x0)), np.arange(len(y0)), indexing="ij")
+        windows = np.column_stack([
+            box[0] * dbu + x0[columns.ravel()] * resolution,
+            box[1] * dbu + y0[rows.ravel()] * resolution,
+            box[0] * dbu + x1[columns.ravel()] * resolution,
+            box[1] * dbu + y1[rows.ravel()] * resolution,
+        ])
+        cells = np.column_stack([columns.ravel(), rows.ravel()])
+        results.append(LayerDensity(layer, float(coverage.sum()) * resolution * resolution, windows, cells, density.ravel()))
+    return results
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Chained steps run as a dependency graph.
+
+A flow is a batch manifest whose steps may name the steps they come
+`after` and the `outputs` they write (by default their `--output`). A
+step also comes after every step whose outputs it reads. Like make, a
+step is skipped when the digest of its command line and its inputs
+matches the one recorded when its outputs were written, and those outputs
+are unchanged since. Digests are of the content, so a step rerun into
+identical outputs doesn't rerun the steps reading them.
+"""
+import json
+import os
+import time
+from .batch import IGNORED_OPTIONS, WorkerPool, job_args, job_inputs, load_manifest, run_job, summary_table
+from .cache import get_cache, write_atomic
+from .common import abort
+
+
+def split_values(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return str(value).split()
+
+
+def load_flow(console, flow):
+    """Reads the steps of a flow manifest, with their `after` and
+    `outputs` taken out of the options."""
+    steps = load_manifest(console, flow, "steps")
+    names = set()
+    for step in steps:
+        if step["name"] in names:
+            abort(console, f"step {step['name']} appears twice in {flow}")
+        names.add(step["name"])
+        step["after"] = split_values(step["options"].pop("after", None))
+        outputs = split_values(step["options"].pop("outputs", None))
+        if not outputs and step["options"].get("output"):
+            outputs = [str(step["options"]["output"])]
+        step["outputs"] = [os.path.abspath(path) for path in outputs]
+    for step in steps:
+        unknown = [name for name in step["after"] if name not in names]
+        if unknown:
+            abort(console, f"step {step['name']} comes after unknown steps {' '.join(unknown)}")
+    return steps
+
+
+def step_paths(step):
+    """Absolute paths named by the argument and options of a step, whether
+    they exist yet or not."""
+    values = [step.get("input")]
+    for key, value in step["options"].items():
+        if key.replace("-", "_") not in IGNORED_OPTIONS:
+            values += split_values(value)
+    return {os.path.abspath(str(value)) for value in values if value is not None}
+
+
+def reads(paths, output):
+    # an output is read when it is named, lies in a named directory (magic
+    # searches directories without descending) or contains a named path
+    return any(path == output or os.path.dirname(output) == path or path.startswith(output + os.sep) for path in paths)
+
+
+def dependencies(console, steps):
+    """Returns the names of the steps each step comes after, and the steps
+    in an order where every step comes after its dependencies."""
+    after = {}
+    for step in steps:
+        paths = step_paths(step)
+        after[step["name"]] = set(step["after"]) | {
+            other["name"]
+            for other in steps
+            if other is not step and any(reads(paths, output) for output in other["outputs"])
+        }
+    order = []
+    state = {}
+
+    def visit(name, chain):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            abort(console, f"steps depend on each other: {' -> '.join(chain[chain.index(name):] + [name])}")
+        state[name] = "visiting"
+        for dependency in sorted(after[name]):
+            visit(dependency, chain + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for step in steps:
+        visit(step["name"], [])
+    return after, order
+
+
+def output_digests(outputs, since=None):
+    """Digests of the files of the outputs of a step, None when an output
+    is missing. Directories are walked for the files written since, by
+    their change time: a file linked from the result cache keeps its old
+    modification time."""
+    cache = get_cache()
+    digests = {}
+    for path in outputs:
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            digests[path] = cache.file_digest(path)
+            continue
+        for root, directories, names in os.walk(path):
+            directories[:] = [directory for directory in directories if not directory.startswith(".")]
+            for name in names:
+                child = os.path.join(root, name)
+                if not name.startswith(".") and (since is None or os.stat(child).st_ctime >= since):
+                    digests[child] = cache.file_digest(child)
+    return digests
+
+
+def step_key(step, upstream):
+    """Digest of the command line and the inputs of a step. upstream are
+    the output digests of the steps it comes `after` without reading their
+    outputs, which the inputs cover otherwise."""
+    from .manage import commands
+
+    files, directories = job_inputs(step)
+    # a step isn't an input of itself
+    inputs = sorted(path for path in files | directories if path not in step["outputs"])
+    args = job_args(commands[step["command"]], step)
+    values = {"command": step["command"], "args": "\0".join(args), "cwd": os.getcwd()}
+    values.update({f"upstream:{path}": digest for path, digest in upstream.items()})
+    return get_cache().key(inputs, values)
+
+
+class FlowState:
+    """Keys and output digests of the steps of a flow, written after every
+    step so an interrupted flow keeps what it finished."""
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.steps = json.load(f).get("steps", {})
+            except (OSError, ValueError):
+                self.steps = {}
+
+    def up_to_date(self, step, key):
+        # only the files this step wrote count, not those other steps put
+        # into a shared output directory
+        recorded = self.steps.get(step["name"])
+        if not recorded or recorded["key"] != key:
+            return False
+        current = output_digests(step["outputs"])
+        return current is not None and all(current.get(path) == digest for path, digest in recorded["outputs"].items())
+
+    def record(self, step, key, start, duration):
+        self.steps[step["name"]] = {
+            "key": key,
+            # a second of slack for coarse file system timestamps
+            "outputs": output_digests(step["outputs"], start - 1) or {},
+            "duration": duration,
+            "finished": time.time(),
+        }
+        write_atomic(self.path, json.dumps({"steps": self.steps}, indent=1))
+
+    def forget(self, step):
+        if self.steps.pop(step["name"], None) is not None:
+            write_atomic(self.path, json.dumps({"steps": self.steps}, indent=1))
+
+
+def critical_path(after, order, durations):
+    """Returns the chain of steps with the longest total duration and that
+    duration."""
+    finish, previous = {}, {}
+    for name in order:
+        start = 0.0
+        for dependency in after[name]:
+            if finish[dependency] > start:
+                start, previous[name] = finish[dependency], dependency
+        finish[name] = start + durations.get(name, 0.0)
+    if not finish:
+        return [], 0.0
+    name = max(order, key=lambda name: finish[name])
+    total = finish[name]
+    chain = [name]
+    while chain[-1] in previous:
+        chain.append(previous[chain[-1]])
+    return chain[::-1], total
+
+
+def result(step, status, detail="", duration=0.0):
+    return {
+        "name": step["name"],
+        "command": step["command"],
+        "input": step.get("input"),
+        "status": status,
+        "detail": detail,
+        "duration": duration,
+    }
+
+
+def run_flow(console, steps, state_file, processes=None, log_dir=None, force=False, dry_run=False):
+    """Runs the steps of a flow, independent ones in parallel, skipping
+    those that are up to date. Returns the result of every step."""
+    from .manage import commands
+
+    for step in steps:
+        if step["command"] not in commands:
+            abort(console, f"step {step['name']} has unknown command {step['command']}")
+    after, order = dependencies(console, steps)
+    by_name = {step["name"]: step for step in steps}
+    state = FlowState(state_file)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    if dry_run:
+        stale = set()
+        for name in order:
+            step = by_name[name]
+            upstream = {}
+            for dependency in step["after"]:
+                upstream.update(state.steps.get(dependency, {}).get("outputs", {}))
+            if force or stale & after[name] or not state.up_to_date(step, step_key(step, upstream)):
+                stale.add(name)
+                console.print(f"[cyan]would run[/cyan] {name}")
+            else:
+                console.print(f"[green]up to date[/green] {name}")
+        return []
+
+    processes = processes or os.cpu_count()
+    results = {}
+    upstream_outputs = {}
+    started = set()
+    start = time.time()
+    with WorkerPool(processes) as pool:
+        while len(results) < len(steps):
+            # steps start in flow order once their dependencies are done
+            for name in order:
+                if name in results or name in started or not pool.free():
+                    continue
+                if any(dependency not in results for dependency in after[name]):
+                    continue
+                step = by_name[name]
+                failed = [dependency for dependency in sorted(after[name]) if results[dependency]["status"] not in ("ok", "up to date")]
+                if failed:
+                    results[name] = result(step, "skipped", f"after failed {' '.join(failed)}")
+                    console.print(f"[yellow]skipped[/yellow] {name}")
+                    continue
+                upstream = {}
+                for dependency in step["after"]:
+                    upstream.update(upstream_outputs[dependency])
+                step["key"] = step_key(step, upstream)
+                if not force and state.up_to_date(step, step["key"]):
+                    results[name] = result(step, "up to date")
+                    upstream_outputs[name] = state.steps[name]["outputs"]
+                    console.print(f"[green]up to date[/green] {name}")
+                    continue
+                # a step that fails half way must not look up to date later
+                state.forget(step)
+                # the commands want an existing --output, which a fresh
+                # checkout of a flow doesn't have
+                if step["options"].get("output"):
+                    os.makedirs(str(step["options"]["output"]), exist_ok=True)
+                console.print(f"[cyan]running[/cyan] {name}")
+                step["start"] = time.time()
+                started.add(name)
+                pool.submit(name, run_job, step, log_dir)
+            for name, outcome, error in pool.wait():
+                step = by_name[name]
+                if error:
+                    outcome = result(step, "failed", error)
+                results[name] = outcome
+                if outcome["status"] == "ok":
+                    state.record(step, step["key"], step["start"], outcome["duration"])
+                    upstream_outputs[name] = state.steps[name]["outputs"]
+                color = "green" if outcome["status"] == "ok" else "red"
+                console.print(f"[{color}]{outcome['status']}[/{color}] {name} ({outcome['duration']:.1f}s)")
+    results = [results[step["name"]] for step in steps]
+    console.print(summary_table(results, "flow summary"))
+    chain, total = critical_path(after, order, {item["name"]: item["duration"] for item in results})
+    durations = {item["name"]: item["duration"] for item in results}
+    if chain and total > 0:
+        path = " -> ".join(f"{name} ({durations[name]:.1f}s)" for name in chain)
+        console.print(f"critical path {total:.1f}s of {time.time() - start:.1f}s : {path}")
+    return results
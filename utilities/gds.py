@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming GDSII reader.
+
+Layouts are read record by record, straight out of an mmap of the file (or
+from any binary stream), and only what is needed to describe the library
+is kept: structure names, the SREF/AREF graph and, on request, per
+structure bounding boxes. No polygons are built. read_library skips the
+records it doesn't need by their length and whole runs of rectangles with
+one regex match, so a scan costs about as much as reading the file.
+"""
+import array
+import hashlib
+import math
+import mmap
+import re
+import shutil
+import struct
+import sys
+import tempfile
+
+HEADER = 0x00
+BGNLIB = 0x01
+LIBNAME = 0x02
+UNITS = 0x03
+ENDLIB = 0x04
+BGNSTR = 0x05
+STRNAME = 0x06
+ENDSTR = 0x07
+BOUNDARY = 0x08
+PATH = 0x09
+SREF = 0x0A
+AREF = 0x0B
+TEXT = 0x0C
+LAYER = 0x0D
+DATATYPE = 0x0E
+WIDTH = 0x0F
+XY = 0x10
+ENDEL = 0x11
+SNAME = 0x12
+COLROW = 0x13
+NODE = 0x15
+TEXTTYPE = 0x16
+STRING = 0x19
+STRANS = 0x1A
+MAG = 0x1B
+ANGLE = 0x1C
+BOX = 0x2D
+BOXTYPE = 0x2E
+
+ELEMENTS = (BOUNDARY, PATH, SREF, AREF, TEXT, NODE, BOX)
+SHAPES = (BOUNDARY, PATH, BOX)
+RECORD_HEADER = struct.Struct(">HBB")
+
+
+class GDSError(Exception):
+    pass
+
+
+def real8(data, offset=0):
+    """Decodes a GDSII 8 byte excess-64 base-16 real."""
+    value = int.from_bytes(data[offset:offset + 8], "big")
+    if not value & 0x00FFFFFFFFFFFFFF:
+        return 0.0
+    sign = -1.0 if value >> 63 else 1.0
+    exponent = (value >> 56) & 0x7F
+    mantissa = value & 0x00FFFFFFFFFFFFFF
+    return sign * mantissa / (1 << 56) * 16.0 ** (exponent - 64)
+
+
+def text(data):
+    return bytes(data).rstrip(b"\0").decode("ascii", "replace")
+
+
+def int32s(data):
+    return struct.unpack(f">{len(data) // 4}i", data)
+
+
+def iter_records(source, raw=False):
+    """Yields (record type, data) for every record of a GDSII stream.
+
+    `source` is a path, which is mmapped, or a binary file object, which is
+    read sequentially. For mmapped files `data` is a zero-copy memoryview.
+    With `raw=True`, `data` is the whole record including its header.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                raise GDSError(f"{source} is empty")
+            try:
+                yield from _iter_buffer(memoryview(buffer), raw)
+            finally:
+                try:
+                    buffer.close()
+                except BufferError:
+                    # a caller still holds one of the yielded records; the
+                    # map is released once that goes away
+                    pass
+    else:
+        yield from _iter_stream(source, raw)
+
+
+def _iter_buffer(view, raw=False):
+    unpack = RECORD_HEADER.unpack_from
+    position = 0
+    end = len(view)
+    while position + 4 <= end:
+        length, record, _ = unpack(view, position)
+        if length < 4:
+            # null padding after ENDLIB
+            if length == 0:
+                return
+            raise GDSError(f"invalid record length {length} at offset {position}")
+        if position + length > end:
+            raise GDSError(f"truncated record at offset {position}")
+        yield record, view[position + (0 if raw else 4):position + length]
+        if record == ENDLIB:
+            return
+        position += length
+    raise GDSError("stream ended without ENDLIB")
+
+
+def _iter_stream(stream, raw=False):
+    read = stream.read
+    unpack = RECORD_HEADER.unpack
+    while True:
+        header = read(4)
+        if len(header) < 4:
+            break
+        length, record, _ = unpack(header)
+        if length < 4:
+            if length == 0:
+                return
+            raise GDSError(f"invalid record length {length}")
+        data = read(length - 4)
+        if len(data) < length - 4:
+            raise GDSError("truncated record")
+        yield record, header + data if raw else data
+        if record == ENDLIB:
+            return
+    raise GDSError("stream ended without ENDLIB")
+
+
+class Reference:
+    __slots__ = ("name", "origin", "reflect", "magnification", "angle", "columns", "rows", "column_step", "row_step")
+
+    def __init__(self, name):
+        self.name = name
+        self.origin = (0, 0)
+        self.reflect = False
+        self.magnification = 1.0
+        self.angle = 0.0
+        self.columns = 1
+        self.rows = 1
+        self.column_step = (0, 0)
+        self.row_step = (0, 0)
+
+    def transform(self, x, y):
+        """Maps a point of the referenced structure into its parent."""
+        if self.reflect:
+            y = -y
+        x *= self.magnification
+        y *= self.magnification
+        if self.angle:
+            radians = math.radians(self.angle)
+            cos, sin = math.cos(radians), math.sin(radians)
+            x, y = x * cos - y * sin, x * sin + y * cos
+        return x + self.origin[0], y + self.origin[1]
+
+    def transform_box(self, box):
+        x0, y0, x1, y1 = box
+        points = [self.transform(x, y) for x, y in ((x0, y0), (x0, y1), (x1, y0), (x1, y1))]
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        # for arrays the corner instances bound all the others
+        dx = (self.columns - 1) * self.column_step[0], (self.rows - 1) * self.row_step[0]
+        dy = (self.columns - 1) * self.column_step[1], (self.rows - 1) * self.row_step[1]
+        return (
+            min(xs) + min(0, dx[0]) + min(0, dx[1]),
+            min(ys) + min(0, dy[0]) + min(0, dy[1]),
+            max(xs) + max(0, dx[0]) + max(0, dx[1]),
+            max(ys) + max(0, dy[0]) + max(0, dy[1]),
+        )
+
+
+class Structure:
+    __slots__ = ("name", "references", "box", "elements")
+
+    def __init__(self, name):
+        self.name = name
+        self.references = []
+        self.box = None
+        self.elements = 0
+
+    def extend(self, box):
+        if self.box is None:
+            self.box = box
+        else:
+            self.box = (
+                min(self.box[0], box[0]),
+                min(self.box[1], box[1]),
+                max(self.box[2], box[2]),
+                max(self.box[3], box[3]),
+            )
+
+
+class Library:
+    def __init__(self):
+        self.name = None
+        self.user_unit = None
+        self.meters_per_unit = None
+        self.structures = {}
+        self._boxes = {}
+
+    @property
+    def dbu(self):
+        """Database unit in microns."""
+        return self.meters_per_unit * 1e6 if self.meters_per_unit else None
+
+    def children(self, name):
+        return {reference.name for reference in self.structures[name].references}
+
+    @property
+    def tops(self):
+        referenced = set()
+        for structure in self.structures.values():
+            referenced.update(reference.name for reference in structure.references)
+        return [name for name in self.structures if name not in referenced]
+
+    @property
+    def missing(self):
+        """Structures that are referenced but not defined in the library."""
+        missing = set()
+        for structure in self.structures.values():
+            missing.update(
+                reference.name
+                for reference in structure.references
+                if reference.name not in self.structures
+            )
+        return sorted(missing)
+
+    def bbox(self, name):
+        """Bounding box of a structure and its subtree in database units."""
+        if name in self._boxes:
+            return self._boxes[name]
+        structure = self.structures.get(name)
+        if structure is None:
+            return None
+        # guard against reference cycles in broken files
+        self._boxes[name] = None
+        box = structure.box
+        for reference in structure.references:
+            child = self.bbox(reference.name)
+            if child is None:
+                continue
+            child = reference.transform_box(child)
+            box = child if box is None else (
+                min(box[0], child[0]),
+                min(box[1], child[1]),
+                max(box[2], child[2]),
+                max(box[3], child[3]),
+            )
+        self._boxes[name] = box
+        return box
+
+
+# a BOUNDARY of one layer and datatype with 5 points, how rectangles are
+# written; runs of them are matched by the regex engine instead of being
+# read record by record
+RECTANGLE = 64
+RECTANGLES = re.compile(
+    b"(?:"
+    + re.escape(RECORD_HEADER.pack(4, BOUNDARY, 0) + RECORD_HEADER.pack(6, LAYER, 2))
+    + b".."
+    + re.escape(RECORD_HEADER.pack(6, DATATYPE, 2))
+    + b".."
+    + re.escape(RECORD_HEADER.pack(44, XY, 3))
+    + b".{40}"
+    + re.escape(RECORD_HEADER.pack(4, ENDEL, 0))
+    + b")+",
+    re.DOTALL,
+)
+# words of a rectangle holding its x and y, as 32 bit integers
+RECTANGLE_XS = (5, 7, 9, 11)
+RECTANGLE_YS = (6, 8, 10, 12)
+STREAM_CHUNK = 1 << 22
+
+
+def rectangle_words(data):
+    words = array.array("i")
+    words.frombytes(data)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words
+
+
+class LibraryReader:
+    """State of read_library between the buffers it is fed."""
+
+    def __init__(self, boxes=False, shape=None, rectangles=None):
+        self.library = Library()
+        self.boxes = boxes
+        self.shape = shape
+        self.rectangles = rectangles
+        self.structure = None
+        self.element = None
+        self.reference = None
+        self.layer = self.datatype = self.width = None
+        self.ended = False
+        self.offset = 0
+
+    def run(self, buffer, position, end):
+        """Reads the rectangles of buffer[position:end]."""
+        structure = self.structure
+        if structure is None:
+            raise GDSError(f"element outside a structure at offset {self.offset + position}")
+        structure.elements += (end - position) // RECTANGLE
+        if self.boxes:
+            words = rectangle_words(buffer[position:end])
+            xs = [function(words[index::16]) for index in RECTANGLE_XS for function in (min, max)]
+            ys = [function(words[index::16]) for index in RECTANGLE_YS for function in (min, max)]
+            structure.extend((min(xs), min(ys), max(xs), max(ys)))
+        if self.rectangles is not None:
+            self.rectangles(structure.name, buffer[position:end])
+        elif self.shape is not None:
+            for start in range(position, end, RECTANGLE):
+                layer, datatype = struct.unpack_from(">h4xh", buffer, start + 8)
+                self.shape(structure.name, BOUNDARY, layer, datatype, None, buffer[start + 20:start + 60])
+
+    def feed(self, buffer, position, end):
+        """Reads the complete records of buffer[position:end] and returns
+        the offset of the first record it couldn't read whole. Only the
+        records describing the library are decoded, the others are skipped
+        by their length."""
+        library = self.library
+        unpack = RECORD_HEADER.unpack_from
+        match = RECTANGLES.match
+        decode = self.boxes or self.shape is not None
+        shape = self.shape
+        structure, element, reference = self.structure, self.element, self.reference
+        layer, datatype, width = self.layer, self.datatype, self.width
+        try:
+            while position + 4 <= end:
+                length, record, _ = unpack(buffer, position)
+                if length < 4:
+                    # null padding after ENDLIB
+                    if length == 0:
+                        self.ended = True
+                        return position
+                    raise GDSError(f"invalid record length {length} at offset {self.offset + position}")
+                if position + length > end:
+                    return position
+                if record == BOUNDARY:
+                    found = match(buffer, position, end)
+                    if found:
+                        self.structure = structure
+                        self.run(buffer, position, found.end())
+                        position = found.end()
+                        continue
+                if record == XY:
+                    if reference is not None:
+                        points = int32s(buffer[position + 4:position + length])
+                        reference.origin = (points[0], points[1])
+                        if element == AREF and len(points) >= 6 and reference.columns and reference.rows:
+                            reference.column_step = (
+                                (points[2] - points[0]) / reference.columns,
+                                (points[3] - points[1]) / reference.columns,
+                            )
+                            reference.row_step = (
+                                (points[4] - points[0]) / reference.rows,
+                                (points[5] - points[1]) / reference.rows,
+                            )
+                    elif decode and element in SHAPES:
+                        data = buffer[position + 4:position + length]
+                        if self.boxes:
+                            points = int32s(data)
+                            xs = points[0::2]
+                            ys = points[1::2]
+                            structure.extend((min(xs), min(ys), max(xs), max(ys)))
+                        if shape is not None:
+                            shape(structure.name, element, layer, datatype, width, data)
+                elif record == ENDEL:
+                    element = None
+                    reference = None
+                elif record in ELEMENTS:
+                    if structure is None:
+                        raise GDSError(f"element outside a structure at offset {self.offset + position}")
+                    element = record
+                    structure.elements += 1
+                    layer = datatype = width = None
+                elif record == SNAME:
+                    if structure is None:
+                        raise GDSError(f"SNAME outside a structure at offset {self.offset + position}")
+                    reference = Reference(text(buffer[position + 4:position + length]))
+                    structure.references.append(reference)
+                elif reference is not None:
+                    if record == COLROW:
+                        reference.columns, reference.rows = struct.unpack_from(">hh", buffer, position + 4)
+                    elif record == STRANS:
+                        reference.reflect = bool(buffer[position + 4] & 0x80)
+                    elif record == MAG:
+                        reference.magnification = real8(buffer, position + 4)
+                    elif record == ANGLE:
+                        reference.angle = real8(buffer, position + 4)
+                elif element is not None:
+                    if shape is not None:
+                        if record == LAYER:
+                            layer = struct.unpack_from(">h", buffer, position + 4)[0]
+                        elif record in (DATATYPE, BOXTYPE):
+                            datatype = struct.unpack_from(">h", buffer, position + 4)[0]
+                        elif record == WIDTH:
+                            width = struct.unpack_from(">i", buffer, position + 4)[0]
+                elif record == STRNAME:
+                    structure = Structure(text(buffer[position + 4:position + length]))
+                    library.structures[structure.name] = structure
+                elif record == ENDSTR:
+                    structure = None
+                elif record == LIBNAME:
+                    library.name = text(buffer[position + 4:position + length])
+                elif record == UNITS:
+                    library.user_unit = real8(buffer, position + 4)
+                    library.meters_per_unit = real8(buffer, position + 12)
+                elif record == ENDLIB:
+                    self.ended = True
+                    return position + length
+                position += length
+            return position
+        finally:
+            self.structure, self.element, self.reference = structure, element, reference
+            self.layer, self.datatype, self.width = layer, datatype, width
+
+
+def read_library(source, boxes=False, shape=None, rectangles=None):
+    """Scans a GDSII stream into a Library.
+
+    `source` is a path, which is mmapped, or a binary file object. Only the
+    structure graph is collected, unless `boxes` asks for the bounding box
+    of the shapes of every structure. `shape`, if given, is called with
+    (structure name, element, layer, datatype, width, XY data) for every
+    shape; `rectangles`, if given, takes the rectangles instead, called with
+    (structure name, data) for runs of them, RECTANGLE bytes each.
+    """
+    reader = LibraryReader(boxes, shape, rectangles)
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise GDSError(f"{source} is empty")
+            with buffer:
+                position = reader.feed(buffer, 0, len(buffer))
+                if not reader.ended and position < len(buffer):
+                    raise GDSError(f"truncated record at offset {position}")
+    else:
+        pending = b""
+        while not reader.ended:
+            data = source.read(STREAM_CHUNK)
+            if not data:
+                if pending:
+                    raise GDSError(f"truncated record at offset {reader.offset}")
+                break
+            buffer = pending + data if pending else data
+            position = reader.feed(buffer, 0, len(buffer))
+            pending = buffer[position:]
+            reader.offset += position
+    if not reader.ended:
+        raise GDSError("stream ended without ENDLIB")
+    return reader.library
+
+
+def structure_names(source):
+    """Returns the names of the structures defined in a GDSII stream."""
+    return list(read_library(source).structures)
+
+
+def canonical_points(data):
+    """Closed polygon points, starting from the smallest vertex and going
+    the same way round, so writers that start elsewhere hash the same."""
+    points = int32s(data)
+    vertices = list(zip(points[0::2], points[1::2]))
+    if len(vertices) > 1 and vertices[0] == vertices[-1]:
+        vertices.pop()
+    if not vertices:
+        return b""
+    start = vertices.index(min(vertices))
+    forward = vertices[start:] + vertices[:start]
+    backward = [forward[0]] + forward[:0:-1]
+    vertices = min(forward, backward)
+    return struct.pack(f">{len(vertices) * 2}i", *(value for vertex in vertices for value in vertex))
+
+
+class CellHash:
+    __slots__ = ("name", "local", "children", "elements")
+
+    def __init__(self, name, local, children, elements):
+        self.name = name
+        self.local = local
+        self.children = children
+        self.elements = elements
+
+
+def hash_cells(source):
+    """Hashes the geometry and instance list of every structure.
+
+    Each element is hashed from its records (boundary points canonicalized)
+    and a structure's local hash combines the sorted element hashes, so
+    element order and structure timestamps don't matter.
+    """
+    cells = {}
+    name = None
+    element_hashes = []
+    children = set()
+    element = None
+    for record, data in iter_records(source):
+        if record in ELEMENTS:
+            element = hashlib.sha1(bytes((record,)))
+            element_type = record
+        elif record == ENDEL:
+            element_hashes.append(element.digest())
+            element = None
+        elif element is not None:
+            if record == XY and element_type == BOUNDARY:
+                data = canonical_points(data)
+            elif record == SNAME:
+                children.add(text(data))
+            element.update(bytes((record,)))
+            element.update(len(data).to_bytes(4, "big"))
+            element.update(data)
+        elif record == STRNAME:
+            name = text(data)
+            element_hashes = []
+            children = set()
+        elif record == ENDSTR:
+            local = hashlib.sha1()
+            for digest in sorted(element_hashes):
+                local.update(digest)
+            cells[name] = CellHash(name, local.hexdigest(), children, len(element_hashes))
+            name = None
+    return cells
+
+
+def subtree_hashes(cells):
+    """Combines each cell's local hash with the subtree hashes of its children."""
+    hashes = {}
+
+    def subtree(name):
+        if name not in hashes:
+            cell = cells.get(name)
+            if cell is None:
+                hashes[name] = "missing"
+                return hashes[name]
+            # guard against reference cycles in broken files
+            hashes[name] = cell.local
+            combined = hashlib.sha1(cell.local.encode())
+            for child in sorted(cell.children):
+                combined.update(f"{child}\0{subtree(child)}\0".encode())
+            hashes[name] = combined.hexdigest()
+        return hashes[name]
+
+    for name in cells:
+        subtree(name)
+    return hashes
+
+
+def subtree_names(cells, top):
+    names = set()
+    stack = [top]
+    while stack:
+        name = stack.pop()
+        if name in names or name not in cells:
+            continue
+        names.add(name)
+        stack.extend(cells[name].children)
+    return names
+
+
+def compare_cells(cells_a, cells_b, top):
+    """Compares the hierarchy under `top` in two layouts.
+
+    Returns {cell: status} with status one of identical, changed (its own
+    shapes or instances differ), subtree (only something below it changed),
+    added or removed.
+    """
+    hashes_a = subtree_hashes(cells_a)
+    hashes_b = subtree_hashes(cells_b)
+    names = subtree_names(cells_a, top) | subtree_names(cells_b, top)
+    status = {}
+    for name in sorted(names):
+        if name not in cells_b:
+            status[name] = "removed"
+        elif name not in cells_a:
+            status[name] = "added"
+        elif cells_a[name].local != cells_b[name].local:
+            status[name] = "changed"
+        elif hashes_a[name] != hashes_b[name]:
+            status[name] = "subtree"
+        else:
+            status[name] = "identical"
+    return status
+
+
+def xor_roots(cells, status, top):
+    """The highest changed cells under `top`: XORing these flat covers every
+    difference, and everything outside their subtrees is identical."""
+    roots = []
+    stack = [top]
+    seen = set()
+    while stack:
+        name = stack.pop()
+        if name in seen or name not in cells:
+            continue
+        seen.add(name)
+        if status.get(name) == "changed":
+            roots.append(name)
+        elif status.get(name) == "subtree":
+            stack.extend(cells[name].children)
+    return sorted(roots)
+
+
+def shape_layers(source):
+    """The (layer, datatype) pairs used by shapes, texts excluded."""
+    layers = set()
+    element = None
+    layer = None
+    for record, data in iter_records(source):
+        if record in ELEMENTS:
+            element = record
+        elif record == LAYER:
+            layer = struct.unpack(">h", data[:2])[0]
+        elif record in (DATATYPE, BOXTYPE) and element in SHAPES:
+            layers.add((layer, struct.unpack(">h", data[:2])[0]))
+        elif record == ENDEL:
+            element = None
+    return layers
+
+
+def merge_libraries(sources, destination):
+    """Writes one library holding the structures of all sources.
+
+    Structures with the same name are merged into one holding the elements
+    of every source, which is how flat outputs of runs over disjoint layer
+    sets are put back together. A reference found in several sources is
+    written once, so its cell isn't placed on top of itself. Elements are
+    spooled to temporary files, so memory use does not grow with the size
+    of the sources.
+    """
+    header = []
+    structures = {}
+    for index, source in enumerate(sources):
+        spool = None
+        reference = None
+        for record, data in iter_records(source, raw=True):
+            if record == BGNSTR:
+                begin = bytes(data)
+                spool = None
+            elif record == STRNAME:
+                name = text(data[4:])
+                if name not in structures:
+                    structures[name] = (begin, bytes(data), tempfile.TemporaryFile(), set())
+                spool, references = structures[name][2:]
+            elif record == ENDSTR:
+                spool = None
+            elif record == ENDLIB:
+                break
+            elif spool is not None:
+                if record in (SREF, AREF):
+                    reference = bytearray()
+                if reference is None:
+                    spool.write(data)
+                    continue
+                reference += data
+                if record == ENDEL:
+                    reference = bytes(reference)
+                    if reference not in references:
+                        references.add(reference)
+                        spool.write(reference)
+                    reference = None
+            elif index == 0:
+                header.append(bytes(data))
+    with open(destination, "wb") as f:
+        for data in header:
+            f.write(data)
+        for begin, name, spool, _ in structures.values():
+            f.write(begin)
+            f.write(name)
+            spool.seek(0)
+            shutil.copyfileobj(spool, f)
+            spool.close()
+            f.write(RECORD_HEADER.pack(4, ENDSTR, 0))
+        f.write(RECORD_HEADER.pack(4, ENDLIB, 0))
+
+
+def layer_hashes(source):
+    """Hashes the shapes of every layer across the whole library.
+
+    Returns ({"layer/datatype": hash}, instance hash). The instance hash
+    covers every SREF/AREF, so any change to placement shows up there while
+    the layer hashes tell which layers a change touched.
+    """
+    layers = {}
+    instances = hashlib.sha1()
+    name = None
+    element = None
+    element_type = None
+    layer = None
+    for record, data in iter_records(source):
+        if record in ELEMENTS:
+            element = hashlib.sha1(bytes((record,)))
+            element_type = record
+            layer = None
+        elif record == ENDEL:
+            if element_type in (SREF, AREF):
+                instances.update(f"{name}\0".encode())
+                instances.update(element.digest())
+            elif layer is not None:
+                layers.setdefault(layer, []).append(hashlib.sha1(f"{name}\0".encode() + element.digest()).digest())
+            element = None
+        elif element is not None:
+            if record == LAYER:
+                layer = struct.unpack(">h", data[:2])[0]
+            elif record in (DATATYPE, TEXTTYPE, BOXTYPE):
+                layer = f"{layer}/{struct.unpack('>h', data[:2])[0]}"
+            elif record == XY and element_type == BOUNDARY:
+                data = canonical_points(data)
+            element.update(bytes((record,)))
+            element.update(len(data).to_bytes(4, "big"))
+            element.update(data)
+        elif record == STRNAME:
+            name = text(data)
+    hashes = {}
+    for layer, digests in layers.items():
+        combined = hashlib.sha1()
+        for digest in sorted(digests):
+            combined.update(digest)
+        # "layer" alone for an element without a datatype
+        hashes[str(layer)] = combined.hexdigest()
+    return hashes, instances.hexdigest()
+
+
+def iter_shape_boxes(source):
+    """Yields (cell, "layer/datatype", (x0, y0, x1, y1)) for every shape,
+    with coordinates in microns."""
+    scale = 1.0
+    name = None
+    element = None
+    layer = None
+    for record, data in iter_records(source):
+        if record in ELEMENTS:
+            element = record
+        elif record == ENDEL:
+            element = None
+        elif element in SHAPES:
+            if record == LAYER:
+                layer = struct.unpack(">h", data[:2])[0]
+            elif record in (DATATYPE, BOXTYPE):
+                layer = f"{layer}/{struct.unpack('>h', data[:2])[0]}"
+            elif record == XY:
+                points = int32s(data)
+                xs = points[0::2]
+                ys = points[1::2]
+                yield name, layer, (min(xs) * scale, min(ys) * scale, max(xs) * scale, max(ys) * scale)
+        elif record == STRNAME:
+            name = text(data)
+        elif record == UNITS:
+            scale = real8(data, 8) * 1e6
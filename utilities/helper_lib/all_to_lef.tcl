@@ -1,18 +1,31 @@
 drc off
 crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+macro_ready
+phase load
 if { $::env(MAG_TO_LEF) } {
     load $::env(MACRO)
 }
 if { $::env(GDS_TO_LEF) } {
+    phase gds_read
     gds read $::env(MACRO)
-    load [file rootname [file tail $::env(MACRO)]]
+    if { [info exists ::env(TOP_CELL)] } {
+        load $::env(TOP_CELL)
+    } else {
+        load [file rootname [file tail $::env(MACRO)]]
+    }
 }
 if { $::env(DEF_TO_LEF) } {
     lef read $::env(PDK_ROOT)/$::env(PDK)/libs.ref/sky130_fd_sc_hd/techlef/sky130_fd_sc_hd__nom.tlef
+    phase def_read
     def read $::env(MACRO)
     load [file rootname [file tail $::env(MACRO)]]
 }
+phase expand
 select top cell
 expand
+phase lef_write
 lef write $::env(OUTPUT)/[file rootname [file tail $::env(MACRO)]].lef
+phase done
 quit -noprompt
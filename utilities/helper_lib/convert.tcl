@@ -0,0 +1,103 @@
+drc off
+crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+macro_ready
+set design [file rootname [file tail $::env(MACRO)]]
+# the gds top cell comes from the preflight and need not match the file name
+set top $design
+if { [info exists ::env(TOP_CELL)] } {
+    set top $::env(TOP_CELL)
+}
+if { $::env(SOURCE) eq "gds" } {
+    phase gds_read
+    gds read $::env(MACRO)
+    phase load
+    load $top
+}
+if { $::env(SOURCE) eq "mag" } {
+    phase load
+    addpath [file dirname $::env(MACRO)]
+    if { [info exists ::env(MAG_DIR)] } {
+        foreach mag_dir [env_paths MAG_DIR] {
+            addpath $mag_dir
+        }
+    }
+    if { [info exists ::env(MAGLEF_MACRO)] } {
+        foreach maglef_macro [env_paths MAGLEF_MACRO] {
+            load $maglef_macro
+        }
+    }
+    if { [info exists ::env(GDS_MACRO)] } {
+        foreach gds_macro [env_paths GDS_MACRO] {
+            load [file rootname [file rootname [file tail $gds_macro]]]
+            property LEFview true
+            property GDS_FILE $gds_macro
+            property GDS_START 0
+        }
+    }
+    load $design -dereference
+}
+if { $::env(SOURCE) eq "def" } {
+    phase lef_read
+    lef read $::env(PDK_ROOT)/$::env(PDK)/libs.ref/sky130_fd_sc_hd/techlef/sky130_fd_sc_hd__nom.tlef
+    lef read $::env(PDK_ROOT)/$::env(PDK)/libs.ref/sky130_fd_sc_hvl/techlef/sky130_fd_sc_hvl__nom.tlef
+    if { [info exists ::env(EXTRA_LEFS)] } {
+        foreach lef_file [env_paths EXTRA_LEFS] {
+            lef read $lef_file
+        }
+    }
+    phase def_read
+    def read $::env(MACRO)
+    load $design
+}
+phase expand
+select top cell
+expand
+
+# Every view below is written from the design loaded above. Extraction for
+# the DEF changes labels, so it goes last.
+if { $::env(TO_MAG) } {
+    phase mag_write
+    save $::env(OUTPUT)/$design.mag
+}
+if { $::env(TO_LEF) } {
+    phase lef_write
+    lef write $::env(OUTPUT)/$design.lef
+}
+if { $::env(TO_GDS) } {
+    phase gds_write
+    if { [info exists ::env(EXTRA_GDS_FILES)] } {
+        gds readonly true
+        gds rescale false
+        foreach gds_file [env_paths EXTRA_GDS_FILES] {
+            gds read $gds_file
+        }
+        load $top
+        select top cell
+        expand
+    }
+    cif *hier write disable
+    cif *array write disable
+    if { $::env(MAGIC_GDS_ALLOW_ABSTRACT) } {
+        gds abstract allow
+    }
+    gds write [gds_output]/$design.gds
+}
+if { $::env(TO_DEF) } {
+    phase extract
+    # see gds_to_def.tcl
+    if { [info exists ::env(EXTRACT_DIR)] } {
+        cd $::env(EXTRACT_DIR)
+    }
+    extract do local
+    extract no all
+    extract unique
+    extract
+    phase def_write
+    set def_tmp [file join $::env(OUTPUT) .$design.[pid].def]
+    def write $def_tmp -units 1000
+    file rename -force $def_tmp [file join $::env(OUTPUT) $design.def]
+}
+phase done
+quit -noprompt
@@ -1,25 +1,32 @@
 drc off
 crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+phase lef_read
 lef read $::env(PDK_ROOT)/$::env(PDK)/libs.ref/sky130_fd_sc_hd/techlef/sky130_fd_sc_hd__nom.tlef
 lef read $::env(PDK_ROOT)/$::env(PDK)/libs.ref/sky130_fd_sc_hvl/techlef/sky130_fd_sc_hvl__nom.tlef
 if {  [info exist ::env(EXTRA_LEFS)] } {
-    foreach lef_file $::env(EXTRA_LEFS) {
+    foreach lef_file [env_paths EXTRA_LEFS] {
         lef read $lef_file
     }
 }
+phase def_read
 def read $::env(MACRO)
 load [file rootname [file tail $::env(MACRO)]]
+phase expand
 select top cell
 expand
 if { $::env(DEF_TO_MAG) } {
+    phase mag_write
     save $::env(OUTPUT)/[file rootname [file tail $::env(MACRO)]].mag
 }
 
 if { $::env(DEF_TO_GDS) } {
+    phase gds_read
     gds readonly true
     gds rescale false
     if {  [info exist ::env(EXTRA_GDS_FILES)] } {
-		set gds_files_in $::env(EXTRA_GDS_FILES)
+		set gds_files_in [env_paths EXTRA_GDS_FILES]
 		foreach gds_file $gds_files_in {
 			gds read $gds_file
 		}
@@ -27,12 +34,14 @@ if { $::env(DEF_TO_GDS) } {
     load [file rootname [file tail $::env(MACRO)]]
     select top cell
     expand
+    phase gds_write
     cif *hier write disable
     cif *array write disable
     if { $::env(MAGIC_GDS_ALLOW_ABSTRACT) } { 
         gds abstract allow
     }
 
-	gds write $::env(OUTPUT)/[file rootname [file tail $::env(MACRO)]].gds
+	gds write [gds_output]/[file rootname [file tail $::env(MACRO)]].gds
 }
+phase done
 quit -noprompt
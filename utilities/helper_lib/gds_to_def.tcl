@@ -1,12 +1,35 @@
 drc off
 crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+macro_ready
+phase gds_read
 gds read $::env(MACRO)
-load [file rootname [file tail $::env(MACRO)]]
+if { [info exists ::env(TOP_CELL)] } {
+    set top $::env(TOP_CELL)
+} else {
+    set top [file rootname [file tail $::env(MACRO)]]
+}
+phase load
+load $top
+phase expand
 select top cell
 expand
+phase extract
+# .ext files go to the current directory; the extraction directory keeps
+# them between runs so magic only extracts the cells that changed
+if { [info exists ::env(EXTRACT_DIR)] } {
+    cd $::env(EXTRACT_DIR)
+}
 extract do local
 extract no all
 extract unique
-extract all
-def write [file rootname [file tail $::env(MACRO)]].def -units 1000
+extract
+phase def_write
+# written next to the final name and renamed, so readers never see half a def
+set def_name [file rootname [file tail $::env(MACRO)]]
+set def_tmp [file join $::env(OUTPUT) .$def_name.[pid].def]
+def write $def_tmp -units 1000
+file rename -force $def_tmp [file join $::env(OUTPUT) $def_name.def]
+phase done
 quit -noprompt
\ No newline at end of file
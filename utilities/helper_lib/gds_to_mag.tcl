@@ -1,6 +1,18 @@
 drc off
 crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+macro_ready
+phase gds_read
 gds read $::env(MACRO)
-load [file rootname [file tail $::env(MACRO)]]
+if { [info exists ::env(TOP_CELL)] } {
+    set top $::env(TOP_CELL)
+} else {
+    set top [file rootname [file tail $::env(MACRO)]]
+}
+phase load
+load $top
+phase mag_write
 save $::env(OUTPUT)/[file rootname [file tail $::env(MACRO)]].mag
+phase done
 quit -noprompt
@@ -15,21 +15,24 @@
 
 drc off
 crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+phase load
 addpath [file dirname $::env(MACRO)]
 if { [info exists ::env(MAG_DIR)] } {
-    foreach mag_dir $::env(MAG_DIR) {
+    foreach mag_dir [env_paths MAG_DIR] {
         addpath $mag_dir
     }
 }
 
 if { [info exists ::env(MAGLEF_MACRO)] } {
-    foreach maglef_macro $::env(MAGLEF_MACRO) {
+    foreach maglef_macro [env_paths MAGLEF_MACRO] {
         load $maglef_macro
     }
 }
 
 if { [info exists ::env(GDS_MACRO)] } {
-    foreach gds_macro $::env(GDS_MACRO) {
+    foreach gds_macro [env_paths GDS_MACRO] {
         load [file rootname [file rootname [file tail $gds_macro]]]
         property LEFview true
         property GDS_FILE $gds_macro
@@ -38,11 +41,24 @@ if { [info exists ::env(GDS_MACRO)] } {
 }
 
 load [file rootname [file tail $::env(MACRO)]] -dereference
+phase expand
 select top cell
 expand
+phase extract
+# .ext files go to the current directory; the extraction directory keeps
+# them between runs so magic only extracts the cells that changed
+if { [info exists ::env(EXTRACT_DIR)] } {
+    cd $::env(EXTRACT_DIR)
+}
 extract do local
 extract no all
 extract unique
-extract all
-def write [file rootname [file tail $::env(MACRO)]].def -units 1000
+extract
+phase def_write
+# written next to the final name and renamed, so readers never see half a def
+set def_name [file rootname [file tail $::env(MACRO)]]
+set def_tmp [file join $::env(OUTPUT) .$def_name.[pid].def]
+def write $def_tmp -units 1000
+file rename -force $def_tmp [file join $::env(OUTPUT) $def_name.def]
+phase done
 quit -noprompt
@@ -15,21 +15,24 @@
 
 drc off
 crashbackups stop
+source [file join [file dirname [info script]] phase.tcl]
+source [file join [file dirname [info script]] scratch.tcl]
+phase load
 addpath [file dirname $::env(MACRO)]
 if { [info exists ::env(MAG_DIR)] } {
-    foreach mag_dir $::env(MAG_DIR) {
+    foreach mag_dir [env_paths MAG_DIR] {
         addpath $mag_dir
     }
 }
 
 if { [info exists ::env(MAGLEF_MACRO)] } {
-    foreach maglef_macro $::env(MAGLEF_MACRO) {
+    foreach maglef_macro [env_paths MAGLEF_MACRO] {
         load $maglef_macro
     }
 }
 
 if { [info exists ::env(GDS_MACRO)] } {
-    foreach gds_macro $::env(GDS_MACRO) {
+    foreach gds_macro [env_paths GDS_MACRO] {
         load [file rootname [file rootname [file tail $gds_macro]]]
         property LEFview true
         property GDS_FILE $gds_macro
@@ -38,9 +41,12 @@ if { [info exists ::env(GDS_MACRO)] } {
 }
 
 load [file rootname [file tail $::env(MACRO)]] -dereference
+phase expand
 select top cell
 expand
+phase gds_write
 cif *hier write disable
 cif *array write disable
-gds write $::env(OUTPUT)/[file rootname [file tail $::env(MACRO)]].gds
+gds write [gds_output]/[file rootname [file tail $::env(MACRO)]].gds
+phase done
 quit -noprompt
@@ -0,0 +1,7 @@
+# Phase markers for utilities/logs.py. `phase <name>` prints an
+# "@@PHASE <name>" line that the output capture turns into the progress
+# display and the per phase times. A phase lasts until the next marker.
+proc phase {name} {
+    puts "@@PHASE $name"
+    flush stdout
+}
@@ -0,0 +1,73 @@
+# Bootstrap for a persistent magic worker (see utilities/magic_pool.py).
+#
+# The worker reads one `pool_run` command per job from stdin. Each job sets
+# its environment, sources one of the helper_lib scripts and reports its
+# status on stdout, after which the cell database is reset for the next job.
+drc off
+crashbackups stop
+
+# The helper scripts end with `quit -noprompt`, which must end the job and
+# not the worker.
+rename quit pool_quit
+proc quit {args} {
+    return -code error POOL_QUIT
+}
+
+set pool_search_path [path search]
+set pool_blank_cell pool_blank
+load $pool_blank_cell
+
+proc pool_reset {saved_env} {
+    # the environment from before the job, without what the job or its
+    # script set, like TOP_CELL in macro_ready
+    foreach name [array names ::env] {
+        if { ![dict exists $saved_env $name] } {
+            catch {unset ::env($name)}
+        }
+    }
+    array set ::env $saved_env
+    catch {select clear}
+    catch {path search $::pool_search_path}
+    catch {gds readonly false}
+    catch {gds rescale true}
+    catch {gds abstract disallow}
+    catch {cif *hier write enable}
+    catch {cif *array write enable}
+    catch {extract do all}
+    catch {load $::pool_blank_cell}
+    # Cells can only be deleted once nothing uses them, so sweep until the
+    # database stops shrinking.
+    set remaining -1
+    while { 1 } {
+        set cells [cellname list allcells]
+        if { [llength $cells] == $remaining } {
+            break
+        }
+        set remaining [llength $cells]
+        foreach cell $cells {
+            if { $cell ne $::pool_blank_cell } {
+                catch {cellname delete $cell -noprompt}
+            }
+        }
+    }
+}
+
+proc pool_run {job_id job_cwd script args} {
+    set saved [array get ::env]
+    foreach {name value} $args {
+        set ::env($name) $value
+    }
+    set status 0
+    set cwd [pwd]
+    if { [catch {cd $job_cwd; uplevel #0 [list source $script]} msg] && $msg ne "POOL_QUIT" } {
+        puts stderr "pool: job $job_id failed: $msg"
+        set status 1
+    }
+    catch {cd $cwd}
+    pool_reset $saved
+    puts "@@POOL_DONE $job_id $status"
+    flush stdout
+}
+
+puts "@@POOL_READY"
+flush stdout
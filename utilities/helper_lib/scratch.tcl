@@ -0,0 +1,48 @@
+# Compressed inputs and outputs, see utilities/compress.py.
+#
+# A .gz/.zst MACRO is decompressed into local scratch while magic starts.
+# MACRO already names the decompressed file and MACRO_READY the flag file
+# written once it is complete: "ok <top cell>" or "error <message>".
+proc macro_ready {} {
+    if { ![info exists ::env(MACRO_READY)] } {
+        return
+    }
+    phase decompress
+    while { ![file exists $::env(MACRO_READY)] } {
+        after 50
+    }
+    set f [open $::env(MACRO_READY)]
+    set status [read -nonewline $f]
+    close $f
+    if { [lindex $status 0] ne "ok" } {
+        set message "can't read $::env(MACRO_SOURCE) : [lrange $status 1 end]"
+        # a pool worker outlives the job, see pool_worker.tcl
+        if { [info commands pool_quit] ne "" } {
+            error $message
+        }
+        puts "ERROR : $message"
+        flush stdout
+        exit 1
+    }
+    if { [llength $status] > 1 } {
+        set ::env(TOP_CELL) [lindex $status 1]
+    }
+}
+
+# Directory the gds is written to; GDS_OUTPUT is local scratch when the
+# gds gets compressed into OUTPUT afterwards.
+proc gds_output {} {
+    if { [info exists ::env(GDS_OUTPUT)] } {
+        return $::env(GDS_OUTPUT)
+    }
+    return $::env(OUTPUT)
+}
+
+# The paths in a variable like GDS_MACRO, which common.py passes as one
+# quoted, space separated string: as a Tcl list that would be one element.
+proc env_paths {name} {
+    if { ![info exists ::env($name)] } {
+        return {}
+    }
+    return [string trim $::env($name) "\""]
+}
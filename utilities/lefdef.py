@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming DEF reader and LEF abstract writer.
+
+The DEF is read in a single pass, token by token except for NETS, which
+is scanned in large chunks with regular expressions. Only what an abstract
+needs is kept: the die area, the pins with their port geometry and, per
+routing layer, the bounding box of the wiring of NETS and SPECIALNETS,
+which becomes a blanket obstruction. Memory does not grow with the size of
+the routing.
+"""
+import gzip
+import itertools
+import os
+import re
+
+QUOTED = re.compile(r'"[^"]*"|\S+')
+# the layer of the wiring that follows, in NETS
+WIRE_LAYER = re.compile(r'\s(?:NEW|ROUTED|FIXED|COVER|NOSHIELD)\s+(\S+)')
+VIRTUAL_POINT = re.compile(r'VIRTUAL\s*\([^)]*\)')
+END_NETS = re.compile(r'END\s+NETS\b')
+POINT_X = re.compile(r'\(\s*(-?\d+)\s+(?:-?\d+|\*)(?:\s+-?\d+)?\s*\)')
+POINT_Y = re.compile(r'\(\s*(?:-?\d+|\*)\s+(-?\d+)(?:\s+-?\d+)?\s*\)')
+NET_CHUNK = 1 << 22
+# `RECT ( dx0 dy0 dx1 dy1 )` patches and the points they are relative to
+RECT_PATCH = re.compile(r'RECT\s*\(\s*(-?\d+)\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)\s*\)|\(\s*(-?\d+|\*)\s+(-?\d+|\*)(?:\s+-?\d+)?\s*\)')
+# wire width in um of the layers no tech LEF gives a width for, when no
+# layer has one
+DEFAULT_WIDTH = 0.1
+# ( x y [more] ) groups as (x, y, more, ""), other words as ("", "", "", word)
+NET_ITEMS = re.compile(r'\(\s*(\S+)\s+(\S+)\s*([^)]*?)\s*\)|("[^"]*"|\S+)')
+ROUTE_KEYWORDS = ("ROUTED", "FIXED", "COVER", "NOSHIELD")
+# sections skipped as a whole, up to their END
+SKIPPED_SECTIONS = (
+    "PROPERTYDEFINITIONS", "VIAS", "STYLES", "NONDEFAULTRULES", "REGIONS", "COMPONENTMASKSHIFT",
+    "COMPONENTS", "BLOCKAGES", "SLOTS", "FILLS", "SCANCHAINS", "GROUPS", "PINPROPERTIES", "BEGINEXT",
+)
+# (x, y) -> (x, y) for the DEF orientations
+ORIENTATIONS = {
+    "N": lambda x, y: (x, y),
+    "W": lambda x, y: (-y, x),
+    "S": lambda x, y: (-x, -y),
+    "E": lambda x, y: (y, -x),
+    "FN": lambda x, y: (-x, y),
+    "FW": lambda x, y: (y, x),
+    "FS": lambda x, y: (x, -y),
+    "FE": lambda x, y: (-y, -x),
+}
+
+
+class DefError(Exception):
+    pass
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+def split(line):
+    words = QUOTED.findall(line) if '"' in line else line.split()
+    for index, word in enumerate(words):
+        if word.startswith("#"):
+            return words[:index]
+    return words
+
+
+class Tokens:
+    """Iterator over the tokens of a DEF that can also hand out the rest of
+    the current line at once, for the sections read line by line."""
+
+    def __init__(self, file):
+        self.file = file
+        self.lines = iter(file)
+        self.words = []
+        self.index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.index >= len(self.words):
+            self.words = split(next(self.lines))
+            self.index = 0
+        self.index += 1
+        return self.words[self.index - 1]
+
+    def raw_line(self):
+        """Returns the rest of the current line, or the next line."""
+        line = " ".join(self.words[self.index:]) if self.index < len(self.words) else next(self.lines)
+        self.words = []
+        self.index = 0
+        return line
+
+
+def until(stream, end=";"):
+    words = []
+    for token in stream:
+        if token == end:
+            return words
+        words.append(token)
+    raise DefError(f"file ended before {end}")
+
+
+def skip_section(stream, name):
+    previous = None
+    for token in stream:
+        if previous == "END" and token == name:
+            return
+        previous = token
+    raise DefError(f"file ended in {name}")
+
+
+def points(words):
+    """Returns the points of `( x y )` groups, `*` repeating the previous value."""
+    result = []
+    x = y = 0
+    index = 0
+    while index < len(words):
+        if words[index] == "(":
+            x = x if words[index + 1] == "*" else int(float(words[index + 1]))
+            y = y if words[index + 2] == "*" else int(float(words[index + 2]))
+            result.append((x, y))
+            index = words.index(")", index)
+        index += 1
+    return result
+
+
+def bbox(points):
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+        self.net = name
+        self.direction = None
+        self.use = None
+        # [[(layer, kind, points)], placement, orientation] per port
+        self.ports = []
+
+    def port(self):
+        if not self.ports:
+            self.ports.append([[], None, "N"])
+        return self.ports[-1]
+
+    def placed_ports(self):
+        """Yields the shapes of every placed port as a list of (layer, kind,
+        points) in die coordinates; kind is RECT or POLYGON."""
+        for shapes, placement, orientation in self.ports:
+            if placement is None:
+                continue
+            transform = ORIENTATIONS.get(orientation, ORIENTATIONS["N"])
+            port = []
+            for layer, kind, shape in shapes:
+                moved = [transform(x, y) for x, y in shape]
+                moved = [(x + placement[0], y + placement[1]) for x, y in moved]
+                if kind == "RECT":
+                    box = bbox(moved)
+                    moved = [(box[0], box[1]), (box[2], box[3])]
+                port.append((layer, kind, moved))
+            yield port
+
+
+class DefAbstract:
+    """What read_def_abstract keeps of a DEF."""
+
+    def __init__(self):
+        self.design = None
+        self.dbu = 100
+        self.die = None
+        self.pins = []
+        self.obstructions = {}
+
+
+def read_pin(stream, pin):
+    while True:
+        words = []
+        for token in stream:
+            if token in ("+", ";"):
+                break
+            words.append(token)
+        else:
+            raise DefError(f"file ended in pin {pin.name}")
+        if words:
+            keyword = words[0]
+            if keyword == "NET":
+                pin.net = words[1]
+            elif keyword == "DIRECTION":
+                pin.direction = " ".join(words[1:])
+            elif keyword == "USE":
+                pin.use = words[1]
+            elif keyword == "PORT":
+                pin.ports.append([[], None, "N"])
+            elif keyword in ("LAYER", "POLYGON"):
+                shape = points(words)
+                pin.port()[0].append((words[1], "RECT" if keyword == "LAYER" else "POLYGON", shape))
+            elif keyword in ("PLACED", "FIXED", "COVER"):
+                port = pin.port()
+                port[1] = points(words)[0]
+                port[2] = words[-1]
+        if token == ";":
+            return
+
+
+def read_pins(stream, abstract):
+    for token in stream:
+        if token == "END":
+            next(stream)
+            return
+        if token == "-":
+            pin = Pin(next(stream))
+            read_pin(stream, pin)
+            abstract.pins.append(pin)
+    raise DefError("file ended in PINS")
+
+
+def rect_patches(text):
+    """Boxes of the RECT patches in text, a piece of NETS on one layer. A
+    patch is relative to the point before it; one whose point is in an
+    earlier chunk of the file is left out."""
+    patches = []
+    x = y = None
+    for dx0, dy0, dx1, dy1, px, py in RECT_PATCH.findall(text):
+        if not dx0:
+            x = x if px == "*" else int(px)
+            y = y if py == "*" else int(py)
+        elif x is not None and y is not None:
+            dx0, dy0, dx1, dy1 = int(dx0), int(dy0), int(dx1), int(dy1)
+            patches.append([x + min(dx0, dx1), y + min(dy0, dy1), x + max(dx0, dx1), y + max(dy0, dy1)])
+    return patches
+
+
+def half_width(widths, layer):
+    """Half the width of the wires of layer in DEF units, never 0: a layer
+    without a width gets the narrowest one known (see read_def_abstract)."""
+    return max(1, widths.get(layer, widths.get(None, 0)) // 2)
+
+
+def wiring_boxes(text, layer, boxes, widths):
+    """Extends boxes with the points and RECT patches in text, a piece of
+    NETS wired on layer at its start. Returns the layer wired at its end."""
+    if "VIRTUAL" in text:
+        text = VIRTUAL_POINT.sub(" ", text)
+    parts = WIRE_LAYER.split(text)
+    pieces = {}
+    if layer:
+        pieces[layer] = [parts[0]]
+    for index in range(1, len(parts), 2):
+        layer = parts[index]
+        pieces.setdefault(layer, []).append(parts[index + 1])
+    for name, texts in pieces.items():
+        text = " ".join(texts)
+        xs = POINT_X.findall(text)
+        if not xs:
+            continue
+        ys = POINT_Y.findall(text)
+        half = half_width(widths, name)
+        box = [min(map(int, xs)) - half, min(map(int, ys)) - half, max(map(int, xs)) + half, max(map(int, ys)) + half]
+        if "RECT" in text:
+            for patch in rect_patches(text):
+                box = [min(box[0], patch[0]), min(box[1], patch[1]), max(box[2], patch[2]), max(box[3], patch[3])]
+        if name in boxes:
+            old = boxes[name]
+            box = [min(old[0], box[0]), min(old[1], box[1]), max(old[2], box[2]), max(old[3], box[3])]
+        boxes[name] = box
+    return layer
+
+
+def read_net_wiring(stream, abstract, widths):
+    """Adds the bounding box of the wiring of NETS to abstract.obstructions.
+
+    Nearly all of a routed DEF is here, so it is read a few MB at a time,
+    cut at the layer changes, and the points of each layer are found with
+    one regular expression rather than token by token; `*` coordinates
+    repeat a value already seen. Wires get the default width of their layer
+    from widths, in DEF units.
+    """
+    layer = None
+    carry = " " + stream.raw_line()
+    while True:
+        block = stream.file.read(NET_CHUNK)
+        text = carry + block
+        end = END_NETS.search(text)
+        while end and not text[end.start() - 1].isspace():
+            end = END_NETS.search(text, end.end())
+        if end:
+            wiring_boxes(text[:end.start()], layer, abstract.obstructions, widths)
+            # hand what follows END NETS back to the token iterator
+            stream.lines = itertools.chain(text[end.end():].splitlines(True), stream.lines)
+            return
+        if not block:
+            raise DefError("file ended in NETS")
+        # cut at a line end, which never splits a point or a layer change
+        cut = text.rfind("\n") + 1
+        text, carry = text[:cut], " " + text[cut:]
+        layer = wiring_boxes(text, layer, abstract.obstructions, widths)
+
+
+def read_nets(stream, abstract, special, widths):
+    """Adds the bounding box of the wiring of every net to
+    abstract.obstructions, without keeping the nets. Regular wires get the
+    default width of their layer from widths, in DEF units. Used for
+    SPECIALNETS, where the wire widths and shapes need the tokens.
+    """
+    boxes = abstract.obstructions
+    layer = box = None
+    # routing, expecting the layer, then in special nets the width
+    routing = expect_layer = expect_width = rect = skip_point = False
+    half = 0
+    x = y = 0
+    items = []
+    index = count = 0
+    try:
+        while True:
+            if index >= count:
+                line = stream.raw_line()
+                while line.count("(") > line.count(")"):
+                    line += " " + stream.raw_line()
+                items = NET_ITEMS.findall(line)
+                index = 0
+                count = len(items)
+                continue
+            first, second, rest, token = items[index]
+            index += 1
+            if token and token[0] == "#":
+                index = count
+                continue
+            if expect_layer:
+                layer = token
+                expect_layer = False
+                expect_width = special
+                half = half_width(widths, layer)
+                box = boxes.get(layer)
+                continue
+            if expect_width:
+                expect_width = False
+                try:
+                    half = int(float(token)) // 2
+                    continue
+                except ValueError:
+                    pass
+            if not token:
+                if not routing or layer is None:
+                    continue
+                if skip_point:
+                    skip_point = False
+                    continue
+                if rect:
+                    # 5.8 `RECT ( dx0 dy0 dx1 dy1 )`, relative to the last point
+                    dx0, dy0, dx1, dy1 = [int(float(value)) for value in [first, second, *rest.split()][:4]]
+                    x0, y0, x1, y1 = x + min(dx0, dx1), y + min(dy0, dy1), x + max(dx0, dx1), y + max(dy0, dy1)
+                    rect = False
+                else:
+                    if first != "*":
+                        x = int(first) if first.isdigit() else int(float(first))
+                    if second != "*":
+                        y = int(second) if second.isdigit() else int(float(second))
+                    x0, y0, x1, y1 = x - half, y - half, x + half, y + half
+                if box is None:
+                    box = boxes[layer] = [x0, y0, x1, y1]
+                    continue
+                if x0 < box[0]:
+                    box[0] = x0
+                if y0 < box[1]:
+                    box[1] = y0
+                if x1 > box[2]:
+                    box[2] = x1
+                if y1 > box[3]:
+                    box[3] = y1
+                continue
+            if token in ("+", "-", "END", "SHAPE", "MASK", "STYLE") and index >= count:
+                # these take the next word, which may be on the next line
+                items = items[index:] + NET_ITEMS.findall(stream.raw_line())
+                index = 0
+                count = len(items)
+            if token == "+":
+                keyword = items[index][3]
+                index += 1
+                if keyword in ROUTE_KEYWORDS:
+                    routing = expect_layer = True
+                elif keyword in ("SHAPE", "MASK", "STYLE"):
+                    index += 1
+                elif keyword in ("RECT", "POLYGON") and special:
+                    # `+ RECT layer ( ) ( )` and `+ POLYGON layer ( ) ...`: absolute
+                    routing = expect_layer = True
+                else:
+                    routing = False
+            elif token == "NEW":
+                if routing:
+                    expect_layer = True
+            elif token == "RECT":
+                rect = True
+            elif token == "VIRTUAL":
+                skip_point = True
+            elif token in ROUTE_KEYWORDS:
+                routing = expect_layer = True
+            elif token == ";":
+                routing = expect_layer = expect_width = False
+                layer = None
+            elif token == "-":
+                # the net name
+                index += 1
+            elif token == "END":
+                # hand the words after END NETS back to the token iterator
+                stream.words = [item[3] or f"( {item[0]} {item[1]} {item[2]} )" for item in items[index + 1:]]
+                stream.index = 0
+                return
+    except StopIteration:
+        raise DefError("file ended in NETS")
+
+
+def lef_routing_widths(lef_file):
+    """Returns {layer: default width in um} of the routing layers of a
+    (tech) LEF, their minimum width when they have no default."""
+    widths = {}
+    minimum = {}
+    layer = None
+    routing = False
+    with open_text(lef_file) as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == "LAYER" and len(words) > 1 and layer is None:
+                layer = words[1]
+                routing = False
+            elif layer and words[0] == "END" and words[1:2] == [layer]:
+                layer = None
+            elif layer and words[0] == "TYPE":
+                routing = words[1] == "ROUTING"
+            elif layer and routing and words[0] == "WIDTH" and layer not in widths:
+                widths[layer] = float(words[1])
+            elif layer and routing and words[0] == "MINWIDTH" and layer not in minimum:
+                minimum[layer] = float(words[1])
+    return dict(minimum, **widths)
+
+
+def def_masters(path):
+    """Returns {master: instance count} of the COMPONENTS of a DEF. The rest
+    of the file after COMPONENTS is not read."""
+    masters = {}
+    with open_text(path) as f:
+        for line in f:
+            if line.split()[:1] == ["COMPONENTS"]:
+                break
+        else:
+            return masters
+        stream = Tokens(f)
+        previous = None
+        for token in stream:
+            if token == "-":
+                next(stream)
+                master = next(stream)
+                masters[master] = masters.get(master, 0) + 1
+            elif previous == "END" and token == "COMPONENTS":
+                return masters
+            previous = token
+    raise DefError(f"{path} ended in COMPONENTS")
+
+
+def lef_macros(path):
+    """Returns {macro: [start, end]}, the byte range of every MACRO of a
+    LEF file."""
+    macros = {}
+    macro = pin = None
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            words = line.split()
+            if words[:1] == [b"MACRO"] and len(words) > 1 and macro is None:
+                macro = words[1]
+                start = offset
+            elif macro is not None and words[:1] == [b"PIN"] and len(words) > 1:
+                pin = words[1]
+            elif macro is not None and len(words) == 2 and words[0] == b"END":
+                # a pin may be named like its macro
+                if words[1] == pin:
+                    pin = None
+                elif words[1] == macro:
+                    macros[macro.decode(errors="replace")] = [start, offset + len(line)]
+                    macro = None
+            offset += len(line)
+    return macros
+
+
+def write_lef_subset(lef_file, macros, keep, output):
+    """Writes lef_file without the MACROs that are not in keep; macros are
+    the byte ranges of lef_macros."""
+    dropped = sorted(span for name, span in macros.items() if name not in keep)
+    with open(lef_file, "rb") as f, open(f"{output}.{os.getpid()}.tmp", "wb") as out:
+        for start, end in dropped:
+            out.write(f.read(start - f.tell()))
+            f.seek(end)
+        out.write(f.read())
+    os.replace(f"{output}.{os.getpid()}.tmp", output)
+
+
+def read_def_abstract(path, widths=None):
+    """Reads the abstract of a DEF; widths are the default wire widths in
+    um per layer, see lef_routing_widths. Wires on other layers get the
+    narrowest of them, or DEFAULT_WIDTH."""
+    abstract = DefAbstract()
+    widths = widths or {}
+    dbu_widths = {}
+    with open_text(path) as f:
+        stream = Tokens(f)
+        for token in stream:
+            if token == "DESIGN":
+                abstract.design = until(stream)[0]
+            elif token == "UNITS":
+                abstract.dbu = int(float(until(stream)[-1]))
+                dbu_widths = {layer: round(width * abstract.dbu) for layer, width in widths.items()}
+                # None: the width of the layers without one
+                dbu_widths[None] = min(dbu_widths.values(), default=round(DEFAULT_WIDTH * abstract.dbu))
+            elif token == "DIEAREA":
+                abstract.die = bbox(points(until(stream)))
+            elif token == "PINS":
+                until(stream)
+                read_pins(stream, abstract)
+            elif token == "NETS":
+                until(stream)
+                read_net_wiring(stream, abstract, dbu_widths)
+            elif token == "SPECIALNETS":
+                until(stream)
+                read_nets(stream, abstract, True, dbu_widths)
+            elif token in SKIPPED_SECTIONS:
+                skip_section(stream, "ENDEXT" if token == "BEGINEXT" else token)
+            elif token == "END":
+                if next(stream, "DESIGN") == "DESIGN":
+                    break
+            else:
+                until(stream)
+    if abstract.die is None:
+        raise DefError(f"{path} has no DIEAREA")
+    return abstract
+
+
+def subtract(box, holes):
+    """Returns box minus the holes as a list of rectangles, cut in
+    horizontal slabs that are merged again where they line up."""
+    x0, y0, x1, y1 = box
+    holes = [hole for hole in holes if hole[0] < x1 and hole[2] > x0 and hole[1] < y1 and hole[3] > y0]
+    ys = sorted({y0, y1, *(y for hole in holes for y in (hole[1], hole[3]) if y0 < y < y1)})
+    rects = []
+    open_rects = {}
+    for bottom, top in zip(ys, ys[1:]):
+        spans = []
+        x = x0
+        for hx0, hx1 in sorted((hole[0], hole[2]) for hole in holes if hole[1] <= bottom and hole[3] >= top):
+            if hx0 > x:
+                spans.append((x, hx0))
+            x = max(x, hx1)
+        if x < x1:
+            spans.append((x, x1))
+        still_open = {}
+        for span in spans:
+            rect = open_rects.pop(span, None) or [span[0], bottom, span[1], top]
+            rect[3] = top
+            still_open[span] = rect
+        rects += open_rects.values()
+        open_rects = still_open
+    rects += open_rects.values()
+    return rects
+
+
+def write_lef_abstract(abstract, lef_file, name=None):
+    """Writes abstract as a LEF macro: the die area, the pins and a blanket
+    obstruction per routing layer over its wiring, with the pins of that
+    layer cut out."""
+    name = name or abstract.design
+    dbu = abstract.dbu
+    digits = len(str(dbu - 1))
+    x0, y0, x1, y1 = abstract.die
+
+    def um(value):
+        return f"{value / dbu:.{digits}f}"
+
+    def coordinates(shape):
+        return " ".join(f"{um(x - x0)} {um(y - y0)}" for x, y in shape)
+
+    pin_boxes = {}
+    with open(lef_file, "w") as f:
+        f.write('VERSION 5.7 ;\n  NOWIREEXTENSIONATPIN ON ;\n  DIVIDERCHAR "/" ;\n  BUSBITCHARS "[]" ;\n')
+        f.write(f"MACRO {name}\n  CLASS BLOCK ;\n  FOREIGN {name} ;\n  ORIGIN 0.000 0.000 ;\n")
+        f.write(f"  SIZE {um(x1 - x0)} BY {um(y1 - y0)} ;\n")
+        for pin in abstract.pins:
+            f.write(f"  PIN {pin.name}\n")
+            if pin.direction:
+                f.write(f"    DIRECTION {pin.direction} ;\n")
+            if pin.use:
+                f.write(f"    USE {pin.use} ;\n")
+            for port in pin.placed_ports():
+                f.write("    PORT\n")
+                for layer, kind, shape in port:
+                    f.write(f"      LAYER {layer} ;\n        {kind} {coordinates(shape)} ;\n")
+                    pin_boxes.setdefault(layer, []).append(bbox(shape))
+                f.write("    END\n")
+            f.write(f"  END {pin.name}\n")
+        if abstract.obstructions:
+            f.write("  OBS\n")
+            for layer, (bx0, by0, bx1, by1) in sorted(abstract.obstructions.items()):
+                # clipped to the die, wires may overhang it by half a width
+                box = [max(bx0, x0), max(by0, y0), min(bx1, x1), min(by1, y1)]
+                if box[0] >= box[2] or box[1] >= box[3]:
+                    continue
+                f.write(f"      LAYER {layer} ;\n")
+                for rx0, ry0, rx1, ry1 in subtract(box, pin_boxes.get(layer, ())):
+                    f.write(f"        RECT {coordinates([(rx0, ry0), (rx1, ry1)])} ;\n")
+            f.write("  END\n")
+        f.write(f"END {name}\nEND LIBRARY\n")
+
+
+def def_to_lef_abstract(def_file, lef_file, tech_lefs=()):
+    """Writes the abstract of def_file to lef_file, under a temporary name
+    first so that lef_file is never partial. The wire widths come from the
+    first of tech_lefs that has the layer."""
+    widths = {}
+    for tech_lef in reversed(tech_lefs):
+        widths.update(lef_routing_widths(tech_lef))
+    abstract = read_def_abstract(def_file, widths)
+    tmp = os.path.join(os.path.dirname(os.path.abspath(lef_file)), f".{os.path.basename(lef_file)}.{os.getpid()}")
+    try:
+        write_lef_abstract(abstract, tmp, os.path.splitext(os.path.basename(lef_file))[0])
+        os.replace(tmp, lef_file)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return abstract
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Capture of the output of the magic and klayout runs.
+
+The output is read line by line from a pipe. The full log is compressed
+into a file next to the outputs (zstd when the zstandard module is
+installed, gzip otherwise). Only the last lines are kept in memory, to be
+shown when the run fails. `@@PHASE <name>` lines, printed by the helper
+scripts, drive a progress display and give the time spent per phase.
+$UTILITIES_SHOW_LOG (`utilities --show-log`) also echoes the output.
+"""
+import gzip
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+
+from . import telemetry
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PHASE = "@@PHASE "
+TAIL_LINES = 200
+# longer lines are split, so a runaway line can't grow memory either
+MAX_LINE = 1 << 16
+
+_progress = None
+_progress_tasks = 0
+_progress_lock = threading.Lock()
+
+
+def log_path(base):
+    return base + (".log.zst" if zstandard else ".log.gz")
+
+
+def open_log(path):
+    if path.endswith(".zst"):
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"))
+    return gzip.open(path, "wb", compresslevel=3)
+
+
+def show_log():
+    return bool(os.environ.get("UTILITIES_SHOW_LOG"))
+
+
+def add_task(description):
+    """Adds a line to the progress display shared by every run of the
+    process, parallel runs included. Returns None without a terminal."""
+    global _progress, _progress_tasks
+    with _progress_lock:
+        if _progress is None:
+            console = Console(stderr=True)
+            # a live display only makes sense on a terminal
+            if not console.is_terminal:
+                return None
+            _progress = Progress(
+                SpinnerColumn(), TextColumn("{task.description}"), TimeElapsedColumn(),
+                console=console, transient=True,
+            )
+            _progress.start()
+        _progress_tasks += 1
+        return _progress.add_task(description)
+
+
+def update_task(task, description):
+    with _progress_lock:
+        if _progress is not None:
+            _progress.update(task, description=description)
+
+
+def remove_task(task):
+    global _progress, _progress_tasks
+    with _progress_lock:
+        _progress.remove_task(task)
+        _progress_tasks -= 1
+        if not _progress_tasks:
+            _progress.stop()
+            _progress = None
+
+
+class LogCapture:
+    def __init__(self, label, log_file=None, tail=TAIL_LINES):
+        self.label = label
+        self.log_file = log_file
+        self.tail = deque(maxlen=tail)
+        self.phases = {}
+        self.phase = None
+        self.phase_start = None
+        self.echo = show_log()
+        self.log = None
+        self.task = None
+
+    def __enter__(self):
+        if self.log_file:
+            self.log = open_log(self.log_file)
+        # echoed output and a live display would garble each other
+        if not self.echo:
+            self.task = add_task(self.label)
+        return self
+
+    def __exit__(self, *exc):
+        self.end_phase()
+        if self.log:
+            self.log.close()
+        if self.task is not None:
+            remove_task(self.task)
+
+    def feed(self, line):
+        if isinstance(line, str):
+            line = line.encode(errors="replace")
+        if self.log:
+            self.log.write(line)
+        text = line.decode(errors="replace").rstrip("\r\n")
+        if self.echo:
+            print(text, flush=True)
+        if text.startswith(PHASE):
+            self.start_phase(text[len(PHASE):].strip())
+        else:
+            self.tail.append(text)
+
+    def start_phase(self, name):
+        self.end_phase()
+        self.phase = name
+        self.phase_start = time.time()
+        if self.task is not None:
+            update_task(self.task, f"{self.label} : {name}")
+
+    def end_phase(self):
+        if self.phase is not None:
+            self.phases[self.phase] = self.phases.get(self.phase, 0) + time.time() - self.phase_start
+            self.phase = None
+
+    def report(self, returncode):
+        """Shows the tail of the log of a failed run."""
+        if returncode == 0 or self.echo:
+            return
+        console = Console(stderr=True)
+        console.print(f"[red]{self.label} exited with {returncode}, last lines of its output:")
+        for line in self.tail:
+            console.print(line, markup=False, highlight=False)
+        if self.log_file:
+            console.print(f"[red]full log : {self.log_file}")
+
+
+def run_tool(command, tool, label=None, env=None, cwd=None, log_file=None, inputs=(), outputs=(), **fields):
+    """Runs command with its output captured and returns its exit code.
+
+    With telemetry on, the run is recorded. The rusage of wait4 covers the
+    child and every descendant it waited for, so max_rss_kb is the peak of
+    the whole process tree.
+    """
+    start = time.time()
+    with LogCapture(label or tool, log_file) as capture:
+        process = subprocess.Popen(command, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            for line in iter(lambda: process.stdout.readline(MAX_LINE), b""):
+                capture.feed(line)
+            _, status, usage = os.wait4(process.pid, 0)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            process.stdout.close()
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    capture.report(process.returncode)
+    telemetry.record(
+        tool,
+        inputs,
+        outputs,
+        returncode=process.returncode,
+        wall=time.time() - start,
+        user=usage.ru_utime,
+        sys=usage.ru_stime,
+        cpu=usage.ru_utime + usage.ru_stime,
+        max_rss_kb=usage.ru_maxrss,
+        phases=capture.phases,
+        log=log_file,
+        **fields,
+    )
+    return process.returncode
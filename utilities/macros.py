@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Selection of the extra LEF macros and GDS files a DEF instantiates.
+
+The macros of every LEF and the structures of every GDS are kept in an
+index in the cache directory, so a library is only scanned again when its
+size or mtime changes.
+"""
+import glob
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from .cache import get_cache, write_atomic
+from .gds import read_library
+from .lefdef import def_masters, lef_macros, write_lef_subset
+
+MacroSelection = namedtuple("MacroSelection", "lefs gds_files masters unresolved")
+
+
+class MacroIndex:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache().root, "macro_index.json")
+        self.entries = self.load()
+        self.updated = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, path, kind, scan):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = f"{kind} {stat.st_size} {stat.st_mtime_ns}"
+        entry = self.entries.get(path)
+        if entry is None or entry["signature"] != signature:
+            entry = {"signature": signature, "names": scan(path)}
+            self.entries[path] = self.updated[path] = entry
+        return entry["names"]
+
+    def lef_macros(self, path):
+        """{macro: [start, end]} of a LEF file."""
+        return self.lookup(path, "lef", lef_macros)
+
+    def gds_cells(self, path):
+        """{structure: [referenced structures]} of a GDS file."""
+        return self.lookup(path, "gds-graph", cell_graph)
+
+    def save(self):
+        if not self.updated:
+            return
+        # entries written by other runs in the meantime are kept
+        entries = self.load()
+        entries.update(self.updated)
+        write_atomic(self.path, json.dumps(entries))
+        self.updated = {}
+
+
+def cell_graph(path):
+    library = read_library(path)
+    return {name: sorted(library.children(name)) for name in library.structures}
+
+
+def pdk_lefs(pdk_root, pdk):
+    return sorted(glob.glob(os.path.join(pdk_root, pdk, "libs.ref", "*", "lef", "*.lef")))
+
+
+def select_macros(def_file, lefs, gds_files, pdk_root, pdk, index=None):
+    """Returns the MacroSelection of a DEF: the extra LEFs without the
+    macros it doesn't instantiate, the extra GDS files that define one of
+    its masters or a cell those reference, and the masters found nowhere,
+    neither in those nor in the cell libraries of the pdk."""
+    index = index or MacroIndex()
+    masters = def_masters(def_file)
+    resolved = set()
+    selected_lefs = []
+    for lef in lefs:
+        macros = index.lef_macros(lef)
+        used = set(macros) & set(masters)
+        resolved |= used
+        if macros and not used:
+            continue
+        if len(used) == len(macros):
+            selected_lefs.append(lef)
+            continue
+        digest = hashlib.sha256(f"{index.entries[os.path.abspath(lef)]['signature']}\0{os.path.abspath(lef)}\0{' '.join(sorted(used))}".encode()).hexdigest()
+        subset = os.path.join(get_cache().root, "lef", f"{os.path.splitext(os.path.basename(lef))[0]}-{digest[:16]}.lef")
+        if not os.path.exists(subset):
+            os.makedirs(os.path.dirname(subset), exist_ok=True)
+            write_lef_subset(lef, macros, used, subset)
+        selected_lefs.append(subset)
+    graphs = {gds: index.gds_cells(gds) for gds in gds_files}
+    # the cells of the masters, and every cell they reference through SREF
+    # and AREF, in whichever GDS file defines them
+    needed = set()
+    pending = set(masters)
+    while pending:
+        needed |= pending
+        pending = {child for graph in graphs.values() for cell in pending & set(graph) for child in graph[cell]} - needed
+    selected_gds = []
+    for gds, graph in graphs.items():
+        used = needed & set(graph)
+        if used:
+            resolved |= used & set(masters)
+            selected_gds.append(gds)
+    for lef in pdk_lefs(pdk_root, pdk):
+        if len(resolved) == len(masters):
+            break
+        resolved |= set(index.lef_macros(lef)) & set(masters)
+    index.save()
+    unresolved = sorted(set(masters) - resolved)
+    return MacroSelection(selected_lefs, selected_gds, masters, unresolved)
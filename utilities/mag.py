@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cell hierarchy of magic .mag files, read from their `use` lines."""
+import os
+from collections import namedtuple
+
+MagCell = namedtuple("MagCell", "name path children")
+
+
+def mag_uses(path):
+    """Returns the names of the cells used in a .mag file, in file order."""
+    uses = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            if line.startswith("use "):
+                words = line.split()
+                if len(words) > 1 and words[1] not in uses:
+                    uses.append(words[1])
+    return uses
+
+
+def mag_hierarchy(mag_file, search=(), exclude=()):
+    """Returns the cells under mag_file that have a .mag in its directory
+    or in search, children before their parents and mag_file last.
+
+    Other cells, the pdk libraries for example, and the cells in exclude
+    are left out; magic finds them on its own.
+    """
+    directories = [os.path.dirname(os.path.abspath(mag_file)), *search]
+    top = os.path.splitext(os.path.basename(mag_file))[0]
+
+    def find(name):
+        for directory in directories:
+            path = os.path.join(directory, f"{name}.mag")
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+        return None
+
+    cells = {}
+    order = []
+    stack = [(top, os.path.abspath(mag_file), False)]
+    while stack:
+        name, path, expanded = stack.pop()
+        if expanded:
+            order.append(cells[name])
+            continue
+        if name in cells:
+            continue
+        children = []
+        for child in mag_uses(path):
+            if child not in exclude and find(child):
+                children.append(child)
+        cells[name] = MagCell(name, path, children)
+        stack.append((name, path, True))
+        for child in reversed(children):
+            if child not in cells:
+                stack.append((child, find(child), False))
+    return order
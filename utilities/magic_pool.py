@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import atexit
+import itertools
+import os
+import subprocess
+import sys
+import threading
+
+BOOTSTRAP = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "helper_lib", "pool_worker.tcl"
+)
+READY = "@@POOL_READY"
+DONE = "@@POOL_DONE"
+TCL_SPECIAL = set('\\{}[]$";# \t')
+
+
+def tcl_quote(value):
+    value = str(value)
+    if not value:
+        return "{}"
+    quoted = ""
+    for char in value:
+        if char == "\n":
+            quoted += "\\n"
+        elif char in TCL_SPECIAL:
+            quoted += "\\" + char
+        else:
+            quoted += char
+    return quoted
+
+
+class MagicWorker:
+    """A long-lived magic process that runs helper_lib scripts sent over stdin."""
+
+    def __init__(self, rcfile, max_jobs=50):
+        self.rcfile = rcfile
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.process = subprocess.Popen(
+            ["magic", "-noconsole", "-dnull", "-rcfile", rcfile, BOOTSTRAP],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            # errors go into the output of the job, which reads the pipe
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+
+    @property
+    def alive(self):
+        return self.process.poll() is None and self.jobs < self.max_jobs
+
+    def run(self, job_id, script, env, cwd, output=None):
+        output = output or sys.stdout.write
+        words = [str(job_id), tcl_quote(cwd), tcl_quote(script)]
+        for name, value in env.items():
+            words += [tcl_quote(name), tcl_quote(value)]
+        self.jobs += 1
+        try:
+            self.process.stdin.write(f"pool_run {' '.join(words)}\n")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            return self.process.wait() or 1
+        for line in self.process.stdout:
+            # unbuffered stderr may end up in front of the marker
+            before, marker, done = line.partition(DONE)
+            if before.strip() and not before.startswith(READY):
+                output(before if not marker else before + "\n")
+            if marker:
+                done_id, status = done.split()
+                if done_id == str(job_id):
+                    return int(status)
+        # magic died in the middle of the job
+        return self.process.wait() or 1
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write("pool_quit -noprompt\n")
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+class MagicPool:
+    """Keeps up to `size` magic workers per rcfile and hands jobs to idle ones."""
+
+    def __init__(self, size=None, max_jobs=50):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self._workers = {}
+        self._idle = {}
+        self._condition = threading.Condition()
+        self._job_ids = itertools.count(1)
+
+    def _acquire(self, rcfile):
+        with self._condition:
+            while True:
+                idle = self._idle.setdefault(rcfile, [])
+                workers = self._workers.setdefault(rcfile, [])
+                if idle:
+                    return idle.pop()
+                if len(workers) < self.size:
+                    worker = MagicWorker(rcfile, self.max_jobs)
+                    workers.append(worker)
+                    return worker
+                self._condition.wait()
+
+    def _release(self, rcfile, worker):
+        with self._condition:
+            if worker.alive:
+                self._idle[rcfile].append(worker)
+            else:
+                self._workers[rcfile].remove(worker)
+                worker.close()
+            self._condition.notify()
+
+    def run(self, rcfile, script, env, cwd=None, output=None):
+        worker = self._acquire(rcfile)
+        try:
+            return worker.run(next(self._job_ids), script, env, cwd or os.getcwd(), output)
+        finally:
+            self._release(rcfile, worker)
+
+    def close(self):
+        with self._condition:
+            for workers in self._workers.values():
+                for worker in workers:
+                    worker.close()
+            self._workers = {}
+            self._idle = {}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MagicPool(int(os.environ.get("UTILITIES_POOL_SIZE", 0)) or None)
+            atexit.register(_pool.close)
+    return _pool
@@ -14,13 +14,29 @@
 # limitations under the License.
 # import os
 # import ipm
+import os
+import time
+
 import click
 from rich.console import Console
+from rich.table import Table
 
+from .batch import load_manifest, run_batch
+from .flow import load_flow, run_flow
+from .spool import LEASE, MAX_ATTEMPTS, Spool, work
+from .watch import watch
+from .cache import ResultCache, format_size, parse_size
+from .density import RESOLUTION, WINDOW
+from . import admission, stage, telemetry
+from .reports import ingest_lyrdb, ingest_xor, marker_counts, open_db, query_markers
 from .common import (
+    UtilitiesError,
+    abort,
     def_to_gds,
     def_to_lef,
+    def_to_lef_native,
     def_to_mag,
+    density,
     drc,
     gds_to_def,
     gds_to_lef,
@@ -28,11 +44,38 @@ from .common import (
     lvs,
     mag_to_def,
     mag_to_gds,
+    mag_to_gds_incremental,
     mag_to_lef,
     xor,
+    convert,
+    gds_info,
 )
 
-@click.command("mag-to-gds", help="creates a gds from mag")
+
+class UtilitiesCommand(click.Command):
+    """Exits with the code returned by the command, e.g. that of the tool it
+    ran, or with 1 when it aborts. batch calls the callbacks directly and
+    reads the same codes."""
+    def invoke(self, ctx):
+        try:
+            returncode = super().invoke(ctx)
+        except UtilitiesError:
+            ctx.exit(1)
+        if returncode:
+            # a tool killed by a signal returns a negative code
+            ctx.exit(returncode if 0 < returncode < 256 else 1)
+        return returncode
+
+class SizeType(click.ParamType):
+    name = "size"
+
+    def convert(self, value, param, ctx):
+        try:
+            return parse_size(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+@click.command("mag-to-gds", cls=UtilitiesCommand, help="creates a gds from mag")
 @click.argument("mag_file")
 @click.option("--pdk_root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
@@ -44,24 +87,37 @@ from .common import (
     "--gds_macro", required=False, help="path to gds to get loaded", multiple=True
 )
 @click.option("--output", required=True, help="path to destination of gds")
-def mag_to_gds_cmd(mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk):
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+@click.option("--incremental", is_flag=True, help="keep the gds of every subcell in the result cache and only stream the cells that changed")
+@click.option("--compress", "compress_gds", type=click.Choice(["gz", "zst"]), required=False, help="write the gds compressed, as <name>.gds.gz or .gds.zst")
+def mag_to_gds_cmd(mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, use_pool, use_cache, incremental, compress_gds):
     console = Console()
-    mag_to_gds(
-        console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk
+    if incremental:
+        if use_cache:
+            abort(console, "--incremental always uses the result cache, leave out --cache")
+        return mag_to_gds_incremental(
+            console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, compress_gds, use_pool=use_pool
+        )
+    return mag_to_gds(
+        console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, compress_gds, use_pool=use_pool, use_cache=use_cache
     )
 
-@click.command("gds-to-mag", help="creates a mag from gds")
+@click.command("gds-to-mag", cls=UtilitiesCommand, help="creates a mag from gds")
 @click.argument("gds_file")
 @click.option("--pdk_root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
 @click.option("--output", required=True, help="path to destination of mag")
-def gds_to_mag_cmd(gds_file, output, pdk_root, pdk):
+@click.option("--top", required=False, help="top cell of the gds (default: detected from the gds)")
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+def gds_to_mag_cmd(gds_file, output, pdk_root, pdk, use_pool, use_cache, top):
     console = Console()
-    gds_to_mag(
-        console, gds_file, output, pdk_root, pdk
+    return gds_to_mag(
+        console, gds_file, output, pdk_root, pdk, use_pool=use_pool, use_cache=use_cache, top=top
     )
 
-@click.command("mag-to-def", help="creates a def from mag")
+@click.command("mag-to-def", cls=UtilitiesCommand, help="creates a def from mag")
 @click.argument("mag_file")
 @click.option("--pdk_root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
@@ -73,53 +129,92 @@ def gds_to_mag_cmd(gds_file, output, pdk_root, pdk):
     "--gds_macro", required=False, help="path to gds to get loaded", multiple=True
 )
 @click.option("--output", required=True, help="path to destination of gds")
-def mag_to_def_cmd(mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk):
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+def mag_to_def_cmd(mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, use_pool, use_cache):
     console = Console()
-    mag_to_def(
-        console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk
+    return mag_to_def(
+        console, mag_file, maglef_macro, mag_dir, gds_macro, output, pdk_root, pdk, use_pool=use_pool, use_cache=use_cache
     )
 
-@click.command("gds-to-def", help="creates a def from gds")
+@click.command("gds-to-def", cls=UtilitiesCommand, help="creates a def from gds")
 @click.argument("gds_file")
 @click.option("--pdk_root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
 @click.option("--output", required=True, help="path to destination of mag")
-def gds_to_def_cmd(gds_file, output, pdk_root, pdk):
+@click.option("--top", required=False, help="top cell of the gds (default: detected from the gds)")
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+def gds_to_def_cmd(gds_file, output, pdk_root, pdk, use_pool, use_cache, top):
     console = Console()
-    gds_to_def(
-        console, gds_file, output, pdk_root, pdk
+    return gds_to_def(
+        console, gds_file, output, pdk_root, pdk, use_pool=use_pool, use_cache=use_cache, top=top
     )
 
-@click.command("drc", help="runs klayout DRC")
+@click.command("drc", cls=UtilitiesCommand, help="runs klayout DRC")
 @click.argument("gds_file")
 @click.option("--output", required=True, help="path to destination output reports")
-def drc_cmd(gds_file, output):
+@click.option("--sharded", is_flag=True, help="run the feol, beol and offgrid decks as parallel klayout runs and merge their reports")
+@click.option("--incremental", is_flag=True, help="only rerun the checks affected by layers changed since the last run")
+@click.option("-j", "--jobs", "processes", type=int, required=False, help="number of parallel klayout runs (default: one per shard)")
+@click.option("--index/--no-index", default=True, help="load the reports into outputs/reports/drc.db for `report query`")
+def drc_cmd(gds_file, output, sharded, incremental, processes, index):
     console = Console()
-    drc(
-        console, gds_file, output
+    return drc(
+        console, gds_file, output, sharded, incremental, processes, index
     )
 
-@click.command("lvs", help="runs LVS")
-@click.argument("design_name")
+@click.command("density", cls=UtilitiesCommand, help="reports the density of layers per window, without klayout (needs numpy)")
+@click.argument("gds_file")
+@click.option("--output", required=True, help="directory receiving <top>.density.csv")
+@click.option("--pdk", required=False, help="pdk family whose density layers and limits are checked (sky130A, sky130B)")
+@click.option("--layer", "layers", multiple=True, help="layer to check as name=layer/datatype[:min[:max]], e.g. met1=68/20:0.7; replaces a pdk layer of the same name")
+@click.option("--top", required=False, help="top cell of the gds (default: detected from the gds)")
+@click.option("--window", type=float, default=WINDOW, show_default=True, help="window size in um")
+@click.option("--step", type=float, required=False, help="window step in um (default: the window size)")
+@click.option("--resolution", type=float, default=RESOLUTION, show_default=True, help="pixel size in um of the coverage raster")
+def density_cmd(gds_file, output, pdk, layers, top, window, step, resolution):
+    console = Console()
+    # density returns the number of windows out of limits
+    return 1 if density(console, gds_file, output, pdk, layers, top, window, step, resolution) else 0
+
+@click.command("lvs", cls=UtilitiesCommand, help="runs LVS of one or more designs")
+@click.argument("design_names", nargs=-1)
+@click.option("--designs", "designs_file", required=False, help="file with more design names, one per line")
 @click.option("--output", required=True, help="path to destination output reports")
 @click.option("--design_dir", required=True, help="path to design directory (should have gds/<design>.gds & verilog/gl/<design>.v)")
 @click.option("--config_file", required=True, help="path to LVS config file")
 @click.option("--pdk_root", required=True, help="path to PDK")
 @click.option("--pdk", required=True, help="PDK family (sky130A, sky130B, etc..)")
 @click.option("--tag", required=False, help="Run tag, if used then it will not extract")
-def lvs_cmd(design_name, output, design_dir, config_file, pdk_root, pdk, tag):
+@click.option("-j", "--jobs", "processes", type=int, required=False, help="number of designs checked in parallel (default: number of cores)")
+def lvs_cmd(design_names, designs_file, output, design_dir, config_file, pdk_root, pdk, tag, processes):
     console = Console()
-    lvs(console, design_dir, output, design_name, config_file, pdk_root, pdk, tag)
+    design_names = list(design_names)
+    if designs_file:
+        if not os.path.exists(designs_file):
+            abort(console, f"{designs_file} path doesn't exist")
+        with open(designs_file) as f:
+            design_names += [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+    if not design_names:
+        abort(console, "no design to check")
+    return lvs(console, design_dir, output, design_names, config_file, pdk_root, pdk, tag, processes)
 
-@click.command("xor", help="runs xor on 2 layouts")
+@click.command("xor", cls=UtilitiesCommand, help="runs xor on 2 layouts")
 @click.argument("design_name")
 @click.option("--design1", required=True, help="path to gds1")
 @click.option("--design2", required=True, help="path to gds2")
-def xor_cmd(design_name, design1, design2):
+@click.option("--prefilter", is_flag=True, help="compare cell hashes first and only xor the cells that differ")
+@click.option("--threads", type=int, required=False, help="klayout threads (default: number of cores)")
+@click.option("--tile-size", type=float, required=False, help="klayout tile size in um (default: about four tiles per thread over the layout extent, at least 100 um); 0 runs flat")
+@click.option("--per-layer", is_flag=True, help="xor groups of layers in parallel klayout processes")
+@click.option("-j", "--jobs", "processes", type=int, required=False, help="number of klayout processes for --per-layer (default: number of cores)")
+@click.option("--index/--no-index", default=True, help="load the differences into <design_name>-xor.db for `report query`")
+def xor_cmd(design_name, design1, design2, prefilter, threads, tile_size, per_layer, processes, index):
     console = Console()
-    xor(console, design_name, design1, design2)
+    return xor(console, design_name, design1, design2, prefilter, threads, tile_size, per_layer, processes, index)
 
-@click.command("def-to-gds", help="creates a gds from def")
+@click.command("def-to-gds", cls=UtilitiesCommand, help="creates a gds from def")
 @click.argument("def-file")
 @click.option("--pdk-root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
@@ -128,42 +223,351 @@ def xor_cmd(design_name, design1, design2):
     "--extra-gds", required=False, help="path of extra gds", multiple=True
 )
 @click.option("--output", required=True, help="path to destination of gds")
-def def_to_gds_cmd(def_file, pdk, pdk_root, output, extra_gds, extra_lef):
+@click.option("--all-macros", is_flag=True, help="hand every extra lef macro and extra gds to magic, not only those the def instantiates")
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+@click.option("--compress", "compress_gds", type=click.Choice(["gz", "zst"]), required=False, help="write the gds compressed, as <name>.gds.gz or .gds.zst")
+def def_to_gds_cmd(def_file, pdk, pdk_root, output, extra_gds, extra_lef, all_macros, use_pool, use_cache, compress_gds):
     console = Console()
-    def_to_gds(console, def_file, pdk, pdk_root, output, extra_gds, extra_lef)
+    return def_to_gds(console, def_file, pdk, pdk_root, output, extra_gds, extra_lef, all_macros, compress_gds, use_pool=use_pool, use_cache=use_cache)
 
-@click.command("def-to-mag", help="creates a mag from def")
+@click.command("def-to-mag", cls=UtilitiesCommand, help="creates a mag from def")
 @click.argument("def-file")
 @click.option("--pdk-root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
 @click.option("--output", required=True, help="path to destination of gds")
-def def_to_mag_cmd(def_file, pdk, pdk_root, output):
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+def def_to_mag_cmd(def_file, pdk, pdk_root, output, use_pool, use_cache):
     console = Console()
-    def_to_mag(console, def_file, pdk, pdk_root, output)
+    return def_to_mag(console, def_file, pdk, pdk_root, output, use_pool=use_pool, use_cache=use_cache)
 
-@click.command("mag-to-lef", help="creates a lef from mag")
+@click.command("mag-to-lef", cls=UtilitiesCommand, help="creates a lef from mag")
 @click.argument("mag-file")
 @click.option("--pdk-root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
 @click.option("--output", required=True, help="path to destination of gds")
-def mag_to_lef_cmd(mag_file, pdk, pdk_root, output):
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+def mag_to_lef_cmd(mag_file, pdk, pdk_root, output, use_pool, use_cache):
     console = Console()
-    mag_to_lef(console, mag_file, pdk, pdk_root, output)
+    return mag_to_lef(console, mag_file, pdk, pdk_root, output, use_pool=use_pool, use_cache=use_cache)
 
-@click.command("gds-to-lef", help="creates a lef from gds")
+@click.command("gds-to-lef", cls=UtilitiesCommand, help="creates a lef from gds")
 @click.argument("gds-file")
 @click.option("--pdk-root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
 @click.option("--output", required=True, help="path to destination of gds")
-def gds_to_lef_cmd(gds_file, pdk, pdk_root, output):
+@click.option("--top", required=False, help="top cell of the gds (default: detected from the gds)")
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+def gds_to_lef_cmd(gds_file, pdk, pdk_root, output, use_pool, use_cache, top):
     console = Console()
-    gds_to_lef(console, gds_file, pdk, pdk_root, output)
+    return gds_to_lef(console, gds_file, pdk, pdk_root, output, use_pool=use_pool, use_cache=use_cache, top=top)
 
-@click.command("def-to-lef", help="creates a lef from def")
+@click.command("def-to-lef", cls=UtilitiesCommand, help="creates a lef from def")
 @click.argument("def-file")
 @click.option("--pdk-root", required=True, help="path to pdk")
 @click.option("--pdk", required=True, help="pdk family")
 @click.option("--output", required=True, help="path to destination of gds")
-def def_to_lef_cmd(def_file, pdk, pdk_root, output):
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+@click.option("--backend", type=click.Choice(["magic", "native"]), default="magic", show_default=True, help="native writes an abstract (pins and blanket obstructions) straight from the def, without magic")
+def def_to_lef_cmd(def_file, pdk, pdk_root, output, use_pool, use_cache, backend):
+    console = Console()
+    if backend == "native":
+        return def_to_lef_native(console, def_file, pdk, pdk_root, output)
+    return def_to_lef(console, def_file, pdk, pdk_root, output, use_pool=use_pool, use_cache=use_cache)
+
+@click.command("convert", cls=UtilitiesCommand, help="creates several views (gds, mag, lef, def) from one gds/mag/def in a single magic session")
+@click.argument("source-file")
+@click.option("--to", "targets", required=True, help="comma separated views to create, e.g. gds,lef")
+@click.option("--from", "source", required=False, type=click.Choice(["gds", "mag", "def"]), help="view of the source (default: from its extension)")
+@click.option("--pdk-root", required=True, help="path to pdk")
+@click.option("--pdk", required=True, help="pdk family")
+@click.option("--maglef-macro", required=False, help="path to maglef to get loaded (mag source)", multiple=True)
+@click.option("--mag-dir", required=False, help="path to mag directory (mag source)", multiple=True)
+@click.option("--gds-macro", required=False, help="path to gds to get loaded (mag source)", multiple=True)
+@click.option("--extra-lef", required=False, help="path to extra lef (def source)", multiple=True)
+@click.option("--extra-gds", required=False, help="path of extra gds (def source)", multiple=True)
+@click.option("--all-macros", is_flag=True, help="hand every extra lef macro and extra gds to magic, not only those the def instantiates")
+@click.option("--output", required=True, help="path to destination of the views")
+@click.option("--top", required=False, help="top cell of the gds (default: detected from the gds)")
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+@click.option("--compress", "compress_gds", type=click.Choice(["gz", "zst"]), required=False, help="write the gds compressed, as <name>.gds.gz or .gds.zst")
+def convert_cmd(source_file, targets, source, pdk_root, pdk, maglef_macro, mag_dir, gds_macro, extra_lef, extra_gds, all_macros, output, use_pool, use_cache, top, compress_gds):
+    console = Console()
+    targets = [target.strip().lower() for target in targets.split(",") if target.strip()]
+    return convert(console, source_file, targets, pdk, pdk_root, output, source, maglef_macro, mag_dir, gds_macro, extra_lef, extra_gds, top=top, all_macros=all_macros, compress_gds=compress_gds, use_pool=use_pool, use_cache=use_cache)
+
+@click.command("gds-info", cls=UtilitiesCommand, help="shows the cells, top cells and size of a gds")
+@click.argument("gds-file")
+def gds_info_cmd(gds_file):
+    console = Console()
+    gds_info(console, gds_file)
+
+@click.command("verify", cls=UtilitiesCommand, help="checks published outputs against their manifests")
+@click.argument("manifests", nargs=-1, required=True)
+def verify_cmd(manifests):
+    console = Console()
+    failed = False
+    for manifest in manifests:
+        try:
+            bad = stage.verify(manifest)
+        except (OSError, ValueError, KeyError) as e:
+            abort(console, f"can't read {manifest} : {e}")
+        if bad:
+            failed = True
+            console.print(f"[red]{manifest} : {', '.join(bad)} missing or changed")
+        else:
+            console.print(f"[green]{manifest} : ok")
+    if failed:
+        return 1
+
+@click.command("batch", cls=UtilitiesCommand, help="runs the jobs of a yaml/json/csv manifest in parallel")
+@click.argument("manifest")
+@click.option("-j", "--jobs", "processes", type=int, required=False, help="number of jobs to run in parallel (default: number of cores)")
+@click.option("--log-dir", required=False, help="write the output of every job to <log-dir>/<job>.log")
+@click.option("--use-pool", is_flag=True, help="run magic in a persistent worker pool")
+@click.option("--cache", "use_cache", is_flag=True, help="reuse outputs of identical earlier runs from the result cache")
+@click.option("--memory-budget", required=False, help="only start jobs while their estimated peak memory fits, e.g. 48G or 80% of the available memory")
+@click.option("--memory-cap/--no-memory-cap", default=True, help="limit the address space of every job to a multiple of its estimate (with --memory-budget)")
+def batch_cmd(manifest, processes, log_dir, use_pool, use_cache, memory_budget, memory_cap):
+    console = Console()
+    jobs = load_manifest(console, manifest)
+    flags = [name for name, enabled in (("use_pool", use_pool), ("use_cache", use_cache)) if enabled]
+    if memory_budget:
+        try:
+            memory_budget = admission.memory_budget(memory_budget)
+        except ValueError:
+            abort(console, f"invalid memory budget {memory_budget}")
+    results = run_batch(console, jobs, processes, log_dir, flags, memory_budget, memory_cap)
+    if any(result["status"] != "ok" for result in results):
+        return 1
+
+@click.command("watch", cls=UtilitiesCommand, help="re-runs the jobs of yaml/json/csv manifests whenever their inputs change")
+@click.argument("manifests", nargs=-1, required=True)
+@click.option("--debounce", type=float, default=0.5, show_default=True, help="seconds without changes before the affected jobs are re-run")
+@click.option("--poll", is_flag=True, help="poll the inputs instead of using inotify")
+@click.option("--initial/--no-initial", default=True, help="run every job once at start")
+def watch_cmd(manifests, debounce, poll, initial):
+    console = Console()
+    jobs = [job for manifest in manifests for job in load_manifest(console, manifest)]
+    watch(console, jobs, debounce, poll, initial)
+
+@click.command("flow", cls=UtilitiesCommand, help="runs the steps of a yaml/json/csv flow in dependency order, skipping those that are up to date")
+@click.argument("flow")
+@click.option("-j", "--jobs", "processes", type=int, required=False, help="number of parallel steps (default: number of cores)")
+@click.option("--log-dir", required=False, help="write the output of every step to <log-dir>/<step>.log")
+@click.option("--state", "state_file", required=False, help="file recording the digests of the steps (default: <flow>.state.json)")
+@click.option("--force", is_flag=True, help="run every step, even those that are up to date")
+@click.option("-n", "--dry-run", is_flag=True, help="only print the steps that would run")
+def flow_cmd(flow, processes, log_dir, state_file, force, dry_run):
+    console = Console()
+    steps = load_flow(console, flow)
+    state_file = state_file or f"{os.path.splitext(flow)[0]}.state.json"
+    results = run_flow(console, steps, state_file, processes, log_dir, force, dry_run)
+    if any(result["status"] not in ("ok", "up to date") for result in results):
+        return 1
+
+@click.group("queue", help="submits jobs to a spool directory run by `utilities worker` processes")
+def queue_group():
+    pass
+
+@queue_group.command("submit", cls=UtilitiesCommand, help="adds the jobs of yaml/json/csv manifests to the queue")
+@click.argument("spool_dir")
+@click.argument("manifests", nargs=-1, required=True)
+def queue_submit_cmd(spool_dir, manifests):
+    console = Console()
+    jobs = [job for manifest in manifests for job in load_manifest(console, manifest)]
+    for job, job_id in zip(jobs, Spool(spool_dir).submit(jobs)):
+        console.print(f"{job_id} {job['name']}")
+
+@queue_group.command("status", cls=UtilitiesCommand, help="lists the jobs of the queue")
+@click.argument("spool_dir")
+@click.option("--all", "show_all", is_flag=True, help="also list the finished jobs")
+def queue_status_cmd(spool_dir, show_all):
     console = Console()
-    def_to_lef(console, def_file, pdk, pdk_root, output)
+    if not os.path.isdir(spool_dir):
+        abort(console, f"{spool_dir} path doesn't exist")
+    jobs = Spool(spool_dir).jobs()
+    counts = {}
+    table = Table(title=spool_dir)
+    for column in ("job", "name", "command", "state", "worker", "attempts", "time (s)"):
+        table.add_column(column, justify="right" if column in ("attempts", "time (s)") else "left")
+    for state, job in jobs:
+        result = job.get("result") or {}
+        status = result.get("status", state)
+        counts[status] = counts.get(status, 0) + 1
+        if state == "done" and not show_all and status == "ok":
+            continue
+        if status == "failed":
+            status = f"[red]failed: {result.get('detail', '')}"
+        duration = f"{result['duration']:.1f}" if "duration" in result else ""
+        table.add_row(job["id"], job["name"], job["command"], status, job.get("worker", ""), str(job.get("attempts", 0)), duration)
+    console.print(table)
+    console.print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "no jobs")
+
+@click.command("worker", cls=UtilitiesCommand, help="runs the jobs of a spool directory, one at a time")
+@click.argument("spool_dir")
+@click.option("--lease", type=float, default=LEASE, show_default=True, help="seconds without heartbeat after which another worker takes a job over")
+@click.option("--max-attempts", type=int, default=MAX_ATTEMPTS, show_default=True, help="runs of a job whose lease expired before it is given up")
+@click.option("--idle-exit", type=float, required=False, help="exit after this many seconds without jobs (default: run forever)")
+def worker_cmd(spool_dir, lease, max_attempts, idle_exit):
+    console = Console()
+    try:
+        count = work(console, spool_dir, lease, max_attempts, idle_exit)
+    except KeyboardInterrupt:
+        return
+    console.print(f"ran {count} jobs")
+
+@click.group("cache", help="inspects and prunes the conversion result cache")
+def cache_group():
+    pass
+
+@cache_group.command("stats", cls=UtilitiesCommand, help="shows the size and usage of the cache")
+@click.option("--cache-dir", required=False, help="path to the cache (default: $UTILITIES_CACHE_DIR or ~/.cache/utilities)")
+def cache_stats_cmd(cache_dir):
+    console = Console()
+    stats = ResultCache(cache_dir).stats()
+    console.print(f"path     : {stats['path']}")
+    console.print(f"entries  : {stats['entries']}")
+    console.print(f"size     : {format_size(stats['size'])} / {format_size(stats['max_size'])}")
+    if stats["entries"]:
+        console.print(f"last use : {time.ctime(stats['oldest_use'])} (oldest), {time.ctime(stats['newest_use'])} (newest)")
+
+@cache_group.command("prune", cls=UtilitiesCommand, help="evicts least recently used entries until the cache fits")
+@click.option("--cache-dir", required=False, help="path to the cache (default: $UTILITIES_CACHE_DIR or ~/.cache/utilities)")
+@click.option("--max-size", type=SizeType(), required=False, help="size to prune down to, e.g. 500M or 10G (default: $UTILITIES_CACHE_SIZE or 10G)")
+def cache_prune_cmd(cache_dir, max_size):
+    console = Console()
+    removed, size = ResultCache(cache_dir).prune(max_size)
+    console.print(f"removed {removed} entries, {format_size(size)} left")
+
+@click.group("report", help="indexes and queries drc and xor results")
+def report_group():
+    pass
+
+@report_group.command("ingest", cls=UtilitiesCommand, help="adds drc reports (lyrdb) and xor results to a result database")
+@click.argument("db_file")
+@click.option("--lyrdb", multiple=True, help="klayout report database, can be repeated")
+@click.option("--xor-gds", multiple=True, help="xor output gds, can be repeated")
+@click.option("--xor-total", multiple=True, help="xor_output.txt, can be repeated")
+def report_ingest_cmd(db_file, lyrdb, xor_gds, xor_total):
+    console = Console()
+    connection = open_db(db_file)
+    try:
+        for path in lyrdb:
+            console.print(f"{path} : {ingest_lyrdb(connection, path)} markers")
+        for path in xor_gds:
+            console.print(f"{path} : {ingest_xor(connection, xor_gds=path)} markers")
+        for path in xor_total:
+            ingest_xor(connection, total_file=path)
+    finally:
+        connection.close()
+
+@report_group.command("query", cls=UtilitiesCommand, help="lists or counts markers of a result database")
+@click.argument("db_file")
+@click.option("--rule", required=False, help="rule name, glob patterns allowed (xor markers use \"xor\")")
+@click.option("--layer", required=False, help="layer, e.g. m1 for drc or 68/20 for xor, glob patterns allowed")
+@click.option("--cell", required=False, help="cell name, glob patterns allowed")
+@click.option("--bbox", required=False, help="only markers overlapping x0,y0,x1,y1 (um)")
+@click.option("--counts", is_flag=True, help="count markers per rule and cell instead of listing them")
+@click.option("--limit", type=int, default=100, help="maximum number of markers listed, 0 lists all")
+def report_query_cmd(db_file, rule, layer, cell, bbox, counts, limit):
+    console = Console()
+    if bbox:
+        try:
+            bbox = [float(value) for value in bbox.split(",")]
+        except ValueError:
+            bbox = []
+        if len(bbox) != 4:
+            console.print("[red]ERROR : --bbox takes x0,y0,x1,y1")
+            return 1
+    # sqlite would create an empty database
+    if not os.path.isfile(db_file):
+        abort(console, f"{db_file} path doesn't exist")
+    connection = open_db(db_file)
+    try:
+        if counts:
+            table = Table(title=db_file)
+            table.add_column("rule")
+            table.add_column("cell")
+            table.add_column("markers", justify="right")
+            for row_rule, row_cell, count in marker_counts(connection, ("rule", "cell"), rule, layer, cell, bbox):
+                table.add_row(row_rule, row_cell or "", str(count))
+        else:
+            table = Table(title=db_file)
+            for column in ("rule", "layer", "cell", "xmin", "ymin", "xmax", "ymax"):
+                table.add_column(column)
+            for row_rule, row_layer, row_cell, *box in query_markers(connection, rule, layer, cell, bbox, limit):
+                # the r-tree keeps 32 bit floats, three decimals are exact enough for nm grids
+                table.add_row(row_rule, row_layer or "", row_cell or "", *("" if value is None else f"{value:.3f}" for value in box))
+    finally:
+        connection.close()
+    console.print(table)
+
+@click.command("stats", cls=UtilitiesCommand, help="summarizes telemetry files written with --telemetry")
+@click.argument("telemetry_files", nargs=-1)
+@click.option("--by", type=click.Choice(["command", "tool", "input", "host"]), default="input", help="what to group the runs by")
+@click.option("--top", type=int, default=20, help="number of groups shown, most wall time first")
+def stats_cmd(telemetry_files, by, top):
+    console = Console()
+    telemetry_files = telemetry_files or [telemetry.telemetry_file()]
+    if not all(telemetry_files):
+        abort(console, "no telemetry file given and $UTILITIES_TELEMETRY is not set")
+    for path in telemetry_files:
+        if not os.path.exists(path):
+            abort(console, f"{path} path doesn't exist")
+    records = telemetry.load(telemetry_files)
+    groups = telemetry.summarize(records, by)
+    total_wall = sum(group["wall"] for _, group in groups) or 1
+    table = Table(title=f"{len(records)} runs by {by}")
+    table.add_column(by)
+    table.add_column("runs", justify="right")
+    table.add_column("failed", justify="right")
+    table.add_column("wall (s)", justify="right")
+    table.add_column("share", justify="right")
+    table.add_column("cpu (s)", justify="right")
+    table.add_column("peak rss", justify="right")
+    table.add_column("in", justify="right")
+    table.add_column("out", justify="right")
+    table.add_column("slowest phases")
+    for name, group in groups[:top]:
+        phases = sorted(group["phases"].items(), key=lambda item: item[1], reverse=True)[:3]
+        table.add_row(
+            name,
+            str(group["runs"]),
+            str(group["failed"]),
+            f"{group['wall']:.1f}",
+            f"{100 * group['wall'] / total_wall:.0f}%",
+            f"{group['cpu']:.1f}",
+            format_size(group["max_rss_kb"] * 1024),
+            format_size(group["input_bytes"]),
+            format_size(group["output_bytes"]),
+            ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in phases),
+        )
+    console.print(table)
+
+
+commands = {
+    command.name: command
+    for command in (
+        mag_to_gds_cmd,
+        gds_to_mag_cmd,
+        mag_to_def_cmd,
+        gds_to_def_cmd,
+        drc_cmd,
+        density_cmd,
+        lvs_cmd,
+        xor_cmd,
+        def_to_gds_cmd,
+        def_to_mag_cmd,
+        mag_to_lef_cmd,
+        gds_to_lef_cmd,
+        def_to_lef_cmd,
+        convert_cmd,
+        gds_info_cmd,
+    )
+}
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming helpers for klayout report databases (lyrdb) and the sqlite
+index that drc and xor results are loaded into for fast queries."""
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+from .gds import iter_shape_boxes
+
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+# marker values made of x,y pairs; float:, text: and the like are not
+GEOMETRY_VALUES = ("polygon", "box", "edge", "edge-pair")
+BATCH = 10000
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ingested REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS markers (
+    id INTEGER PRIMARY KEY,
+    report INTEGER NOT NULL,
+    rule TEXT NOT NULL,
+    layer TEXT,
+    cell TEXT,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS totals (
+    report INTEGER NOT NULL,
+    layer TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS markers_rule ON markers (rule);
+CREATE INDEX IF NOT EXISTS markers_layer ON markers (layer);
+CREATE INDEX IF NOT EXISTS markers_cell ON markers (cell);
+CREATE VIRTUAL TABLE IF NOT EXISTS marker_boxes USING rtree (id, xmin, xmax, ymin, ymax);
+"""
+
+
+def iter_lyrdb(source):
+    """Yields ("category" | "cell" | "item" | tag, element) for the parts of a
+    report database, clearing every element once it has been handled so
+    memory stays flat however many markers the report holds."""
+    context = ET.iterparse(source, events=("start", "end"))
+    _, root = next(context)
+    if root.tag != "report-database":
+        raise ValueError(f"{source} is not a klayout report database")
+    depth = 1
+    section = None
+    section_element = None
+    for event, element in context:
+        if event == "start":
+            depth += 1
+            if depth == 2:
+                section = element.tag
+                section_element = element
+            continue
+        depth -= 1
+        if depth == 1:
+            if section not in ("categories", "cells", "items"):
+                yield section, element
+            root.clear()
+            section = None
+        elif depth == 2:
+            if section == "categories" and element.tag == "category":
+                yield "category", element
+            elif section == "cells" and element.tag == "cell":
+                yield "cell", element
+            elif section == "items" and element.tag == "item":
+                yield "item", element
+                section_element.clear()
+
+
+def is_lyrdb(path):
+    try:
+        for _, element in ET.iterparse(path, events=("start",)):
+            return element.tag == "report-database"
+    except ET.ParseError:
+        return False
+    return False
+
+
+def category_name(item):
+    return (item.findtext("category") or "").strip().strip("'")
+
+
+def count_markers(path):
+    """Number of markers per category of a report database."""
+    return Counter(category_name(element) for kind, element in iter_lyrdb(path) if kind == "item")
+
+
+def merge_lyrdb(sources, destination):
+    """Merges report databases into one and returns, for every source, the
+    number of markers per category.
+
+    Categories and cells are merged by name, items are streamed through a
+    temporary file so the merged report is never held in memory.
+    """
+    header = {}
+    categories = {}
+    cells = {}
+    counts = {}
+    with tempfile.TemporaryFile() as items:
+        for source in sources:
+            source_counts = counts.setdefault(source, Counter())
+            for kind, element in iter_lyrdb(source):
+                if kind == "category":
+                    categories.setdefault(element.findtext("name"), ET.tostring(element))
+                elif kind == "cell":
+                    cells.setdefault(element.findtext("name"), ET.tostring(element))
+                elif kind == "item":
+                    source_counts[category_name(element)] += 1
+                    items.write(ET.tostring(element))
+                elif kind not in header:
+                    header[kind] = ET.tostring(element)
+        items.seek(0)
+        with open(destination, "wb") as f:
+            f.write(b'<?xml version="1.0" encoding="utf-8"?>\n<report-database>\n')
+            for data in header.values():
+                f.write(data)
+            f.write(b"<categories>\n")
+            for data in categories.values():
+                f.write(data)
+            f.write(b"</categories>\n<cells>\n")
+            for data in cells.values():
+                f.write(data)
+            f.write(b"</cells>\n<items>\n")
+            shutil.copyfileobj(items, f)
+            f.write(b"</items>\n</report-database>\n")
+    return counts
+
+
+def value_box(values):
+    """Bounding box of the coordinates in the geometry values of a lyrdb
+    marker (polygons, boxes, edges and edge pairs all list x,y pairs)."""
+    numbers = []
+    for value in values:
+        kind, _, coordinates = value.partition(":")
+        if kind.strip() in GEOMETRY_VALUES:
+            numbers += [float(number) for number in NUMBER.findall(coordinates)]
+    if len(numbers) < 2:
+        return None
+    xs = numbers[0::2]
+    ys = numbers[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def rule_layer(rule):
+    # sky130 rule names start with their layer, e.g. m1.2 or licon.8a
+    return rule.split(".")[0] if "." in rule else None
+
+
+def open_db(path, reset=False):
+    if reset and os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def add_report(connection, path, kind):
+    cursor = connection.execute(
+        "INSERT INTO reports (path, kind, ingested) VALUES (?, ?, ?)",
+        (os.path.abspath(path), kind, time.time()),
+    )
+    return cursor.lastrowid
+
+
+def insert_markers(connection, report, markers):
+    """Inserts (rule, layer, cell, value, box) tuples in batches and returns
+    how many were added."""
+    next_id = connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM markers").fetchone()[0]
+    count = 0
+    rows, boxes = [], []
+    for rule, layer, cell, value, box in markers:
+        rows.append((next_id, report, rule, layer, cell, value))
+        if box:
+            boxes.append((next_id, box[0], box[2], box[1], box[3]))
+        next_id += 1
+        count += 1
+        if len(rows) >= BATCH:
+            connection.executemany("INSERT INTO markers VALUES (?, ?, ?, ?, ?, ?)", rows)
+            connection.executemany("INSERT INTO marker_boxes VALUES (?, ?, ?, ?, ?)", boxes)
+            rows, boxes = [], []
+    connection.executemany("INSERT INTO markers VALUES (?, ?, ?, ?, ?, ?)", rows)
+    connection.executemany("INSERT INTO marker_boxes VALUES (?, ?, ?, ?, ?)", boxes)
+    return count
+
+
+def ingest_lyrdb(connection, path):
+    def markers():
+        for kind, element in iter_lyrdb(path):
+            if kind != "item":
+                continue
+            rule = category_name(element)
+            values = [value.text or "" for value in element.iter("value")]
+            cell = (element.findtext("cell") or "").strip() or None
+            yield rule, rule_layer(rule), cell, "\n".join(values), value_box(values)
+
+    with connection:
+        report = add_report(connection, path, "drc")
+        return insert_markers(connection, report, markers())
+
+
+def ingest_xor(connection, xor_gds=None, total_file=None):
+    """Loads the shapes of an xor output gds as markers of rule "xor" and the
+    per layer counts of its xor_output.txt into totals."""
+    count = 0
+    with connection:
+        if xor_gds and os.path.exists(xor_gds):
+            report = add_report(connection, xor_gds, "xor")
+            count = insert_markers(
+                connection,
+                report,
+                (("xor", layer, cell, None, box) for cell, layer, box in iter_shape_boxes(xor_gds)),
+            )
+        if total_file and os.path.exists(total_file):
+            report = add_report(connection, total_file, "xor-total")
+            with open(total_file) as f:
+                total = f.readline().strip()
+                rows = [(report, "total", int(total or 0))]
+                for line in f:
+                    if line.strip():
+                        layer, layer_count = line.split()
+                        rows.append((report, layer, int(layer_count)))
+            connection.executemany("INSERT INTO totals VALUES (?, ?, ?)", rows)
+    return count
+
+
+def marker_filter(rule=None, layer=None, cell=None, bbox=None):
+    """SQL conditions for marker queries; rule, layer and cell take glob
+    patterns and bbox selects markers overlapping (x0, y0, x1, y1)."""
+    conditions, parameters = [], []
+    for column, pattern in (("rule", rule), ("layer", layer), ("cell", cell)):
+        if pattern:
+            conditions.append(f"markers.{column} GLOB ?")
+            parameters.append(pattern)
+    if bbox:
+        conditions.append(
+            "markers.id IN (SELECT id FROM marker_boxes WHERE xmax >= ? AND xmin <= ? AND ymax >= ? AND ymin <= ?)"
+        )
+        parameters += [bbox[0], bbox[2], bbox[1], bbox[3]]
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def query_markers(connection, rule=None, layer=None, cell=None, bbox=None, limit=None):
+    where, parameters = marker_filter(rule, layer, cell, bbox)
+    sql = (
+        "SELECT markers.rule, markers.layer, markers.cell, b.xmin, b.ymin, b.xmax, b.ymax"
+        " FROM markers LEFT JOIN marker_boxes AS b ON b.id = markers.id" + where + " ORDER BY markers.id"
+    )
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return connection.execute(sql, parameters).fetchall()
+
+
+def marker_counts(connection, group_by=("rule", "cell"), rule=None, layer=None, cell=None, bbox=None):
+    columns = ", ".join(f"markers.{column}" for column in group_by)
+    where, parameters = marker_filter(rule, layer, cell, bbox)
+    sql = f"SELECT {columns}, COUNT(*) FROM markers{where} GROUP BY {columns} ORDER BY COUNT(*) DESC"
+    return connection.execute(sql, parameters).fetchall()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Job queue in a spool directory shared over NFS.
+
+A job is a json file that moves from `pending/` to `running/` to `done/`.
+Moves are renames, which are atomic on a single file system, so exactly one
+worker claims a job. The worker holding a job touches its file in
+`running/` as a heartbeat; a job whose file was not touched within the
+lease is moved back to `pending/` by any other worker. Ages are measured
+against the mtime of a file the worker just wrote, i.e. against the clock
+of the file server, not against the clocks of the hosts.
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+from .cache import write_atomic
+
+STATES = ("pending", "running", "done")
+LEASE = 60
+MAX_ATTEMPTS = 3
+
+
+class Spool:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        for state in (*STATES, "logs"):
+            os.makedirs(os.path.join(self.root, state), exist_ok=True)
+
+    def path(self, state, job_id):
+        return os.path.join(self.root, state, f"{job_id}.json")
+
+    def ids(self, state):
+        return sorted(name[:-5] for name in os.listdir(os.path.join(self.root, state)) if name.endswith(".json") and not name.startswith("."))
+
+    def read(self, state, job_id):
+        try:
+            with open(self.path(state, job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # moved by another worker in the meantime
+            return None
+
+    def write(self, state, job):
+        write_atomic(self.path(state, job["id"]), json.dumps(job, indent=1))
+
+    def move(self, job_id, source, destination):
+        try:
+            os.rename(self.path(source, job_id), self.path(destination, job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clock(self):
+        return os.path.join(self.root, f".clock-{socket.gethostname()}-{os.getpid()}")
+
+    def now(self):
+        """Current time of the file server."""
+        with open(self.clock(), "w"):
+            pass
+        return os.stat(self.clock()).st_mtime
+
+    def submit(self, jobs):
+        ids = []
+        stamp = time.time_ns()
+        for index, job in enumerate(jobs):
+            # ids sort in submission order, so pending jobs run first come first served
+            job_id = f"{stamp:x}-{index:05d}-{socket.gethostname()}-{os.getpid()}"
+            self.write("pending", dict(job, id=job_id, cwd=os.getcwd(), attempts=0, submitted=time.time()))
+            ids.append(job_id)
+        return ids
+
+    def claim(self, worker):
+        """Moves the oldest pending job to running and returns it, or None."""
+        for job_id in self.ids("pending"):
+            if self.move(job_id, "pending", "running"):
+                # a rename keeps the mtime, which would look like an expired lease
+                self.heartbeat({"id": job_id})
+                job = self.read("running", job_id)
+                if job is None:
+                    continue
+                job.update(worker=worker, attempts=job.get("attempts", 0) + 1, started=time.time())
+                self.write("running", job)
+                return job
+        return None
+
+    def owns(self, job, worker):
+        current = self.read("running", job["id"])
+        return current is not None and current.get("worker") == worker and current.get("attempts") == job["attempts"]
+
+    def finish(self, job, worker, result):
+        """Moves a job to done with its result, unless its lease expired and
+        another worker took it over. Returns whether it did."""
+        if not self.owns(job, worker):
+            return False
+        self.write("running", dict(job, result=result, finished=time.time()))
+        return self.move(job["id"], "running", "done")
+
+    def heartbeat(self, job):
+        try:
+            os.utime(self.path("running", job["id"]))
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        """Moves the running jobs whose lease expired back to pending, or to
+        done as failed after max_attempts. Returns their ids."""
+        now = self.now()
+        expired = []
+        for job_id in self.ids("running"):
+            try:
+                age = now - os.stat(self.path("running", job_id)).st_mtime
+            except FileNotFoundError:
+                continue
+            if age < lease:
+                continue
+            job = self.read("running", job_id)
+            if job is None:
+                continue
+            if job.get("attempts", 0) >= max_attempts:
+                job["result"] = {"status": "failed", "detail": f"lease expired {job['attempts']} times, last on {job.get('worker')}", "duration": 0.0}
+                self.write("running", job)
+                moved = self.move(job_id, "running", "done")
+            else:
+                moved = self.move(job_id, "running", "pending")
+            if moved:
+                expired.append(job_id)
+        return expired
+
+    def jobs(self):
+        """Returns (state, job) of every job."""
+        return [(state, job) for state in STATES for job in (self.read(state, job_id) for job_id in self.ids(state)) if job]
+
+
+class Heartbeat:
+    """Touches the file of a running job every interval seconds."""
+
+    def __init__(self, spool, job, interval):
+        self.spool = spool
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.spool.heartbeat(self.job)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def work(console, root, lease=LEASE, max_attempts=MAX_ATTEMPTS, idle_exit=None, poll=2.0):
+    """Runs jobs of the spool one at a time until it stays empty for
+    idle_exit seconds, or forever without idle_exit. Returns the number of
+    jobs run."""
+    spool = Spool(root)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    console.print(f"worker {worker} on {spool.root}")
+    try:
+        return work_loop(console, spool, worker, lease, max_attempts, idle_exit, poll)
+    finally:
+        if os.path.exists(spool.clock()):
+            os.remove(spool.clock())
+
+
+def work_loop(console, spool, worker, lease, max_attempts, idle_exit, poll):
+    from .batch import run_job
+
+    cwd = os.getcwd()
+    idle_since = time.time()
+    count = 0
+    while True:
+        for job_id in spool.requeue_expired(lease, max_attempts):
+            console.print(f"[yellow]lease of {job_id} expired[/yellow]")
+        job = spool.claim(worker)
+        if job is None:
+            if idle_exit is not None and time.time() - idle_since >= idle_exit:
+                return count
+            time.sleep(poll)
+            continue
+        console.print(f"[cyan]running[/cyan] {job['name']} ({job['id']}, attempt {job['attempts']})")
+        log_dir = os.path.join(spool.root, "logs", job["id"])
+        os.makedirs(log_dir, exist_ok=True)
+        try:
+            os.chdir(job.get("cwd") or cwd)
+            with Heartbeat(spool, job, lease / 3):
+                result = run_job(job, log_dir)
+        finally:
+            os.chdir(cwd)
+        result["worker"] = worker
+        if spool.finish(job, worker, result):
+            color = "green" if result["status"] == "ok" else "red"
+            console.print(f"[{color}]{result['status']}[/{color}] {job['name']} ({result['duration']:.1f}s)")
+        else:
+            console.print(f"[yellow]dropped the result of {job['name']}, its lease expired[/yellow]")
+        count += 1
+        idle_since = time.time()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Publishing of outputs written into local scratch.
+
+A magic job writes into a scratch directory of its own. After a successful
+run every file is copied once into the output directory under a hidden
+name and renamed into place, so the output directory never holds a
+truncated file. A manifest with the size and sha256 of every file is
+written last. It holds no timestamp: outputs are often inputs of the next
+step, and an identical rerun has to leave their content unchanged.
+"""
+import hashlib
+import json
+import os
+
+from .cache import write_atomic
+
+CHUNK = 1 << 20
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def copy_hashed(source, destination):
+    """Copies source to destination through a hidden file and a rename.
+    Returns the size and sha256 of the file."""
+    partial = os.path.join(os.path.dirname(destination), f".{os.path.basename(destination)}.{os.getpid()}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(source, "rb") as f, open(partial, "wb") as out:
+            for data in iter(lambda: f.read(CHUNK), b""):
+                digest.update(data)
+                out.write(data)
+                size += len(data)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(partial, destination)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return size, digest.hexdigest()
+
+
+def staged_files(scratch):
+    """Relative paths of the files in scratch, without hidden ones."""
+    files = []
+    for root, directories, names in os.walk(scratch):
+        directories[:] = sorted(directory for directory in directories if not directory.startswith("."))
+        files += [os.path.relpath(os.path.join(root, name), scratch) for name in sorted(names) if not name.startswith(".")]
+    return files
+
+
+def publish(scratch, output, manifest, details=None):
+    """Publishes the files of scratch into output and writes the manifest.
+    Returns the published paths."""
+    files = {}
+    published = []
+    for name in staged_files(scratch):
+        destination = os.path.join(output, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        size, sha256 = copy_hashed(os.path.join(scratch, name), destination)
+        files[name] = {"size": size, "sha256": sha256}
+        published.append(destination)
+    write_atomic(manifest, json.dumps(dict(details or {}, files=files), indent=1))
+    return published
+
+
+def verify(manifest):
+    """Returns the files of a manifest that are missing or differ from it."""
+    with open(manifest) as f:
+        files = json.load(f)["files"]
+    output = os.path.dirname(os.path.abspath(manifest))
+    bad = []
+    for name, entry in files.items():
+        digest = hashlib.sha256()
+        try:
+            with open(os.path.join(output, name), "rb") as f:
+                for data in iter(lambda: f.read(CHUNK), b""):
+                    digest.update(data)
+        except OSError:
+            bad.append(name)
+            continue
+        if digest.hexdigest() != entry["sha256"]:
+            bad.append(name)
+    return bad
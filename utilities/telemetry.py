@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Resource telemetry of the magic and klayout runs.
+
+When $UTILITIES_TELEMETRY names a file (`utilities --telemetry <file>`),
+every tool run appends one JSON line to it with its wall and cpu time, the
+peak RSS of its process tree, input and output sizes and the phases marked
+in the helper scripts (see logs.run_tool and helper_lib/phase.tcl).
+"""
+import fcntl
+import json
+import os
+import time
+from collections import defaultdict
+
+import click
+from click.globals import pop_context, push_context
+
+
+def telemetry_file():
+    return os.environ.get("UTILITIES_TELEMETRY") or None
+
+
+def current_command():
+    ctx = click.get_current_context(silent=True)
+    return ctx.info_name if ctx else None
+
+
+def keep_command(function):
+    """Wraps function for worker threads so that records written from them
+    still name the command of the thread that started them."""
+    ctx = click.get_current_context(silent=True)
+    if ctx is None:
+        return function
+
+    def run(*args, **kwargs):
+        push_context(ctx)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            pop_context()
+    return run
+
+
+def path_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if os.path.isfile(os.path.join(path, name)))
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def sizes(paths):
+    return {path: path_size(path) for path in paths if path}
+
+
+def record(tool, inputs=(), outputs=(), **fields):
+    """Appends one record to the telemetry file."""
+    destination = telemetry_file()
+    if not destination:
+        return
+    input_sizes = sizes(inputs)
+    output_sizes = sizes(outputs)
+    entry = {
+        "time": time.time(),
+        "command": current_command(),
+        "tool": tool,
+        "input": next(iter(input_sizes), None),
+        "input_bytes": sum(input_sizes.values()),
+        "outputs": output_sizes,
+        "output_bytes": sum(output_sizes.values()),
+        "host": os.uname().nodename,
+    }
+    entry.update(fields)
+    line = json.dumps(entry) + "\n"
+    with open(destination, "a") as f:
+        # one locked write per record keeps parallel batch jobs from interleaving
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load(paths):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+    return records
+
+
+def summarize(records, by="command"):
+    """Aggregates records per `by` value (command, tool, input or host),
+    most expensive first."""
+    groups = {}
+    for entry in records:
+        key = entry.get(by) or "-"
+        group = groups.setdefault(key, {
+            "runs": 0, "failed": 0, "wall": 0.0, "cpu": 0.0, "max_rss_kb": 0,
+            "input_bytes": 0, "output_bytes": 0, "phases": defaultdict(float),
+        })
+        group["runs"] += 1
+        group["failed"] += 1 if entry.get("returncode") else 0
+        group["wall"] += entry.get("wall") or 0
+        group["cpu"] += entry.get("cpu") or 0
+        group["max_rss_kb"] = max(group["max_rss_kb"], entry.get("max_rss_kb") or 0)
+        group["input_bytes"] += entry.get("input_bytes") or 0
+        group["output_bytes"] += entry.get("output_bytes") or 0
+        for name, seconds in (entry.get("phases") or {}).items():
+            group["phases"][name] += seconds
+    return sorted(groups.items(), key=lambda item: item[1]["wall"], reverse=True)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# Copyright 2022 Efabless Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Re-runs the jobs of batch manifests whenever their inputs change.
+
+The directories of the inputs are watched with inotify (through ctypes,
+or by polling where inotify is not available), since editors often save
+by writing a new file and renaming it over the old one. Each job runs as
+its own `python -m utilities` process, in its own session so that a
+newer edit can kill it together with its magic or klayout children.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+from .batch import job_args, job_inputs
+from .common import UtilitiesError
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+# IN_MODIFY comes in bursts during a write, the close is enough
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"can't watch {directory}")
+        self.directories[wd] = directory
+
+    def wait(self, timeout):
+        """Returns the paths that changed within timeout seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        paths = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return paths
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if wd in self.directories:
+                    paths.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """Stand-in for Inotify that compares directory listings."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.directories = {}
+
+    def scan(self, directory):
+        state = {}
+        try:
+            for entry in os.scandir(directory):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                state[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            pass
+        return state
+
+    def add(self, directory):
+        self.directories[directory] = self.scan(directory)
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            paths = set()
+            for directory, old in self.directories.items():
+                new = self.scan(directory)
+                paths.update(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+                self.directories[directory] = new
+            remaining = deadline - time.time()
+            if paths or remaining <= 0:
+                return paths
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class WatchedJob:
+    def __init__(self, command, job):
+        self.job = job
+        self.name = job["name"]
+        self.args = [sys.executable, "-m", "utilities", command.name, *job_args(command, job)]
+        self.files, self.directories = job_inputs(job)
+        output = job["options"].get("output")
+        self.output = os.path.abspath(str(output)) if output else None
+        self.extension = os.path.splitext(str(job.get("input") or ""))[1]
+        self.process = None
+        self.start = None
+
+    def affected_by(self, path):
+        if path in self.files:
+            return True
+        directory, name = os.path.split(path)
+        if directory not in self.directories or name.startswith("."):
+            return False
+        if self.output and (path == self.output or path.startswith(self.output + os.sep)):
+            # what the job writes is no edit; no command writes files with
+            # the extension of its input, e.g. the subcells of a .mag
+            return bool(self.extension) and path.endswith(self.extension)
+        return True
+
+    def run(self, console):
+        if self.process is not None:
+            self.cancel(console, "its inputs changed")
+        console.print(f"[cyan]running[/cyan] {self.name}")
+        self.start = time.time()
+        self.process = subprocess.Popen(self.args, start_new_session=True)
+
+    def cancel(self, console, reason):
+        console.print(f"[yellow]cancelled[/yellow] {self.name}, {reason}")
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        except ProcessLookupError:
+            self.process.wait()
+        self.process = None
+
+    def poll(self, console):
+        if self.process is None or self.process.poll() is None:
+            return
+        color = "green" if self.process.returncode == 0 else "red"
+        status = "ok" if self.process.returncode == 0 else f"failed (exit code {self.process.returncode})"
+        console.print(f"[{color}]{status}[/{color}] {self.name} ({time.time() - self.start:.1f}s)")
+        self.process = None
+
+
+def watch(console, jobs, debounce=0.5, poll=False, initial=True):
+    from .manage import commands
+
+    watched = []
+    for job in jobs:
+        if job["command"] not in commands:
+            raise UtilitiesError(f"unknown command {job['command']}")
+        watched.append(WatchedJob(commands[job["command"]], job))
+    watcher = None
+    if not poll:
+        try:
+            watcher = Inotify()
+        except OSError as e:
+            console.print(f"[yellow]WARNING : {e}, polling instead")
+    watcher = watcher or Poller()
+    directories = set()
+    for job in watched:
+        directories |= job.directories | {os.path.dirname(path) for path in job.files}
+    for directory in sorted(directories):
+        watcher.add(directory)
+    console.print(f"watching {len(directories)} directories for {len(watched)} jobs, ctrl-c to stop")
+    try:
+        if initial:
+            for job in watched:
+                job.run(console)
+        while True:
+            changed = watcher.wait(0.2)
+            for job in watched:
+                job.poll(console)
+            if not changed:
+                continue
+            # an editor saving, or a tool writing a whole library, is one change
+            while True:
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+            for job in watched:
+                if any(job.affected_by(path) for path in changed):
+                    job.run(console)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for job in watched:
+            if job.process is not None:
+                job.cancel(console, "stopping")
+        watcher.close()